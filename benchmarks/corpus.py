@@ -0,0 +1,72 @@
+"""
+Synthetic PDF corpus for the benchmarks.
+Documents are generated with reportlab and kept in benchmarks/.corpus, so that they are only
+generated once per machine.
+"""
+
+import os
+import shutil
+from typing import List, Tuple
+
+from reportlab.lib.pagesizes import A3, A4, A5, LEGAL, LETTER
+from reportlab.pdfgen import canvas
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), ".corpus")
+
+STANDARD_PAGE_SIZES = [A4, LETTER, A3, A5, LEGAL]
+
+LINES_PER_PAGE = 40
+
+
+def get_page_sizes(distinct_page_sizes: int) -> List[Tuple[float, float]]:
+    """Return distinct page sizes, starting with the standard ones."""
+    page_sizes = STANDARD_PAGE_SIZES[:distinct_page_sizes]
+    for i in range(distinct_page_sizes - len(page_sizes)):
+        page_sizes.append((A4[0] + 10 * (i + 1), A4[1]))
+    return page_sizes
+
+
+def generate_document(path: str, pages: int, distinct_page_sizes: int = 1):
+    """Generate a document with text on each page, cycling through the page sizes."""
+    page_sizes = get_page_sizes(distinct_page_sizes)
+    pdf = canvas.Canvas(path)
+    for page in range(pages):
+        width, height = page_sizes[page % len(page_sizes)]
+        pdf.setPageSize((width, height))
+        pdf.setFont("Helvetica", 10)
+        for line in range(LINES_PER_PAGE):
+            pdf.drawString(
+                40,
+                height - 40 - 14 * line,
+                f"Page {page + 1}, line {line + 1}: the quick brown fox jumps over the lazy dog.",
+            )
+        pdf.showPage()
+    pdf.save()
+
+
+def get_corpus(pages: int, distinct_page_sizes: int = 1, files: int = 1) -> str:
+    """
+    Return the path of a corpus, generating it if needed.
+
+    Returns:
+        The path of the document when files is 1, and otherwise the path of a directory holding
+        files copies of the document.
+    """
+    name = f"{pages}p-{distinct_page_sizes}s"
+    document = os.path.join(CORPUS_DIR, f"{name}.pdf")
+    if not os.path.isfile(document):
+        os.makedirs(CORPUS_DIR, exist_ok=True)
+        generate_document(document + ".tmp", pages, distinct_page_sizes)
+        os.replace(document + ".tmp", document)
+
+    if files == 1:
+        return document
+
+    directory = os.path.join(CORPUS_DIR, f"{name}-{files}f")
+    if not os.path.isdir(directory):
+        os.makedirs(directory + ".tmp", exist_ok=True)
+        for i in range(files):
+            shutil.copyfile(document, os.path.join(directory + ".tmp", f"{i}.pdf"))
+        os.replace(directory + ".tmp", directory)
+
+    return directory
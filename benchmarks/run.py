@@ -0,0 +1,290 @@
+"""
+Benchmarks for pdf-watermark.
+
+Each case watermarks a synthetic corpus in a separate process, and reports the throughput in pages
+per second, the peak resident memory and the size of the output. Results can be saved as a baseline
+and later runs compared against it.
+
+Usage, from the root of the repository:
+    python -m benchmarks.run                     # quick suite, compared to the baseline if any
+    python -m benchmarks.run --suite full        # includes documents of up to 50k pages
+    python -m benchmarks.run --save-baseline     # record the baseline of this machine
+    python -m benchmarks.run --case grid-text-100p
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional
+
+from benchmarks.corpus import get_corpus
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+IMAGE_WATERMARK = "images/image.png"
+
+# Relative changes tolerated before a result is reported as a regression
+DEFAULT_TOLERANCE = 0.2
+
+
+@dataclass
+class Case:
+    name: str
+    command: str = "grid"
+    pages: int = 100
+    distinct_page_sizes: int = 1
+    files: int = 1
+    image: bool = False
+    workers: int = 1
+    executor: str = "thread"
+    merge_mode: str = "content"
+    unselectable: bool = False
+    save_as_image: bool = False
+    dpi: int = 100
+
+    @property
+    def requires_poppler(self) -> bool:
+        return self.unselectable or self.save_as_image
+
+
+QUICK_SUITE = [
+    Case("grid-text-1p", pages=1),
+    Case("grid-text-100p"),
+    Case("insert-text-100p", command="insert"),
+    Case("grid-image-100p", image=True),
+    Case("insert-image-100p", command="insert", image=True),
+    Case("grid-text-100p-5sizes", distinct_page_sizes=5),
+    Case("grid-text-100p-xobject", merge_mode="xobject"),
+    Case("grid-text-50files", pages=10, files=50),
+    Case("grid-text-50files-4threads", pages=10, files=50, workers=4),
+    Case(
+        "grid-text-50files-4processes",
+        pages=10,
+        files=50,
+        workers=4,
+        executor="process",
+    ),
+    Case("grid-text-unselectable-20p", pages=20, unselectable=True),
+    Case("grid-text-save-as-image-20p", pages=20, save_as_image=True),
+]
+
+FULL_SUITE = QUICK_SUITE + [
+    Case("grid-text-5000p", pages=5000),
+    Case("grid-text-5000p-20sizes", pages=5000, distinct_page_sizes=20),
+    Case("grid-text-50000p", pages=50000),
+    Case("insert-text-50000p", command="insert", pages=50000),
+    Case("grid-text-50000p-xobject", pages=50000, merge_mode="xobject"),
+    Case("grid-image-5000p", pages=5000, image=True),
+    Case("grid-text-1000files", pages=5, files=1000),
+    Case(
+        "grid-text-1000files-processes",
+        pages=5,
+        files=1000,
+        workers=os.cpu_count() or 1,
+        executor="process",
+    ),
+    Case("grid-text-save-as-image-200p", pages=200, save_as_image=True),
+]
+
+SUITES = {"quick": QUICK_SUITE, "full": FULL_SUITE}
+
+
+def get_peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows
+        return None
+
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def get_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(directory, file))
+        for directory, _, files in os.walk(path)
+        for file in files
+    )
+
+
+def run_case_in_process(case: Case) -> Dict:
+    """Watermark the corpus of a case in the current process. This runs in a child process."""
+    from pdf_watermark.handler import add_watermark_from_options
+    from pdf_watermark.options import (
+        DrawingOptions,
+        FilesOptions,
+        GridOptions,
+        InsertOptions,
+    )
+
+    corpus = get_corpus(case.pages, case.distinct_page_sizes, case.files)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output = os.path.join(temp_dir, "output.pdf" if case.files == 1 else "output")
+
+        start = time.perf_counter()
+        add_watermark_from_options(
+            FilesOptions(
+                corpus,
+                output,
+                workers=case.workers,
+                executor=case.executor,
+                verbose=False,
+            ),
+            DrawingOptions(
+                watermark=IMAGE_WATERMARK if case.image else "CONFIDENTIAL",
+                merge_mode=case.merge_mode,
+                unselectable=case.unselectable,
+                save_as_image=case.save_as_image,
+                dpi=case.dpi,
+            ),
+            GridOptions() if case.command == "grid" else InsertOptions(),
+        )
+        seconds = time.perf_counter() - start
+        output_size = get_size(output)
+
+    return {
+        "seconds": seconds,
+        "pages_per_second": case.pages * case.files / seconds,
+        "peak_rss_mb": get_peak_rss_mb(),
+        "output_mb": output_size / (1024 * 1024),
+    }
+
+
+def run_case(case: Case, repeat: int) -> Dict:
+    """Run a case in fresh processes, so that caches and memory peaks are not shared between cases."""
+    # The corpus is generated outside of the measured runs
+    get_corpus(case.pages, case.distinct_page_sizes, case.files)
+
+    results = []
+    for _ in range(repeat):
+        completed = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.run",
+                "--child",
+                json.dumps(asdict(case)),
+            ],
+            cwd=ROOT,
+            env={**os.environ, "PYTHONPATH": os.path.join(ROOT, "src")},
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        results.append(json.loads(completed.stdout.splitlines()[-1]))
+
+    # The fastest run is the least disturbed by the rest of the system
+    return min(results, key=lambda result: result["seconds"])
+
+
+def compare(
+    name: str, result: Dict, baseline: Dict[str, Dict], tolerance: float
+) -> List[str]:
+    """Return the regressions of a result with respect to the baseline."""
+    if name not in baseline:
+        return []
+
+    reference = baseline[name]
+    regressions = []
+    if result["pages_per_second"] < reference["pages_per_second"] * (1 - tolerance):
+        regressions.append("pages/s")
+    for metric in ("peak_rss_mb", "output_mb"):
+        if result[metric] is not None and reference.get(metric) is not None:
+            if result[metric] > reference[metric] * (1 + tolerance):
+                regressions.append(metric)
+    return regressions
+
+
+def format_change(value: Optional[float], reference: Optional[float]) -> str:
+    if value is None or reference is None or reference == 0:
+        return ""
+    return f"({(value - reference) / reference:+.0%})"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run the pdf-watermark benchmarks.")
+    parser.add_argument("--suite", choices=SUITES, default="quick")
+    parser.add_argument("--case", action="append", help="Only run the named cases.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--output", help="Save the results to this JSON file.")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child is not None:
+        print(json.dumps(run_case_in_process(Case(**json.loads(args.child)))))
+        return 0
+
+    cases = SUITES[args.suite]
+    if args.case:
+        cases = [case for case in FULL_SUITE if case.name in args.case]
+
+    baseline = {}
+    if os.path.isfile(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    has_poppler = shutil.which("pdftoppm") is not None
+    results = {}
+    regressions = {}
+    print(f"{'case':<34} {'pages/s':>16} {'peak RSS (MB)':>20} {'output (MB)':>20}")
+    for case in cases:
+        if case.requires_poppler and not has_poppler:
+            print(f"{case.name:<34} skipped, poppler is not installed")
+            continue
+
+        result = run_case(case, args.repeat)
+        results[case.name] = result
+        regressions[case.name] = compare(case.name, result, baseline, args.tolerance)
+
+        reference = baseline.get(case.name, {})
+        columns = [
+            f"{result[metric]:.1f} {format_change(result[metric], reference.get(metric))}"
+            if result[metric] is not None
+            else "n/a"
+            for metric in ("pages_per_second", "peak_rss_mb", "output_mb")
+        ]
+        flag = (
+            "  REGRESSION: " + ", ".join(regressions[case.name])
+            if regressions[case.name]
+            else ""
+        )
+        print(
+            f"{case.name:<34} {columns[0]:>16} {columns[1]:>20} {columns[2]:>20}{flag}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        # Cases that were not run keep their previous baseline
+        if os.path.isfile(args.baseline):
+            with open(args.baseline) as f:
+                results = {**json.load(f), **results}
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+
+    return 1 if any(regressions.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,25 @@
+from importlib import import_module
+
+# The public API is imported on first access, so that importing the command line interface
+# does not load the PDF libraries.
+_EXPORTS = {
+    "add_timing_hook": "pdf_watermark.profiling",
+    "add_watermark_to_bytes": "pdf_watermark.handler",
+    "add_watermark_to_pdf": "pdf_watermark.handler",
+    "DrawingOptions": "pdf_watermark.options",
+    "GridOptions": "pdf_watermark.options",
+    "InsertOptions": "pdf_watermark.options",
+    "remove_timing_hook": "pdf_watermark.profiling",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(import_module(_EXPORTS[name]), name)
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
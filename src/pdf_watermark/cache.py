@@ -0,0 +1,195 @@
+"""
+Caching utilities for pdf-watermark.
+Rendered watermark stamps are shared by all the files processed in the same process, and rasterized
+stamps can also be kept on disk for the next runs.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import fields, is_dataclass
+from typing import Callable, Collection, Dict, Hashable, Optional
+
+# Fields that change how the document is written but not how a stamp looks. save_as_image is not
+# one of them, since --unselectable stamps are only rasterized when the pages are not.
+NON_STAMP_FIELDS = {
+    "merge_mode",
+    "incremental",
+    "compress",
+    "compression_level",
+    "deduplicate",
+    "max_raster_memory",
+    "raster_workers",
+    "persistent_stamp_cache",
+}
+
+DEFAULT_STAMP_CACHE_SIZE = 64
+
+# Overrides the directory of the caches persisted between runs
+CACHE_DIR_ENV = "PDF_WATERMARK_CACHE_DIR"
+
+
+def get_cache_dir() -> str:
+    """
+    Directory of the caches persisted between runs.
+
+    This is the PDF_WATERMARK_CACHE_DIR environment variable when it is set, and a pdf-watermark
+    folder in the user cache directory otherwise. The directory may not exist yet.
+    """
+    cache_dir = os.environ.get(CACHE_DIR_ENV)
+    if cache_dir:
+        return cache_dir
+
+    user_cache_dir = (
+        os.environ.get("XDG_CACHE_HOME")
+        or os.environ.get("LOCALAPPDATA")
+        or os.path.join(os.path.expanduser("~"), ".cache")
+    )
+    return os.path.join(user_cache_dir, "pdf-watermark")
+
+
+def atomic_write(path: str, data: bytes):
+    # Several processes may write the same file, each one writes its own temporary file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(file_descriptor, "wb") as f:
+            f.write(data)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+def options_fingerprint(
+    *options_objects, exclude: Collection[str] = NON_STAMP_FIELDS
+) -> str:
+    """
+    Compute a stable fingerprint of the options that affect the rendered stamp.
+
+    Args:
+        options_objects: Dataclass instances such as DrawingOptions, GridOptions or InsertOptions
+        exclude: Names of the fields left out of the fingerprint
+
+    Returns:
+        A hexadecimal digest that changes whenever one of the stamp options changes.
+    """
+    digest = hashlib.sha256()
+    for options in options_objects:
+        if not is_dataclass(options):
+            raise TypeError(f"Cannot fingerprint non-dataclass object {options!r}.")
+
+        digest.update(type(options).__name__.encode())
+        for field in fields(options):
+            if field.name in exclude:
+                continue
+            digest.update(f"{field.name}={getattr(options, field.name)!r};".encode())
+
+        # Images created from memory have no path in the watermark field
+        image_data = getattr(options, "image_data", None)
+        if image_data is not None:
+            digest.update(image_data)
+
+    return digest.hexdigest()
+
+
+class StampCache:
+    """
+    Thread-safe LRU cache of rendered watermark stamps.
+
+    Stamps are stored as the bytes of a one-page PDF, so that each document can parse its own
+    copy without sharing pypdf objects between threads.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_STAMP_CACHE_SIZE):
+        self.max_size = max_size
+        self._stamps: OrderedDict[Hashable, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending: Dict[Hashable, threading.Lock] = {}
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        with self._lock:
+            stamp = self._stamps.get(key)
+            if stamp is not None:
+                self._stamps.move_to_end(key)
+            return stamp
+
+    def put(self, key: Hashable, stamp: bytes) -> None:
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            self._stamps[key] = stamp
+            self._stamps.move_to_end(key)
+            while len(self._stamps) > self.max_size:
+                self._stamps.popitem(last=False)
+
+    def get_or_create(self, key: Hashable, create: Callable[[], bytes]) -> bytes:
+        """
+        Return the stamp stored for key, creating it with create if it is not cached yet.
+
+        Threads asking for the same missing stamp wait for the first one to create it, so that
+        each stamp is only rendered once, even when many files with the same page size start
+        at the same time.
+        """
+        stamp = self.get(key)
+        if stamp is not None:
+            return stamp
+
+        with self._lock:
+            key_lock = self._pending.setdefault(key, threading.Lock())
+
+        with key_lock:
+            try:
+                stamp = self.get(key)
+                if stamp is None:
+                    stamp = create()
+                    self.put(key, stamp)
+            finally:
+                with self._lock:
+                    self._pending.pop(key, None)
+
+        return stamp
+
+    def clear(self) -> None:
+        with self._lock:
+            self._stamps.clear()
+
+    def __len__(self) -> int:
+        return len(self._stamps)
+
+
+STAMP_CACHE = StampCache()
+
+
+# Folder of the cache directory holding the rasterized stamps
+RASTER_STAMPS_FOLDER = "stamps"
+RASTER_STAMP_CACHE_VERSION = 1
+
+
+def get_raster_stamp_path(key: str) -> str:
+    """Path of the rasterized stamp stored for key, a digest of everything the stamp depends on."""
+    from reportlab import Version
+
+    name = hashlib.sha256(
+        f"{RASTER_STAMP_CACHE_VERSION};{Version};{key}".encode()
+    ).hexdigest()
+    return os.path.join(get_cache_dir(), RASTER_STAMPS_FOLDER, f"{name}.pdf")
+
+
+def load_raster_stamp(path: str) -> Optional[bytes]:
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def save_raster_stamp(path: str, stamp: bytes):
+    # The disk cache is only an optimization, failing to write it is not an error
+    try:
+        atomic_write(path, stamp)
+    except OSError:
+        pass
@@ -1,17 +1,29 @@
-from math import cos, pi, sin
-from typing import Union
+from math import cos, hypot, pi, sin
+from typing import BinaryIO, Tuple, Union
 
 import numpy as np
 from reportlab.pdfgen import canvas
 
-from pdf_watermark.options import Alignments, DrawingOptions, GridOptions, InsertOptions
+from pdf_watermark.options import (
+    Alignments,
+    DrawingOptions,
+    GridOptions,
+    GridRenderings,
+    InsertOptions,
+    UnselectableModes,
+)
 from pdf_watermark.utils import (
     change_base,
     draw_centered_image,
     draw_centered_string_with_line_breaks,
     fit_image,
+    grid_layout,
 )
 
+GRID_CELL_FORM = "PdfWatermarkCell"
+GRID_ROW_FORM = "PdfWatermarkRow"
+GRID_FORM = "PdfWatermarkGrid"
+
 
 def draw_one_watermark(
     watermark: canvas.Canvas,
@@ -23,13 +35,27 @@ def draw_one_watermark(
     image_height: float,
 ):
     x_prime, y_prime = change_base(x, y, rotation_matrix)
+    draw_one_rotated_watermark(
+        watermark, x_prime, y_prime, drawing_options, image_width, image_height
+    )
+
 
+def draw_one_rotated_watermark(
+    watermark: canvas.Canvas,
+    x_prime: float,
+    y_prime: float,
+    drawing_options: DrawingOptions,
+    image_width: float,
+    image_height: float,
+):
     if drawing_options.text is not None:
         draw_centered_string_with_line_breaks(
             watermark,
             x_prime,
             y_prime,
             drawing_options.text,
+            outlines=drawing_options.unselectable
+            and drawing_options.unselectable_mode == UnselectableModes.OUTLINES.value,
         )
 
     if drawing_options.image is not None:
@@ -40,6 +66,7 @@ def draw_one_watermark(
             image_width,
             image_height,
             drawing_options.image,
+            drawing_options.image_dpi,
         )
 
 
@@ -118,6 +145,26 @@ def draw_insert_watermark(
     )
 
 
+def get_grid_image_size(
+    drawing_options: DrawingOptions,
+    specific_options: GridOptions,
+    width: float,
+    height: float,
+) -> Tuple[float, float]:
+    if drawing_options.image is None:
+        return 0, 0
+
+    # if the image is too big, scale it down to fit in the box
+    image_width, image_height = drawing_options.image.getSize()
+    return fit_image(
+        image_width,
+        image_height,
+        width / specific_options.horizontal_boxes,
+        height / specific_options.vertical_boxes,
+        drawing_options.image_scale,
+    )
+
+
 def draw_grid_watermark(
     watermark: canvas.Canvas,
     drawing_options: DrawingOptions,
@@ -126,50 +173,86 @@ def draw_grid_watermark(
     height: float,
     rotation_matrix: np.ndarray,
 ):
-    image_width, image_height = 0, 0
+    image_width, image_height = get_grid_image_size(
+        drawing_options, specific_options, width, height
+    )
+
+    positions = grid_layout(
+        width,
+        height,
+        specific_options.horizontal_boxes,
+        specific_options.vertical_boxes,
+        specific_options.margin,
+        drawing_options.angle,
+    )
+    for x_prime, y_prime in positions:
+        draw_one_rotated_watermark(
+            watermark,
+            x_prime,
+            y_prime,
+            drawing_options,
+            image_width,
+            image_height,
+        )
+
+
+def draw_grid_watermark_with_forms(
+    watermark: canvas.Canvas,
+    drawing_options: DrawingOptions,
+    specific_options: GridOptions,
+    width: float,
+    height: float,
+):
+    """
+    Same as draw_grid_watermark, but the watermark is drawn once in a form, referenced by a form
+    holding one row of the grid, itself referenced once per row. The page only references the grid.
+    """
+    image_width, image_height = get_grid_image_size(
+        drawing_options, specific_options, width, height
+    )
 
     horizontal_box_spacing = width / specific_options.horizontal_boxes
     vertical_box_spacing = height / specific_options.vertical_boxes
+    start_index = 1 if specific_options.margin else 0
+    offset = 0.5 if specific_options.margin else 0
 
-    if specific_options.margin:
-        start_index = 1
-    else:
-        start_index = 0
+    # Anything farther than the page diagonal from a box center is outside the page
+    reach = hypot(width, height)
+    bounding_box = (-reach, -reach, width + reach, height + reach)
 
-    if drawing_options.image is not None:
-        # if the image is too big, scale it down to fit in the box
-        image_width, image_height = drawing_options.image.getSize()
-        image_width, image_height = fit_image(
-            image_width,
-            image_height,
-            horizontal_box_spacing,
-            vertical_box_spacing,
-            drawing_options.image_scale,
-        )
+    # reportlab does not add transparency settings to the resources of forms, so the color and
+    # opacity are set on the page and inherited by the forms
+    watermark.setFillColor(drawing_options.text_color, alpha=drawing_options.opacity)
+
+    watermark.beginForm(GRID_CELL_FORM, *bounding_box)
+    watermark.setFont(drawing_options.text_font, drawing_options.text_size)
+    watermark.rotate(drawing_options.angle)
+    draw_one_rotated_watermark(
+        watermark, 0, 0, drawing_options, image_width, image_height
+    )
+    watermark.endForm()
 
+    watermark.beginForm(GRID_ROW_FORM, *bounding_box)
     for x_index in range(start_index, specific_options.horizontal_boxes + 1):
-        for y_index in range(start_index, specific_options.vertical_boxes + 1):
-            # Coordinates to draw at in original coordinates system
-            x_base = x_index * horizontal_box_spacing
-            y_base = y_index * vertical_box_spacing
-
-            if specific_options.margin:
-                x_base -= horizontal_box_spacing / 2
-                y_base -= vertical_box_spacing / 2
-
-            draw_one_watermark(
-                watermark,
-                x_base,
-                y_base,
-                rotation_matrix,
-                drawing_options,
-                image_width,
-                image_height,
-            )
+        watermark.saveState()
+        watermark.translate((x_index - offset) * horizontal_box_spacing, 0)
+        watermark.doForm(GRID_CELL_FORM)
+        watermark.restoreState()
+    watermark.endForm()
+
+    watermark.beginForm(GRID_FORM, *bounding_box)
+    for y_index in range(start_index, specific_options.vertical_boxes + 1):
+        watermark.saveState()
+        watermark.translate(0, (y_index - offset) * vertical_box_spacing)
+        watermark.doForm(GRID_ROW_FORM)
+        watermark.restoreState()
+    watermark.endForm()
+
+    watermark.doForm(GRID_FORM)
 
 
 def draw_watermarks(
-    file_name: str,
+    file_name: Union[str, BinaryIO],
     width: float,
     height: float,
     drawing_options: DrawingOptions,
@@ -177,6 +260,17 @@ def draw_watermarks(
 ):
     watermark = canvas.Canvas(file_name, pagesize=(width, height))
 
+    if (
+        isinstance(specific_options, GridOptions)
+        and specific_options.rendering == GridRenderings.FORM.value
+    ):
+        # The forms set up their own graphics state
+        draw_grid_watermark_with_forms(
+            watermark, drawing_options, specific_options, width, height
+        )
+        watermark.save()
+        return
+
     rotation_angle_rad = drawing_options.angle * pi / 180
     rotation_matrix = np.array(
         [
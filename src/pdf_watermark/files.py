@@ -0,0 +1,53 @@
+"""
+File utilities for pdf-watermark.
+Lists the files to watermark without loading the PDF libraries, so that dry runs start fast.
+"""
+
+from typing import Iterator, Optional, Tuple, Union
+
+import click
+
+from pdf_watermark.manifest import Manifest
+from pdf_watermark.options import (
+    STDIO,
+    DrawingOptions,
+    FilesOptions,
+    GridOptions,
+    InsertOptions,
+)
+
+
+def pending_files(
+    files_options: FilesOptions, manifest: Optional[Manifest]
+) -> Iterator[Tuple[str, str]]:
+    """Iterate over the input and output files, leaving out those that are up to date in the manifest."""
+    for input_file, output_file in files_options:
+        if manifest is not None and manifest.is_up_to_date(input_file, output_file):
+            continue
+
+        if files_options.verbose or files_options.dry_run:
+            if output_file == STDIO:
+                # The standard output holds the document
+                click.echo("writing: <stdout>", err=True)
+            elif input_file == output_file:
+                click.echo(f"modifying: {output_file}")
+            else:
+                click.echo(f"creating: {output_file}")
+
+        yield input_file, output_file
+
+
+def list_pending_files(
+    files_options: FilesOptions,
+    drawing_options: DrawingOptions,
+    specific_options: Union[GridOptions, InsertOptions],
+):
+    """Print the files that would be watermarked, without modifying them."""
+    manifest = None
+    if files_options.manifest:
+        manifest = Manifest.from_options(
+            files_options, drawing_options, specific_options
+        )
+
+    for _ in pending_files(files_options, manifest):
+        pass
@@ -0,0 +1,250 @@
+"""
+Font index for pdf-watermark.
+Maps font names to the font files of the font folders, and keeps the parsed fonts on disk, so that
+the font folders are not listed and the font files are not parsed again by every run.
+"""
+
+import copy
+import hashlib
+import json
+import logging
+import os
+import pickle
+import stat
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from pdf_watermark.cache import atomic_write, get_cache_dir
+
+FONT_INDEX_NAME = "font-index.json"
+FONT_INDEX_VERSION = 2
+PARSED_FONTS_FOLDER = "fonts"
+
+# Tried in this order for each font name, like reportlab does
+FONT_EXTENSIONS = (".ttf", ".TTF", ".otf", ".OTF")
+
+logger = logging.getLogger(__name__)
+
+
+def _mtime_ns(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _font_file(path: str) -> Dict:
+    file_stat = os.stat(path)
+    return {"path": path, "size": file_stat.st_size, "mtime_ns": file_stat.st_mtime_ns}
+
+
+def scan_folder(folder: str) -> Dict:
+    """
+    Find the font files of a folder.
+
+    Like reportlab, only the files directly in the folder are considered, not those of its
+    subfolders.
+
+    Returns:
+        A dictionary with the modification time of the folder, used to detect changes, and the
+        font files by file name.
+    """
+    fonts = {}
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.name.endswith(FONT_EXTENSIONS) and entry.is_file():
+                    try:
+                        fonts[entry.name] = _font_file(entry.path)
+                    except OSError:
+                        continue
+    except OSError:
+        pass
+
+    return {"mtime_ns": _mtime_ns(folder), "fonts": fonts}
+
+
+class FontIndex:
+    """
+    Font files of each font folder, stored in a JSON file.
+
+    A folder is scanned again when it was modified, i.e. when a file was added, removed or
+    renamed. Checking this only takes one stat per folder. Files modified in place are detected
+    by FontIndex.find, which checks the font file it returns.
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.folders: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+        if path is not None and os.path.isfile(path):
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                data = {}
+            if data.get("version") == FONT_INDEX_VERSION:
+                self.folders = data["folders"]
+
+    def is_up_to_date(self, folder: str) -> bool:
+        entry = self.folders.get(folder)
+        return entry is not None and _mtime_ns(folder) == entry["mtime_ns"]
+
+    def update(self, folders: Iterable[str]) -> List[str]:
+        """Scan the folders that changed since they were indexed, and save the index if needed."""
+        with self._lock:
+            folders = [os.path.abspath(folder) for folder in folders]
+            changed = False
+            for folder in folders:
+                if not self.is_up_to_date(folder):
+                    self.folders[folder] = scan_folder(folder)
+                    changed = True
+            if changed:
+                self.save()
+            return folders
+
+    def find(self, font_name: str, folders: Iterable[str]) -> Optional[Dict]:
+        """
+        Find the file of a font.
+
+        Like reportlab, a file named after the font in the working directory comes first, then
+        the files of the folders, in order.
+
+        Returns:
+            A dictionary with the path, size and modification time of the font file, or None if
+            there is no such file. The size and modification time are read again from the file,
+            so that they change when the file is overwritten.
+        """
+        folders = self.update(folders)
+        for extension in FONT_EXTENSIONS:
+            filename = font_name + extension
+            if os.path.isfile(filename):
+                return _font_file(os.path.abspath(filename))
+            for folder in folders:
+                font_file = self.folders[folder]["fonts"].get(filename)
+                if font_file is None:
+                    continue
+                try:
+                    return _font_file(font_file["path"])
+                except OSError:
+                    continue
+        return None
+
+    def similar_fonts(self, font_name: str, folders: Iterable[str]) -> List[str]:
+        """Names of the indexed fonts that contain font_name, ignoring case."""
+        similar_fonts = set()
+        for folder in self.update(folders):
+            for filename in self.folders[folder]["fonts"]:
+                if font_name.lower() in filename.lower():
+                    similar_fonts.add(filename.rsplit(".", 1)[0])
+        return sorted(similar_fonts)
+
+    def save(self):
+        if self.path is None:
+            return
+
+        data = {"version": FONT_INDEX_VERSION, "folders": self.folders}
+        try:
+            atomic_write(self.path, json.dumps(data).encode())
+        except OSError:
+            # The index is only an optimization, e.g. the cache directory may be read-only
+            pass
+
+
+_FONT_INDEX: Optional[FontIndex] = None
+
+
+def get_font_index() -> FontIndex:
+    """The font index of the cache directory, loaded once per process."""
+    global _FONT_INDEX
+
+    path = os.path.join(get_cache_dir(), FONT_INDEX_NAME)
+    if _FONT_INDEX is None or _FONT_INDEX.path != path:
+        _FONT_INDEX = FontIndex(path)
+    return _FONT_INDEX
+
+
+def _parsed_font_path(font_file: Dict) -> str:
+    from reportlab import Version
+
+    key = hashlib.sha256(
+        f"{FONT_INDEX_VERSION};{Version};{font_file['path']};"
+        f"{font_file['size']};{font_file['mtime_ns']}".encode()
+    ).hexdigest()
+    return os.path.join(get_cache_dir(), PARSED_FONTS_FOLDER, f"{key}.pickle")
+
+
+def _is_private(path: str) -> bool:
+    """
+    Whether a file of the cache directory can only have been written by the current user.
+
+    Parsed fonts are loaded with pickle, which can run arbitrary code, and the cache directory can
+    be moved anywhere with PDF_WATERMARK_CACHE_DIR. So they are only loaded if both the file and
+    its directory belong to the current user and cannot be written by anyone else.
+    """
+    # Ownership cannot be checked without user ids, e.g. on Windows
+    if not hasattr(os, "getuid"):
+        return False
+
+    for checked_path in (path, os.path.dirname(path)):
+        path_stat = os.stat(checked_path)
+        if path_stat.st_uid != os.getuid() or path_stat.st_mode & (
+            stat.S_IWGRP | stat.S_IWOTH
+        ):
+            return False
+    return True
+
+
+def _pdf_scale(units_per_em: int):
+    # Same scaling function as the one reportlab creates while parsing the font
+    if units_per_em == 1000:
+        return lambda x: x
+    multiplier = 1000 / units_per_em
+    return lambda x: x * multiplier
+
+
+def load_ttf_font(font_name: str, font_file: Dict):
+    """
+    Create a reportlab TTFont from a font file found by FontIndex.find.
+
+    The parsed font is stored in the cache directory, and reused by the next runs as long as the
+    font file does not change. This avoids parsing large fonts, e.g. CJK fonts, in every process.
+    """
+    from weakref import WeakKeyDictionary
+
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    parsed_font_path = _parsed_font_path(font_file)
+    try:
+        if _is_private(parsed_font_path):
+            with open(parsed_font_path, "rb") as f:
+                font = pickle.load(f)
+            font.fontName = font_name
+            font.state = WeakKeyDictionary()
+            font.face._pdfScale = _pdf_scale(font.face.unitsPerEm)
+            return font
+        logger.debug("Ignoring parsed font %s not owned by the user.", parsed_font_path)
+    except FileNotFoundError:
+        pass
+    except (OSError, pickle.UnpicklingError, EOFError) as e:
+        logger.debug("Could not load parsed font %s: %s", parsed_font_path, e)
+
+    font = TTFont(font_name, font_file["path"])
+
+    # The state of the font in each document and the scaling function cannot be pickled
+    parsed_font = copy.copy(font)
+    parsed_font.state = None
+    parsed_font.face = copy.copy(font.face)
+    del parsed_font.face._pdfScale
+    try:
+        # Only the user can write parsed fonts, see _is_private
+        os.makedirs(os.path.dirname(parsed_font_path), mode=0o700, exist_ok=True)
+        atomic_write(
+            parsed_font_path,
+            pickle.dumps(parsed_font, protocol=pickle.HIGHEST_PROTOCOL),
+        )
+    except (OSError, pickle.PicklingError, AttributeError, TypeError) as e:
+        logger.debug("Could not store parsed font %s: %s", parsed_font_path, e)
+
+    return font
@@ -6,11 +6,6 @@ Handles custom font registration including TTF and CID fonts.
 import os
 from typing import Optional
 
-import reportlab.rl_config
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.cidfonts import UnicodeCIDFont
-from reportlab.pdfbase.ttfonts import TTFont
-
 # Standard fonts that come with reportlab and don't need registration
 STANDARD_FONTS = [
     "Helvetica",
@@ -66,7 +61,14 @@ def register_custom_font(
     if font_name in STANDARD_FONTS:
         return
 
+    # Only loaded when a font has to be registered
+    from reportlab.pdfbase import pdfmetrics
+
     if font_name in STANDARD_CID_FONTS:
+        from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+
+        if font_name in pdfmetrics.getRegisteredFontNames():
+            return
         try:
             pdfmetrics.registerFont(UnicodeCIDFont(font_name))
             return
@@ -80,42 +82,40 @@ def register_ttf_font(font_name: str) -> None:
     """
     Try to register a font as a TTF font.
 
+    The font file is looked up in the font index, which covers the folders of reportlab's TTF
+    search path, including the custom fonts folder.
+
     Args:
         font_name: The name of the font to register
-        custom_fonts_folder: Optional folder path to search for font files first
     """
-    try:
-        # Check if font is already registered
-        existing_fonts = pdfmetrics.getRegisteredFontNames()
-        if font_name in existing_fonts:
-            return
-    except Exception:
-        pass
+    import reportlab.rl_config
+    from reportlab.pdfbase import pdfmetrics
 
-    # Try different common extensions with reportlab's search
-    possible_extensions = [".ttf", ".TTF", ".otf", ".OTF"]
-    for ext in possible_extensions:
+    from pdf_watermark.font_index import get_font_index, load_ttf_font
+
+    # Check if font is already registered
+    if font_name in pdfmetrics.getRegisteredFontNames():
+        return
+
+    font_index = get_font_index()
+    font_file = font_index.find(font_name, reportlab.rl_config.TTFSearchPath)
+
+    if font_file is not None:
         try:
-            ttf_font = TTFont(font_name, font_name + ext)
-            pdfmetrics.registerFont(ttf_font)
+            pdfmetrics.registerFont(load_ttf_font(font_name, font_file))
             return
         except Exception as e:
-            if "Can't open file" not in str(e):
-                print(
-                    f"Warning: Could not register font '{font_name + ext}' due to error: {e}"
-                )
-            continue
+            raise ValueError(
+                f"Failed to register font '{font_name}' from {font_file['path']}: {e}"
+            )
 
     # If font_name could not be registered, look for similar names in the font folders
-    similar_fonts = set()
-    for folder in reportlab.rl_config.TTFSearchPath:
-        for _, _, files in os.walk(folder):
-            for file in files:
-                if font_name.lower() in file.lower():
-                    similar_fonts.add(file.rsplit(".", 1)[0])
+    similar_fonts = font_index.similar_fonts(
+        font_name, reportlab.rl_config.TTFSearchPath
+    )
 
     raise ValueError(
-        f"Font '{font_name}' could not be registered. Maybe you meant one of {list(similar_fonts)} ?"
+        f"Font '{font_name}' could not be registered. Maybe you meant one of {similar_fonts} ?"
     )
 
 
@@ -132,6 +132,8 @@ def setup_custom_fonts_path(custom_fonts_folder: Optional[str] = None) -> None:
     if not os.path.exists(custom_fonts_folder):
         raise ValueError(f"Custom fonts folder does not exist: {custom_fonts_folder}")
 
+    import reportlab.rl_config
+
     # Add the custom fonts folder to reportlab's TTF search path
     if hasattr(reportlab.rl_config, "TTFSearchPath"):
         if custom_fonts_folder not in reportlab.rl_config.TTFSearchPath:
@@ -1,70 +1,444 @@
 import os
-from concurrent.futures import ThreadPoolExecutor
-from tempfile import NamedTemporaryFile
-from typing import Union
+import sys
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from io import BytesIO
+from typing import BinaryIO, Dict, Iterable, List, Optional, Tuple, Union
 
-import click
 import pypdf
 
+from pdf_watermark.cache import (
+    STAMP_CACHE,
+    get_raster_stamp_path,
+    load_raster_stamp,
+    options_fingerprint,
+    save_raster_stamp,
+)
 from pdf_watermark.draw import draw_watermarks
+from pdf_watermark.files import list_pending_files, pending_files
+from pdf_watermark.image_utils import RasterEncoder
+from pdf_watermark.manifest import Manifest, file_digest
+from pdf_watermark.merge import (
+    compress_page_contents,
+    create_stamp_xobject,
+    draw_stamp_xobject_on_pages,
+    merge_stamp_content,
+    prepare_stamp_content,
+    set_merged_page_content,
+)
 from pdf_watermark.options import (
+    STDIO,
     DrawingOptions,
+    Executors,
     FilesOptions,
     GridOptions,
     InsertOptions,
+    MergeModes,
+    UnselectableModes,
+)
+from pdf_watermark.profiling import Profile, record_timings, timed
+from pdf_watermark.utils import (
+    MEGABYTE,
+    convert_bytes_to_images,
+    convert_pdf_writer_to_images,
+    get_page_count,
+    get_page_sizes,
 )
-from pdf_watermark.utils import convert_content_to_images
+
+
+def get_raster_encoder(drawing_options: DrawingOptions) -> RasterEncoder:
+    return RasterEncoder(
+        drawing_options.raster_encoding,
+        drawing_options.raster_quality,
+        drawing_options.raster_compression_level,
+    )
+
+
+def rasterizes_stamp(drawing_options: DrawingOptions) -> bool:
+    return (
+        drawing_options.unselectable
+        and drawing_options.unselectable_mode == UnselectableModes.IMAGE.value
+        and not drawing_options.save_as_image
+    )
+
+
+def raster_stamp_key(
+    width: float, height: float, fingerprint: str, drawing_options: DrawingOptions
+) -> str:
+    """
+    Key of a rasterized stamp in the disk cache.
+
+    Unlike the options fingerprint, it also depends on the content of the image and font files,
+    which may change between runs while keeping the same path.
+    """
+    key = f"{width};{height};{fingerprint}"
+    if drawing_options.image_path is not None:
+        key += f";{file_digest(drawing_options.image_path)}"
+
+    from reportlab.pdfbase import pdfmetrics
+
+    font_file = getattr(
+        pdfmetrics.getFont(drawing_options.text_font).face, "filename", None
+    )
+    if font_file is not None and os.path.isfile(font_file):
+        stat = os.stat(font_file)
+        key += f";{font_file};{stat.st_size};{stat.st_mtime_ns}"
+
+    return key
+
+
+def render_watermark_stamp(
+    width: float,
+    height: float,
+    drawing_options: DrawingOptions,
+    specific_options: Union[GridOptions, InsertOptions],
+    fingerprint: Optional[str] = None,
+) -> bytes:
+    stamp_path = None
+    if rasterizes_stamp(drawing_options) and drawing_options.persistent_stamp_cache:
+        if fingerprint is None:
+            fingerprint = options_fingerprint(drawing_options, specific_options)
+        stamp_path = get_raster_stamp_path(
+            raster_stamp_key(width, height, fingerprint, drawing_options)
+        )
+        stamp = load_raster_stamp(stamp_path)
+        if stamp is not None:
+            return stamp
+
+    # The watermark is drawn in memory, as a one page pdf
+    buffer = BytesIO()
+    with timed("draw"):
+        draw_watermarks(buffer, width, height, drawing_options, specific_options)
+    stamp = buffer.getvalue()
+
+    if rasterizes_stamp(drawing_options):
+        rasterized_stamp = convert_bytes_to_images(
+            stamp, drawing_options.dpi, encoder=get_raster_encoder(drawing_options)
+        )
+        if rasterized_stamp is not None:
+            stamp = rasterized_stamp
+            # Stamps that could not be rasterized are not stored, so that they are not reused
+            # once poppler is available
+            if stamp_path is not None:
+                save_raster_stamp(stamp_path, stamp)
+
+    return stamp
+
+
+def get_watermark_stamp(
+    width: float,
+    height: float,
+    drawing_options: DrawingOptions,
+    specific_options: Union[GridOptions, InsertOptions],
+    fingerprint: Optional[str] = None,
+) -> bytes:
+    """Return the watermark stamp for a page size, rendering it only if it is not cached yet."""
+    if fingerprint is None:
+        fingerprint = options_fingerprint(drawing_options, specific_options)
+
+    return STAMP_CACHE.get_or_create(
+        (width, height, fingerprint),
+        lambda: render_watermark_stamp(
+            width, height, drawing_options, specific_options, fingerprint
+        ),
+    )
+
+
+def open_pdf_writer(
+    input: Union[str, BinaryIO], drawing_options: DrawingOptions
+) -> Tuple[pypdf.PdfWriter, List[Tuple[float, float]]]:
+    with timed("parse"):
+        if drawing_options.incremental:
+            # The original bytes are written as they are, followed by the modified objects
+            if isinstance(input, str):
+                with open(input, "rb") as f:
+                    data = f.read()
+            else:
+                data = input.read()
+            # The update must start on a new line
+            if not data.endswith((b"\n", b"\r")):
+                data += b"\n"
+            pdf_writer = pypdf.PdfWriter(
+                pypdf.PdfReader(BytesIO(data)), incremental=True
+            )
+            page_sizes = get_page_sizes(pdf_writer)
+        else:
+            pdf_writer = pypdf.PdfWriter()
+            pdf_to_transform = pypdf.PdfReader(input)
+            pdf_writer.clone_document_from_reader(pdf_to_transform)
+            page_sizes = get_page_sizes(pdf_to_transform)
+
+    return pdf_writer, page_sizes
+
+
+def optimize_pdf_writer(pdf_writer: pypdf.PdfWriter, drawing_options: DrawingOptions):
+    # Pointless when the pages are rasterized afterwards
+    if drawing_options.save_as_image:
+        return
+
+    if drawing_options.compress:
+        # Compressing the unchanged streams of the original document would add them to the update
+        changed_objects = None
+        if drawing_options.incremental:
+            changed_objects = {
+                reference.idnum for reference in pdf_writer.list_objects_in_increment()
+            }
+        compress_page_contents(
+            pdf_writer,
+            pdf_writer.pages,
+            drawing_options.compression_level,
+            changed_objects,
+        )
+
+    if drawing_options.deduplicate:
+        pdf_writer.compress_identical_objects()
+
+
+def save_pdf_writer(
+    pdf_writer: pypdf.PdfWriter,
+    output: Union[str, BinaryIO],
+    drawing_options: DrawingOptions,
+    page_sizes: List[Tuple[float, float]],
+):
+    with timed("write"):
+        optimize_pdf_writer(pdf_writer, drawing_options)
+
+    # Output directories are created when their first file is written
+    if isinstance(output, str) and os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+
+    # The rasterized document is written instead, unless poppler is not available
+    if drawing_options.save_as_image and convert_pdf_writer_to_images(
+        pdf_writer,
+        page_sizes,
+        output,
+        drawing_options.dpi,
+        drawing_options.max_raster_memory * MEGABYTE,
+        drawing_options.raster_workers,
+        get_raster_encoder(drawing_options),
+    ):
+        return
+
+    with timed("write"):
+        # Writers opened with incremental=True write an incremental update. The input is already
+        # read in memory, so output can be the input file.
+        if not isinstance(output, str):
+            pdf_writer.write(output)
+        else:
+            with open(output, "wb") as f:
+                pdf_writer.write(f)
+
+
+def get_watermark_stamps(
+    page_sizes: List[Tuple[float, float]],
+    drawing_options: DrawingOptions,
+    specific_options: Union[GridOptions, InsertOptions],
+) -> Dict[Tuple[float, float], pypdf.PageObject]:
+    """Return the stamp page for each unique page size. Only one watermark is computed per page size."""
+    fingerprint = options_fingerprint(drawing_options, specific_options)
+
+    stamps = {}
+    for width, height in dict.fromkeys(page_sizes):
+        stamp = get_watermark_stamp(
+            width, height, drawing_options, specific_options, fingerprint
+        )
+        stamps[(width, height)] = pypdf.PdfReader(BytesIO(stamp)).pages[0]
+
+    return stamps
 
 
 def add_watermark_to_pdf(
+    input: Union[str, BinaryIO],
+    output: Union[str, BinaryIO],
+    drawing_options: DrawingOptions,
+    specific_options: Union[GridOptions, InsertOptions],
+):
+    """
+    Add a watermark to a PDF document.
+
+    Args:
+        input: Path of the document, or binary stream to read it from
+        output: Path to save the watermarked document to, or binary stream to write it to
+        drawing_options: The watermark to draw and how to draw it
+        specific_options: GridOptions or InsertOptions, depending on the layout of the watermark
+    """
+    pdf_writer, page_sizes = open_pdf_writer(input, drawing_options)
+    stamps = get_watermark_stamps(page_sizes, drawing_options, specific_options)
+
+    with timed("merge"):
+        for stamp_index, (page_size, stamp_page) in enumerate(stamps.items()):
+            # Add watermark to pages with the same size
+            pages = [
+                pdf_writer.pages[index]
+                for index, size in enumerate(page_sizes)
+                if size == page_size
+            ]
+            if drawing_options.merge_mode == MergeModes.XOBJECT.value:
+                stamp_xobject = create_stamp_xobject(pdf_writer, stamp_page)
+                draw_stamp_xobject_on_pages(
+                    pdf_writer, pages, stamp_xobject, stamp_index
+                )
+            else:
+                for page in pages:
+                    page.merge_page(stamp_page)
+
+    save_pdf_writer(pdf_writer, output, drawing_options, page_sizes)
+
+
+def add_watermark_to_file(
+    input_file: str,
+    output_file: str,
+    drawing_options: DrawingOptions,
+    specific_options: Union[GridOptions, InsertOptions],
+):
+    """Same as add_watermark_to_pdf, where - stands for the standard input or output."""
+    if input_file == STDIO:
+        # Reading a pdf requires seeking, which pipes do not support
+        input = BytesIO(sys.stdin.buffer.read())
+    else:
+        input = input_file
+
+    if output_file == STDIO:
+        # Offsets are needed to write a pdf, so it is serialized in memory first
+        output = BytesIO()
+        add_watermark_to_pdf(input, output, drawing_options, specific_options)
+        stdout = sys.stdout.buffer
+        stdout.write(output.getvalue())
+        stdout.flush()
+    else:
+        add_watermark_to_pdf(input, output_file, drawing_options, specific_options)
+
+
+def add_watermark_to_bytes(
+    content: bytes,
+    drawing_options: DrawingOptions,
+    specific_options: Union[GridOptions, InsertOptions],
+) -> bytes:
+    """
+    Add a watermark to a PDF document held in memory, without any file system access.
+
+    The options can be created once and reused for any number of documents.
+
+    Args:
+        content: The PDF document
+        drawing_options: The watermark to draw and how to draw it
+        specific_options: GridOptions or InsertOptions, depending on the layout of the watermark
+
+    Returns:
+        The watermarked PDF document.
+    """
+    output = BytesIO()
+    add_watermark_to_pdf(BytesIO(content), output, drawing_options, specific_options)
+    return output.getvalue()
+
+
+def merge_page_range(
+    input: str,
+    start: int,
+    stop: int,
+    stamp_contents: Dict[Tuple[float, float], bytes],
+    level: int = -1,
+) -> List[bytes]:
+    """Compute the watermarked content of the pages from start to stop. This runs in parallel workers."""
+    pdf_to_transform = pypdf.PdfReader(input)
+    contents = []
+    for index in range(start, stop):
+        page = pdf_to_transform.pages[index]
+        stamp_content = stamp_contents[(page.mediabox.width, page.mediabox.height)]
+        contents.append(merge_stamp_content(page, stamp_content, level))
+
+    return contents
+
+
+def add_watermark_to_large_pdf(
     input: str,
     output: str,
     drawing_options: DrawingOptions,
     specific_options: Union[GridOptions, InsertOptions],
+    executor: Executor,
+    chunks: int,
 ):
-    pdf_writer = pypdf.PdfWriter()
-    pdf_to_transform = pypdf.PdfReader(input)
-    pdf_writer.clone_document_from_reader(pdf_to_transform)
-
-    page_sizes = []
-    for page in pdf_to_transform.pages:
-        page_sizes.append((page.mediabox.width, page.mediabox.height))
-
-    # Only one watermark is computed per page size
-    for watermark_width, watermark_height in set(page_sizes):
-        with NamedTemporaryFile(delete=False) as temporary_file:
-            # The watermark is stored in a temporary pdf file
-            draw_watermarks(
-                temporary_file.name,
-                watermark_width,
-                watermark_height,
-                drawing_options,
-                specific_options,
+    """
+    Same as add_watermark_to_pdf, but the pages are split into chunks that are merged with their
+    stamp by the executor workers. The document itself is assembled and written once.
+    """
+    pdf_writer, page_sizes = open_pdf_writer(input, drawing_options)
+    stamps = get_watermark_stamps(page_sizes, drawing_options, specific_options)
+
+    # Includes the time spent waiting for the workers
+    with timed("merge"):
+        stamp_contents = {}
+        stamp_resources = {}
+        for stamp_index, (page_size, stamp_page) in enumerate(stamps.items()):
+            pages = [
+                pdf_writer.pages[index]
+                for index, size in enumerate(page_sizes)
+                if size == page_size
+            ]
+            stamp_contents[page_size], stamp_resources[page_size] = (
+                prepare_stamp_content(pdf_writer, stamp_page, stamp_index, pages)
+            )
+
+        chunk_size = -(-len(page_sizes) // chunks)
+        futures = {
+            start: executor.submit(
+                merge_page_range,
+                input,
+                start,
+                min(start + chunk_size, len(page_sizes)),
+                stamp_contents,
+                drawing_options.compression_level,
             )
+            for start in range(0, len(page_sizes), chunk_size)
+        }
 
-            if drawing_options.unselectable and not drawing_options.save_as_image:
-                convert_content_to_images(
-                    temporary_file.name,
-                    drawing_options.dpi,
+        for start, future in futures.items():
+            for offset, content in enumerate(future.result()):
+                set_merged_page_content(
+                    pdf_writer.pages[start + offset],
+                    content,
+                    stamp_resources[page_sizes[start + offset]],
                 )
 
-            watermark_pdf = pypdf.PdfReader(temporary_file.name)
+    save_pdf_writer(pdf_writer, output, drawing_options, page_sizes)
 
-            # Add watermark to pages with the same size
-            for index, (page_width, page_height) in enumerate(page_sizes):
-                if page_width == watermark_width and page_height == watermark_height:
-                    page = pdf_writer.pages[index]
-                    page.merge_page(watermark_pdf.pages[0])
 
-            # Remove temp file - https://stackoverflow.com/questions/23212435/permission-denied-to-write-to-my-temporary-file
-            temporary_file.close()
-            os.unlink(temporary_file.name)
+# Options shared by all the files processed in a worker process. They are sent
+# once per process through the pool initializer instead of once per file.
+_worker_options = None
 
-    with open(output, "wb") as f:
-        pdf_writer.write(f)
 
-    if drawing_options.save_as_image:
-        convert_content_to_images(output, drawing_options.dpi)
+def _init_worker(
+    drawing_options: DrawingOptions,
+    specific_options: Union[GridOptions, InsertOptions],
+):
+    global _worker_options
+    _worker_options = (drawing_options, specific_options)
+
+
+def _add_watermark_in_worker(input_file: str, output_file: str) -> Dict[str, float]:
+    with record_timings() as timings:
+        add_watermark_to_pdf(input_file, output_file, *_worker_options)
+    return timings
+
+
+def is_large_pdf(
+    input: str, files_options: FilesOptions, drawing_options: DrawingOptions
+) -> bool:
+    if files_options.page_parallel_threshold is None:
+        return False
+
+    # Pages are merged by reference in xobject mode, which is already cheap
+    if drawing_options.merge_mode == MergeModes.XOBJECT.value:
+        return False
+
+    # Called for every input file before it is submitted, so the pages are not loaded
+    return get_page_count(input) >= files_options.page_parallel_threshold
 
 
 def add_watermark_from_options(
@@ -72,24 +446,121 @@ def add_watermark_from_options(
     drawing_options: DrawingOptions,
     specific_options: Union[GridOptions, InsertOptions],
 ):
-    def process_file(input_file, output_file):
-        if files_options.verbose or files_options.dry_run:
-            if input_file == output_file:
-                click.echo(f"modifying: {output_file}")
-            else:
-                click.echo(f"creating: {output_file}")
-        if not files_options.dry_run:
-            add_watermark_to_pdf(
-                input_file, output_file, drawing_options, specific_options
-            )
+    if files_options.dry_run:
+        list_pending_files(files_options, drawing_options, specific_options)
+        return
 
-    if files_options.workers > 1:
-        with ThreadPoolExecutor(max_workers=files_options.workers) as executor:
-            futures = [
-                executor.submit(process_file, inp, out) for inp, out in files_options
-            ]
-            for future in futures:
-                future.result()
+    manifest = None
+    if files_options.manifest:
+        manifest = Manifest.from_options(
+            files_options, drawing_options, specific_options
+        )
+
+    profile = None
+    if files_options.profile is not None:
+        profile = Profile(use_cprofile=files_options.cprofile)
+
+    try:
+        process_files(
+            pending_files(files_options, manifest),
+            files_options,
+            drawing_options,
+            specific_options,
+            manifest,
+            profile,
+        )
+    finally:
+        # Files processed before an error are not processed again by the next run
+        if manifest is not None:
+            manifest.save()
+        if profile is not None:
+            profile.save(files_options.profile)
+
+
+# Files submitted to the workers ahead of the ones being processed. Files are taken from the
+# directory scan as workers become free, so that the number of futures stays bounded.
+PENDING_FILES_PER_WORKER = 4
+
+
+def process_files(
+    files: Iterable[Tuple[str, str]],
+    files_options: FilesOptions,
+    drawing_options: DrawingOptions,
+    specific_options: Union[GridOptions, InsertOptions],
+    manifest: Optional[Manifest],
+    profile: Optional[Profile],
+):
+    def file_done(input_file, output_file, timings):
+        if manifest is not None:
+            manifest.record(input_file, output_file)
+        if profile is not None:
+            profile.add_file(input_file, output_file, timings)
+
+    # The standard streams belong to this process, and hold a single document anyway
+    uses_stdio = STDIO in (str(files_options.file), str(files_options.output))
+
+    if (
+        files_options.workers <= 1
+        or files_options.executor == Executors.SERIAL.value
+        or uses_stdio
+    ):
+        for input_file, output_file in files:
+            with record_timings() as timings:
+                add_watermark_to_file(
+                    input_file, output_file, drawing_options, specific_options
+                )
+            file_done(input_file, output_file, timings)
+        return
+
+    if files_options.executor == Executors.PROCESS.value:
+        # Loads multiprocessing, which is not needed otherwise
+        from concurrent.futures import ProcessPoolExecutor
+
+        executor = ProcessPoolExecutor(
+            max_workers=files_options.workers,
+            initializer=_init_worker,
+            initargs=(drawing_options, specific_options),
+        )
+        process_file = _add_watermark_in_worker
     else:
-        for input_file, output_file in files_options:
-            process_file(input_file, output_file)
+        executor = ThreadPoolExecutor(max_workers=files_options.workers)
+
+        def process_file(input_file, output_file):
+            with record_timings() as timings:
+                add_watermark_to_pdf(
+                    input_file, output_file, drawing_options, specific_options
+                )
+            return timings
+
+    with executor:
+        futures = {}
+        large_files = []
+        max_pending_files = PENDING_FILES_PER_WORKER * files_options.workers
+        for input_file, output_file in files:
+            if is_large_pdf(input_file, files_options, drawing_options):
+                large_files.append((input_file, output_file))
+                continue
+
+            if len(futures) >= max_pending_files:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file_done(*futures.pop(future), future.result())
+
+            future = executor.submit(process_file, input_file, output_file)
+            futures[future] = (input_file, output_file)
+
+        # Large files are assembled here while their pages are merged by the workers
+        for input_file, output_file in large_files:
+            with record_timings() as timings:
+                add_watermark_to_large_pdf(
+                    input_file,
+                    output_file,
+                    drawing_options,
+                    specific_options,
+                    executor,
+                    files_options.workers,
+                )
+            file_done(input_file, output_file, timings)
+
+        for future in as_completed(futures):
+            file_done(*futures[future], future.result())
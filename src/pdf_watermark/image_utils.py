@@ -0,0 +1,434 @@
+"""
+Image utilities for pdf-watermark.
+Prepares image watermarks: the image is downsampled to the resolution it is drawn at, and its image
+and soft mask streams are encoded once and shared by all the stamps of the process.
+Also encodes rasterized pages, with the encoding chosen by the user or by page content.
+"""
+
+import copy
+import hashlib
+import struct
+import threading
+import zlib
+from dataclasses import dataclass
+from io import BytesIO
+from math import ceil
+from typing import Dict, Optional, Tuple
+from weakref import WeakKeyDictionary
+
+import numpy as np
+from reportlab.lib.rl_accel import asciiBase85Decode
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase.pdfdoc import (
+    PDFArray,
+    PDFDictionary,
+    PDFImageXObject,
+    PDFName,
+    PDFObjectReference,
+    PDFStream,
+)
+from reportlab.pdfgen import canvas
+
+from pdf_watermark.options import RasterEncodings
+
+# Resolution of a PDF point
+POINTS_PER_INCH = 72
+
+
+def get_target_size(
+    image_size: Tuple[int, int], width: float, height: float, dpi: int
+) -> Tuple[int, int]:
+    """
+    Size in pixels of an image drawn width x height points large, at dpi dots per inch.
+
+    The aspect ratio is kept, and images are never upsampled. A dpi of 0 keeps the original size.
+    """
+    image_width, image_height = image_size
+    if dpi <= 0:
+        return image_width, image_height
+
+    ratio = max(
+        width * dpi / POINTS_PER_INCH / image_width,
+        height * dpi / POINTS_PER_INCH / image_height,
+    )
+    if ratio >= 1:
+        return image_width, image_height
+
+    return max(1, ceil(image_width * ratio)), max(1, ceil(image_height * ratio))
+
+
+def resize_image(image: ImageReader, size: Tuple[int, int]) -> ImageReader:
+    from PIL import Image
+
+    pil_image = image._image
+    # Palette images can only be resized with the nearest neighbour filter
+    if pil_image.mode in ("LA", "RGBA", "PA") or "transparency" in pil_image.info:
+        pil_image = pil_image.convert("RGBA")
+    elif pil_image.mode not in ("L", "RGB", "CMYK"):
+        pil_image = pil_image.convert("RGB")
+
+    return ImageReader(pil_image.resize(size, Image.LANCZOS))
+
+
+# Color spaces of the modes returned by ImageReader.getRGBData
+COLOR_SPACES = {"L": "DeviceGray", "RGB": "DeviceRGB", "CMYK": "DeviceCMYK"}
+
+
+def _flate_xobject(name: str, image: ImageReader) -> PDFImageXObject:
+    # Same as PDFImageXObject.loadImageFromSRC, without the ASCII85 encoding reportlab may add for
+    # readability, which makes the streams 25% larger and holds the GIL
+    raw_data = image.getRGBData()
+    xobject = PDFImageXObject(name)
+    xobject.width, xobject.height = image.getSize()
+    xobject.streamContent = zlib.compress(raw_data)
+    xobject._filters = ("FlateDecode",)
+    xobject.colorSpace = COLOR_SPACES[image.mode]
+    xobject.bitsPerComponent = 8
+    return xobject
+
+
+class PreparedImage:
+    """
+    Image XObject of a watermark, and its soft mask, encoded once and drawn on any number of canvases.
+
+    This is what Canvas.drawImage does, except that the image is not encoded again for each document.
+    """
+
+    def __init__(self, image: ImageReader):
+        self.width, self.height = image.getSize()
+        digest = hashlib.sha256(image.getRGBData())
+        # Images may only differ by their transparency
+        if image._dataA is not None:
+            digest.update(image._dataA.getRGBData())
+        digest.update(f"{self.width}x{self.height}".encode())
+        self.name = digest.hexdigest()
+        self.smask: Optional[PDFImageXObject] = None
+
+        if image.jpeg_fh() is not None:
+            # JPEG files are embedded as they are
+            self.xobject = PDFImageXObject(self.name, image)
+            if self.xobject._filters[0] == "ASCII85Decode":
+                self.xobject.streamContent = asciiBase85Decode(
+                    self.xobject.streamContent
+                )
+                self.xobject._filters = self.xobject._filters[1:]
+            return
+
+        self.xobject = _flate_xobject(self.name, image)
+        if image._dataA is not None:
+            self.smask = _flate_xobject(f"{self.name}-smask", image._dataA)
+            self.smask._decode = [0, 1]
+        else:
+            transparent = image.getTransparent()
+            if transparent:
+                self.xobject.mask = tuple(
+                    value for value in transparent for _ in range(2)
+                )
+
+    @classmethod
+    def from_xobjects(
+        cls, xobject: PDFImageXObject, smask: Optional[PDFImageXObject] = None
+    ) -> "PreparedImage":
+        """Prepared image made of already encoded streams, named after their content."""
+        digest = hashlib.sha256(xobject.streamContent)
+        if smask is not None:
+            digest.update(smask.streamContent)
+        digest.update(f"{xobject.width}x{xobject.height}".encode())
+
+        prepared_image = cls.__new__(cls)
+        prepared_image.width, prepared_image.height = xobject.width, xobject.height
+        prepared_image.name = xobject.name = digest.hexdigest()
+        if smask is not None:
+            smask.name = f"{prepared_image.name}-smask"
+        prepared_image.xobject = xobject
+        prepared_image.smask = smask
+        return prepared_image
+
+    def _register(self, watermark: canvas.Canvas) -> str:
+        document = watermark._doc
+        registered_name = document.getXObjectName(self.name)
+        if registered_name in document.idToObject:
+            return registered_name
+
+        # The objects are copied, since reportlab records in them the document they belong to.
+        # Copies share the encoded streams.
+        xobject = copy.copy(self.xobject)
+        if self.smask is not None:
+            smask_name = document.getXObjectName(self.smask.name)
+            if smask_name not in document.idToObject:
+                document.Reference(copy.copy(self.smask), smask_name)
+            xobject.smask = PDFObjectReference(smask_name)
+
+        document.Reference(xobject, registered_name)
+        document.addForm(self.name, xobject)
+        return registered_name
+
+    def draw(
+        self,
+        watermark: canvas.Canvas,
+        x: float,
+        y: float,
+        width: float,
+        height: float,
+    ):
+        """Draw the image with its bottom left corner at (x, y), like Canvas.drawImage."""
+        registered_name = self._register(watermark)
+
+        watermark._currentPageHasImages = 1
+        watermark.saveState()
+        watermark.translate(x, y)
+        watermark.scale(width, height)
+        watermark._code.append(f"/{registered_name} Do")
+        watermark.restoreState()
+        watermark._formsinuse.append(self.name)
+
+
+_PREPARED_IMAGES: "WeakKeyDictionary[ImageReader, Dict[Tuple[int, int], PreparedImage]]" = WeakKeyDictionary()
+_PREPARED_IMAGES_LOCK = threading.Lock()
+
+
+def prepare_image(
+    image: ImageReader, width: float, height: float, dpi: int
+) -> PreparedImage:
+    """
+    Get the prepared version of an image drawn width x height points large.
+
+    Prepared images are kept as long as the image, one per target size, so the image is only
+    resized and encoded once for all the stamps of all the files sharing the same drawing options.
+    """
+    target_size = get_target_size(image.getSize(), width, height, dpi)
+
+    with _PREPARED_IMAGES_LOCK:
+        prepared_images = _PREPARED_IMAGES.setdefault(image, {})
+        prepared_image = prepared_images.get(target_size)
+        if prepared_image is None:
+            if target_size != tuple(image.getSize()):
+                prepared_image = PreparedImage(resize_image(image, target_size))
+            else:
+                prepared_image = PreparedImage(image)
+            prepared_images[target_size] = prepared_image
+
+    return prepared_image
+
+
+class _RasterImageXObject(PDFImageXObject):
+    """PDFImageXObject that may also use PNG predictors and an indexed color space."""
+
+    decodeParms: Optional[Dict] = None
+    palette: Optional[bytes] = None
+
+    def format(self, document):
+        stream = PDFStream(content=self.streamContent)
+        dictionary = stream.dictionary
+        dictionary["Type"] = PDFName("XObject")
+        dictionary["Subtype"] = PDFName("Image")
+        dictionary["Width"] = self.width
+        dictionary["Height"] = self.height
+        dictionary["BitsPerComponent"] = self.bitsPerComponent
+        if self.palette is not None:
+            dictionary["ColorSpace"] = PDFArray(
+                [
+                    PDFName("Indexed"),
+                    PDFName("DeviceRGB"),
+                    len(self.palette) // 3 - 1,
+                    b"<" + self.palette.hex().encode() + b">",
+                ]
+            )
+        else:
+            dictionary["ColorSpace"] = PDFName(self.colorSpace)
+        if getattr(self, "_decode", None):
+            dictionary["Decode"] = PDFArray(self._decode)
+        dictionary["Filter"] = PDFArray([PDFName(name) for name in self._filters])
+        if self.decodeParms is not None:
+            # One set of parameters per filter, like the filters
+            dictionary["DecodeParms"] = PDFArray([PDFDictionary(self.decodeParms)])
+        if getattr(self, "smask", None):
+            dictionary["SMask"] = self.smask
+        return stream.format(document)
+
+
+def _png_data(image, compression_level: int) -> Tuple[bytes, int]:
+    """Image data of a PNG file, which is a Flate stream using PNG predictors, and its bit depth."""
+    buffer = BytesIO()
+    image.save(buffer, "PNG", compress_level=compression_level)
+    data = buffer.getvalue()
+
+    chunks = []
+    bits_per_component = 8
+    position = 8
+    while position < len(data):
+        length, chunk_type = struct.unpack(">I4s", data[position : position + 8])
+        chunk = data[position + 8 : position + 8 + length]
+        if chunk_type == b"IHDR":
+            bits_per_component = chunk[8]
+        elif chunk_type == b"IDAT":
+            chunks.append(chunk)
+        position += 12 + length
+
+    return b"".join(chunks), bits_per_component
+
+
+def to_palette_image(image):
+    """Lossless palette version of an RGB image with at most 256 colors, or None."""
+    from PIL import Image
+
+    colors = image.getcolors(256)
+    if colors is None:
+        return None
+
+    pixels = np.asarray(image, dtype=np.uint32)
+    packed_pixels = (pixels[..., 0] << 16) | (pixels[..., 1] << 8) | pixels[..., 2]
+    packed_colors = np.array(
+        sorted((r << 16) | (g << 8) | b for _, (r, g, b) in colors), dtype=np.uint32
+    )
+
+    palette_image = Image.fromarray(
+        np.searchsorted(packed_colors, packed_pixels).astype(np.uint8), "P"
+    )
+    palette_image.putpalette(
+        np.stack(
+            [packed_colors >> 16, (packed_colors >> 8) & 0xFF, packed_colors & 0xFF],
+            axis=-1,
+        )
+        .astype(np.uint8)
+        .tobytes()
+    )
+    return palette_image
+
+
+def split_alpha(image):
+    """
+    Split a page image into its colors and its alpha channel.
+
+    The alpha channel is dropped when the image is opaque, and the colors are reduced to
+    grayscale when the image has no color.
+    """
+    from PIL import ImageChops
+
+    alpha = None
+    if image.mode in ("RGBA", "LA"):
+        alpha = image.getchannel("A")
+        if alpha.getextrema() == (255, 255):
+            alpha = None
+        image = image.convert(image.mode[:-1])
+
+    if image.mode == "P":
+        image = image.convert("RGB")
+
+    if image.mode == "RGB":
+        red, green, blue = image.split()
+        if (
+            ImageChops.difference(red, green).getbbox() is None
+            and ImageChops.difference(green, blue).getbbox() is None
+        ):
+            image = red
+
+    return image, alpha
+
+
+# Size of the sample of a page used to guess its content
+CONTENT_SAMPLE_SIZE = 256
+# Pages with less of their pixels of the most common color are considered photographic
+PHOTOGRAPHIC_THRESHOLD = 0.5
+
+
+def is_photographic(image) -> bool:
+    """
+    Whether a page image looks like a photograph or a scan rather than text and vector graphics.
+
+    Text and vector graphics leave most pixels of the background color, while photographs and
+    scans have noise everywhere.
+    """
+    from PIL import Image
+
+    sample = image.resize(
+        (min(image.width, CONTENT_SAMPLE_SIZE), min(image.height, CONTENT_SAMPLE_SIZE)),
+        Image.NEAREST,
+    )
+    pixel_count = sample.width * sample.height
+    most_common_count = max(sample.getcolors(pixel_count))[0]
+    return most_common_count < PHOTOGRAPHIC_THRESHOLD * pixel_count
+
+
+@dataclass(frozen=True)
+class RasterEncoder:
+    """
+    How the images of rasterized pages are encoded.
+
+    Encodings are those of RasterEncodings: flate compresses the raw pixels, png also uses PNG
+    predictors, which is slower but smaller for smooth images, jpeg is lossy, and auto uses jpeg
+    for photographic pages and flate otherwise, which is best for text. Lossless encodings store
+    images without color as grayscale, and images with few colors with a palette. Transparency is
+    always stored as a Flate soft mask.
+    """
+
+    encoding: str = RasterEncodings.FLATE.value
+    quality: int = 85
+    compression_level: int = 6
+
+    def _encode_lossless(self, image, predictors: bool) -> _RasterImageXObject:
+        palette = None
+        if image.mode == "RGB":
+            palette_image = to_palette_image(image)
+            if palette_image is not None:
+                image = palette_image
+                palette = bytes(palette_image.getpalette())
+
+        xobject = _RasterImageXObject("")
+        xobject.width, xobject.height = image.size
+        xobject.colorSpace = "DeviceRGB" if image.mode == "RGB" else "DeviceGray"
+        xobject._filters = ("FlateDecode",)
+        if predictors:
+            xobject.streamContent, xobject.bitsPerComponent = _png_data(
+                image, self.compression_level
+            )
+            xobject.decodeParms = {
+                "Predictor": 15,
+                "Colors": 3 if image.mode == "RGB" else 1,
+                "BitsPerComponent": xobject.bitsPerComponent,
+                "Columns": image.width,
+            }
+        else:
+            xobject.streamContent = zlib.compress(
+                image.tobytes(), self.compression_level
+            )
+            xobject.bitsPerComponent = 8
+
+        xobject.palette = palette
+        return xobject
+
+    def _encode_jpeg(self, image) -> _RasterImageXObject:
+        buffer = BytesIO()
+        image.save(buffer, "JPEG", quality=self.quality)
+
+        xobject = _RasterImageXObject("")
+        xobject.width, xobject.height = image.size
+        xobject.colorSpace = "DeviceRGB" if image.mode == "RGB" else "DeviceGray"
+        xobject.bitsPerComponent = 8
+        xobject.streamContent = buffer.getvalue()
+        xobject._filters = ("DCTDecode",)
+        return xobject
+
+    def encode(self, image) -> PreparedImage:
+        """Encode a PIL image of a page."""
+        encoding = self.encoding
+        if encoding == RasterEncodings.AUTO.value:
+            encoding = (
+                RasterEncodings.JPEG.value
+                if is_photographic(image)
+                else RasterEncodings.FLATE.value
+            )
+
+        image, alpha = split_alpha(image)
+        predictors = encoding != RasterEncodings.FLATE.value
+        if encoding == RasterEncodings.JPEG.value:
+            xobject = self._encode_jpeg(image)
+        else:
+            xobject = self._encode_lossless(image, predictors)
+
+        smask = None
+        if alpha is not None:
+            smask = self._encode_lossless(alpha, predictors)
+            smask._decode = [0, 1]
+
+        return PreparedImage.from_xobjects(xobject, smask)
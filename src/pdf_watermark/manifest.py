@@ -0,0 +1,143 @@
+"""
+Manifest utilities for pdf-watermark.
+Records the files produced by a run, so that files that did not change are skipped by the next run.
+"""
+
+import hashlib
+import json
+import os
+from typing import Dict, Optional, Union
+
+from pdf_watermark.cache import options_fingerprint
+from pdf_watermark.options import (
+    DrawingOptions,
+    FilesOptions,
+    GridOptions,
+    InsertOptions,
+)
+
+MANIFEST_NAME = ".pdf-watermark-manifest.json"
+MANIFEST_VERSION = 1
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_state(path: str, previous: Optional[Dict] = None) -> Dict:
+    """
+    Return the size, modification time and content hash of a file.
+
+    The hash is only computed when the size or the modification time differ from previous, so
+    that unchanged files are not read again.
+    """
+    stat = os.stat(path)
+    if (
+        previous is not None
+        and previous["size"] == stat.st_size
+        and previous["mtime_ns"] == stat.st_mtime_ns
+    ):
+        sha256 = previous["sha256"]
+    else:
+        sha256 = file_digest(path)
+
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256}
+
+
+def get_manifest_path(files_options: FilesOptions) -> str:
+    """The manifest is stored at the root of the output directory, or next to the output file."""
+    output = (
+        files_options.file if files_options.output is None else files_options.output
+    )
+    if os.path.isdir(files_options.file):
+        return os.path.join(output, MANIFEST_NAME)
+    return os.path.join(os.path.dirname(os.path.abspath(output)), MANIFEST_NAME)
+
+
+class Manifest:
+    """
+    Input hash, options fingerprint and output hash of each file handled in previous runs.
+
+    A file is up to date when the options did not change, the output is the one that was written
+    by the last run, and the input did not change since. When the input is overwritten, only the
+    output is checked.
+    """
+
+    def __init__(self, path: str, fingerprint: str):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.directory = os.path.dirname(os.path.abspath(path))
+        self.files: Dict[str, Dict] = {}
+
+        if os.path.isfile(path):
+            with open(path, "r") as f:
+                data = json.load(f)
+            if data.get("version") == MANIFEST_VERSION:
+                self.files = data["files"]
+
+    @classmethod
+    def from_options(
+        cls,
+        files_options: FilesOptions,
+        drawing_options: DrawingOptions,
+        specific_options: Union[GridOptions, InsertOptions],
+    ) -> "Manifest":
+        # All the options are included, since the output depends on all of them
+        fingerprint = options_fingerprint(drawing_options, specific_options, exclude=())
+        if drawing_options.image_path is not None:
+            fingerprint += file_digest(drawing_options.image_path)
+
+        return cls(get_manifest_path(files_options), fingerprint)
+
+    def _key(self, output_file: str) -> str:
+        return os.path.relpath(os.path.abspath(output_file), self.directory)
+
+    def is_up_to_date(self, input_file: str, output_file: str) -> bool:
+        entry = self.files.get(self._key(output_file))
+        if entry is None or entry["options"] != self.fingerprint:
+            return False
+
+        if not os.path.isfile(output_file):
+            return False
+        if (
+            file_state(output_file, entry["output"])["sha256"]
+            != entry["output"]["sha256"]
+        ):
+            return False
+
+        if entry["input"] is None:
+            return True
+        return (
+            file_state(input_file, entry["input"])["sha256"] == entry["input"]["sha256"]
+        )
+
+    def record(self, input_file: str, output_file: str):
+        """Record a file that was just written."""
+        key = self._key(output_file)
+        previous = self.files.get(key, {})
+
+        # An overwritten input is the output itself
+        if os.path.exists(output_file) and os.path.samefile(input_file, output_file):
+            input_state = None
+        else:
+            input_state = file_state(input_file, previous.get("input"))
+
+        self.files[key] = {
+            "options": self.fingerprint,
+            "input": input_state,
+            "output": file_state(output_file),
+        }
+
+    def save(self):
+        # Written to a temporary file first, so that an interrupted run leaves a valid manifest
+        os.makedirs(self.directory, exist_ok=True)
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w") as f:
+            json.dump({"version": MANIFEST_VERSION, "files": self.files}, f)
+        os.replace(temporary_path, self.path)
@@ -0,0 +1,291 @@
+"""
+Merge utilities for pdf-watermark.
+Draws a watermark stamp on pages by reference, through a Form XObject shared by all the pages.
+"""
+
+import zlib
+from typing import Iterable, Optional, Set, Tuple
+
+import pypdf
+from pypdf.generic import (
+    ArrayObject,
+    ContentStream,
+    DecodedStreamObject,
+    DictionaryObject,
+    FloatObject,
+    IndirectObject,
+    NameObject,
+    StreamObject,
+)
+
+STAMP_XOBJECT_PREFIX = "/PdfWatermarkStamp"
+
+RESOURCE_CATEGORIES = (
+    "/ExtGState",
+    "/ColorSpace",
+    "/Pattern",
+    "/Shading",
+    "/XObject",
+    "/Font",
+    "/Properties",
+)
+
+
+def _unused_name(name: str, used_names: Set[str]) -> NameObject:
+    """
+    Return name, or name with a counter suffix if it is already used, like merge_page renames the
+    resources of a stamp. The returned name is added to used_names.
+    """
+    candidate, suffix = name, 0
+    while candidate in used_names:
+        suffix += 1
+        candidate = f"{name}-{suffix}"
+    used_names.add(candidate)
+    return NameObject(candidate)
+
+
+def _add_stream(pdf_writer: pypdf.PdfWriter, data: bytes) -> IndirectObject:
+    stream = DecodedStreamObject()
+    stream.set_data(data)
+    return pdf_writer._add_object(stream)
+
+
+def _flate_stream(compressed_data: bytes) -> StreamObject:
+    return StreamObject.initialize_from_dictionary(
+        {
+            NameObject("/Filter"): NameObject("/FlateDecode"),
+            "__streamdata__": compressed_data,
+        }
+    )
+
+
+def create_stamp_xobject(
+    pdf_writer: pypdf.PdfWriter, stamp_page: pypdf.PageObject
+) -> IndirectObject:
+    """
+    Convert a stamp page into a Form XObject stored once in the output document.
+
+    Args:
+        pdf_writer: The document the Form XObject is added to
+        stamp_page: The one page watermark drawn by draw_watermarks
+
+    Returns:
+        An indirect reference to the Form XObject.
+    """
+    form = DecodedStreamObject()
+    form.set_data(stamp_page.get_contents().get_data())
+    form[NameObject("/Type")] = NameObject("/XObject")
+    form[NameObject("/Subtype")] = NameObject("/Form")
+    # The bounding box clips the stamp to its page, like merge_page does
+    form[NameObject("/BBox")] = ArrayObject(
+        [FloatObject(value) for value in stamp_page.mediabox]
+    )
+    form[NameObject("/Resources")] = (
+        stamp_page.get("/Resources", DictionaryObject()).get_object().clone(pdf_writer)
+    )
+
+    return pdf_writer._add_object(form.flate_encode())
+
+
+def draw_stamp_xobject_on_pages(
+    pdf_writer: pypdf.PdfWriter,
+    pages: Iterable[pypdf.PageObject],
+    stamp_xobject: IndirectObject,
+    index: int,
+):
+    """
+    Draw a stamp Form XObject on top of each page, without copying the stamp content.
+
+    The original content of each page is wrapped in a q/Q pair, so that its graphics state does not
+    leak into the stamp. The streams holding these operators are shared by all the pages.
+
+    Args:
+        pdf_writer: The document the pages belong to
+        pages: The pages to watermark
+        stamp_xobject: The Form XObject returned by create_stamp_xobject
+        index: Index of the stamp in the document, used to name the Form XObject. The name is also
+            made unique among the XObjects of the pages, which may already hold a stamp, e.g. when
+            a watermarked document is watermarked again.
+    """
+    pages = list(pages)
+    used_names = set()
+    for page in pages:
+        resources = page.get("/Resources", DictionaryObject()).get_object()
+        used_names.update(resources.get("/XObject", DictionaryObject()).get_object())
+    name = _unused_name(f"{STAMP_XOBJECT_PREFIX}{index}", used_names)
+
+    save_state = _add_stream(pdf_writer, b"q\n")
+    draw_stamp = _add_stream(pdf_writer, b"\nQ\nq " + name.encode() + b" Do Q\n")
+
+    for page in pages:
+        resources = DictionaryObject(
+            page.get("/Resources", DictionaryObject()).get_object()
+        )
+        xobjects = DictionaryObject(
+            resources.get("/XObject", DictionaryObject()).get_object()
+        )
+        xobjects[name] = stamp_xobject
+        resources[NameObject("/XObject")] = xobjects
+        page[NameObject("/Resources")] = resources
+
+        contents = ArrayObject([save_state])
+        if "/Contents" in page:
+            original_contents = page.raw_get("/Contents")
+            if isinstance(original_contents.get_object(), StreamObject):
+                if not isinstance(original_contents, IndirectObject):
+                    original_contents = pdf_writer._add_object(original_contents)
+                contents.append(original_contents)
+            else:
+                contents.extend(original_contents.get_object())
+        contents.append(draw_stamp)
+        page[NameObject("/Contents")] = contents
+
+
+def prepare_stamp_content(
+    pdf_writer: pypdf.PdfWriter,
+    stamp_page: pypdf.PageObject,
+    index: int,
+    pages: Iterable[pypdf.PageObject] = (),
+) -> Tuple[bytes, DictionaryObject]:
+    """
+    Prepare a stamp so that it can be appended to the content of pages, like merge_page does.
+
+    The stamp resources are renamed with a prefix, and a counter suffix if the name is already used
+    by the resources of the pages, e.g. when a watermarked document is watermarked again. The stamp
+    content is clipped to the stamp page and wrapped in a q/Q pair.
+
+    Args:
+        pdf_writer: The document the stamp resources are added to
+        stamp_page: The one page watermark drawn by draw_watermarks
+        index: Index of the stamp in the document, used to name its resources
+        pages: The pages the stamp is merged with
+
+    Returns:
+        A tuple (content, resources) where content is the decoded stamp content to append to the
+        pages, and resources the stamp resources to add to the pages.
+    """
+    used_names = {category: set() for category in RESOURCE_CATEGORIES}
+    for page in pages:
+        page_resources = page.get("/Resources", DictionaryObject()).get_object()
+        for category, names in used_names.items():
+            names.update(page_resources.get(category, DictionaryObject()).get_object())
+
+    stamp_resources = stamp_page.get("/Resources", DictionaryObject()).get_object()
+    resources = DictionaryObject()
+    rename = {}
+    for category in RESOURCE_CATEGORIES:
+        if category not in stamp_resources:
+            continue
+        renamed_entries = DictionaryObject()
+        for name, value in stamp_resources[category].get_object().items():
+            new_name = _unused_name(
+                f"{STAMP_XOBJECT_PREFIX}{index}-{name[1:]}", used_names[category]
+            )
+            rename[name] = new_name
+            renamed_entries[new_name] = value.clone(pdf_writer)
+        resources[NameObject(category)] = renamed_entries
+
+    content = ContentStream(stamp_page.get_contents(), stamp_page.pdf)
+    for operands, _ in content.operations:
+        if isinstance(operands, list):
+            for i, operand in enumerate(operands):
+                if isinstance(operand, NameObject):
+                    operands[i] = rename.get(operand, operand)
+
+    left, bottom, right, top = (float(value) for value in stamp_page.cropbox)
+    clip = f"q {left} {bottom} {right - left} {top - bottom} re W n\n".encode()
+
+    return clip + content.get_data() + b"\nQ\n", resources
+
+
+def merge_stamp_content(
+    page: pypdf.PageObject, stamp_content: bytes, level: int = -1
+) -> bytes:
+    """
+    Compute the compressed content of a page with a stamp prepared by prepare_stamp_content on top.
+
+    This only concatenates and compresses streams, and does not depend on the document the page
+    is written to, so it can run in parallel workers.
+    """
+    original_content = page.get_contents()
+    data = b"q\n"
+    if original_content is not None:
+        data += original_content.get_data()
+    data += b"\nQ\n" + stamp_content
+    return zlib.compress(data, level)
+
+
+def set_merged_page_content(
+    page: pypdf.PageObject, content: bytes, stamp_resources: DictionaryObject
+):
+    """
+    Replace the content of a page with the output of merge_stamp_content and add the stamp
+    resources. Resources of the page are never replaced, see prepare_stamp_content.
+    """
+    resources = DictionaryObject(
+        page.get("/Resources", DictionaryObject()).get_object()
+    )
+    for category, entries in stamp_resources.items():
+        merged_entries = DictionaryObject(
+            resources.get(category, DictionaryObject()).get_object()
+        )
+        for name, value in entries.items():
+            if name not in merged_entries:
+                merged_entries[name] = value
+        resources[NameObject(category)] = merged_entries
+    page[NameObject("/Resources")] = resources
+
+    page.replace_contents(_flate_stream(content))
+
+
+def compress_page_contents(
+    pdf_writer: pypdf.PdfWriter,
+    pages: Iterable[pypdf.PageObject],
+    level: int = -1,
+    changed_objects: Optional[Set[int]] = None,
+):
+    """
+    Flate-encode the content streams of pages that have no filter, unless this does not make them
+    smaller.
+
+    Unlike PageObject.compress_content_streams, the streams of a page are not joined, so streams
+    shared by several pages, like the ones added by draw_stamp_xobject_on_pages, stay shared and
+    are compressed once.
+
+    Args:
+        changed_objects: If given, the numbers of the objects written anyway, e.g. to an
+            incremental update. Other indirect streams are left unchanged.
+    """
+    for page in pages:
+        if "/Contents" not in page:
+            continue
+
+        contents = page.raw_get("/Contents")
+        is_array = isinstance(contents.get_object(), ArrayObject)
+        streams = contents.get_object() if is_array else [contents]
+
+        for i, stream in enumerate(streams):
+            if "/Filter" in stream.get_object():
+                continue
+            if (
+                changed_objects is not None
+                and isinstance(stream, IndirectObject)
+                and stream.idnum not in changed_objects
+            ):
+                continue
+
+            # get_data also serializes the operations of parsed content streams
+            data = stream.get_object().get_data()
+            compressed_data = zlib.compress(data, level)
+            if len(compressed_data) >= len(data):
+                continue
+
+            compressed_stream = _flate_stream(compressed_data)
+            if isinstance(stream, IndirectObject):
+                pdf_writer._replace_object(stream, compressed_stream)
+            elif is_array:
+                streams[i] = pdf_writer._add_object(compressed_stream)
+            else:
+                page[NameObject("/Contents")] = pdf_writer._add_object(
+                    compressed_stream
+                )
@@ -1,16 +1,47 @@
 import os
 from dataclasses import dataclass
 from enum import Enum
+from io import BytesIO
 from pathlib import Path
-from typing import Annotated, List
+from typing import Annotated, BinaryIO, Iterator, List, Optional, Tuple, Union
 
 from dataclass_click import argument, option
-from reportlab.lib.colors import HexColor
-from reportlab.lib.utils import ImageReader
 
 from pdf_watermark.font_utils import register_custom_font
 
 
+def scan_directory(
+    input_directory: str, output_directory: str
+) -> Iterator[Tuple[str, str]]:
+    """
+    Recursively scan directory for PDF files, yielding each input and output file path as soon as it is found.
+
+    Output directories are not created here, but when their first output file is written. Since
+    each input file has its own path relative to input_directory, input and output files are unique
+    without keeping track of them, so memory does not grow with the number of files.
+
+    Args:
+        input_directory: Directory to scan for PDF files
+        output_directory: Corresponding output directory
+
+    Yields:
+        Tuples of (input_file, output_file)
+    """
+    if not os.path.isdir(input_directory):
+        raise ValueError("Directory argument must be a directory.")
+
+    with os.scandir(input_directory) as entries:
+        for entry in entries:
+            input_path = os.path.join(input_directory, entry.name)
+            output_path = os.path.join(output_directory, entry.name)
+
+            if entry.is_dir():
+                yield from scan_directory(input_path, output_path)
+
+            elif entry.is_file() and entry.name.endswith((".pdf", ".PDF")):
+                yield input_path, output_path
+
+
 def add_directory_to_files(
     input_directory: str, output_directory: str
 ) -> tuple[List[str], List[str]]:
@@ -24,31 +55,28 @@ def add_directory_to_files(
     Returns:
         Tuple of (input_files, output_files) lists
     """
-    if not os.path.isdir(input_directory):
-        raise ValueError("Directory argument must be a directory.")
-
     input_files = []
     output_files = []
 
-    for file in os.listdir(input_directory):
-        input_path = os.path.join(input_directory, file)
-        output_path = os.path.join(output_directory, file)
+    for input_file, output_file in scan_directory(input_directory, output_directory):
+        input_files.append(input_file)
+        output_files.append(output_file)
 
-        if os.path.isdir(input_path):
-            sub_input_files, sub_output_files = add_directory_to_files(
-                input_path, output_path
-            )
-            input_files.extend(sub_input_files)
-            output_files.extend(sub_output_files)
+    return input_files, output_files
 
-        elif os.path.isfile(input_path) and input_path.endswith((".pdf", ".PDF")):
-            input_files.append(input_path)
-            output_files.append(output_path)
 
-            if not os.path.exists(output_directory):
-                os.makedirs(output_directory)
+# File name standing for the standard input or output
+STDIO = "-"
 
-    return input_files, output_files
+
+class Executors(Enum):
+    PROCESS = "process"
+    THREAD = "thread"
+    SERIAL = "serial"
+
+    @classmethod
+    def has_value(cls, value):
+        return value in cls._value2member_map_
 
 
 @dataclass
@@ -61,7 +89,7 @@ class FilesOptions:
             "--save",
             default=None,
             show_default=True,
-            help="File or folder to save results to. By default, the input files are overwritten.",
+            help="File or folder to save results to, or - for the standard output. By default, the input files are overwritten, or the result is written to the standard output when reading from the standard input.",
         ),
     ] = None
     dry_run: Annotated[
@@ -83,6 +111,53 @@ class FilesOptions:
             help="Number of parallel workers to use. This can speed up processing of multiple files.",
         ),
     ] = 1
+    executor: Annotated[
+        str,
+        option(
+            "--executor",
+            default="thread",
+            show_default=True,
+            help="How parallel workers are run. Can be one of 'process', 'thread' and 'serial'. Use 'process' to scale across CPU cores on large batches.",
+        ),
+    ] = "thread"
+    page_parallel_threshold: Annotated[
+        int | None,
+        option(
+            "--page-parallel-threshold",
+            default=None,
+            show_default=True,
+            help="Split documents with at least this many pages into chunks of pages watermarked by the parallel workers. By default, each document is handled by a single worker. Has no effect with --merge-mode xobject.",
+        ),
+    ] = None
+    manifest: Annotated[
+        bool,
+        option(
+            "--manifest",
+            is_flag=True,
+            default=False,
+            show_default=True,
+            help="Record the content of the input and output files in a manifest stored with the output files, and skip the files that did not change since the last run with the same options.",
+        ),
+    ] = False
+    profile: Annotated[
+        Path | None,
+        option(
+            "--profile",
+            default=None,
+            show_default=True,
+            help="Save the time spent parsing, drawing, merging, writing and rasterizing each file, and in total, to this JSON file.",
+        ),
+    ] = None
+    cprofile: Annotated[
+        bool,
+        option(
+            "--cprofile",
+            is_flag=True,
+            default=False,
+            show_default=True,
+            help="Also include cProfile statistics of the main process in the --profile file.",
+        ),
+    ] = False
     verbose: Annotated[
         bool,
         option(
@@ -94,16 +169,47 @@ class FilesOptions:
     ] = True
 
     def __post_init__(self):
+        if not Executors.has_value(self.executor):
+            raise ValueError(
+                "Invalid argument. Executor must be either process, thread or serial."
+            )
+
+        to_stdout = self.output is not None and str(self.output) == STDIO
+
+        if self.cprofile and self.profile is None:
+            raise ValueError("Invalid argument. --cprofile requires --profile.")
+
+        if self.manifest and STDIO in (str(self.file), str(self.output)):
+            raise ValueError(
+                "Invalid argument. --manifest cannot be used with the standard input or output."
+            )
+
+        if str(self.file) == STDIO:
+            if (
+                self.output is not None
+                and not to_stdout
+                and not str(self.output).endswith((".pdf", ".PDF"))
+            ):
+                raise ValueError(
+                    "Output must be a pdf file when input is the standard input."
+                )
+            self._files = [(STDIO, STDIO if self.output is None else str(self.output))]
+            return
+
         if not os.path.exists(self.file):
             raise ValueError("Input file or directory does not exist.")
         elif os.path.isdir(self.file):
-            if self.output is not None and str(self.output).endswith((".pdf", ".PDF")):
+            if to_stdout or (
+                self.output is not None and str(self.output).endswith((".pdf", ".PDF"))
+            ):
                 raise ValueError(
                     "Output must be a directory when input is a directory."
                 )
         elif os.path.isfile(self.file) and str(self.file).endswith((".pdf", ".PDF")):
-            if self.output is not None and not str(self.output).endswith(
-                (".pdf", ".PDF")
+            if (
+                self.output is not None
+                and not to_stdout
+                and not str(self.output).endswith((".pdf", ".PDF"))
             ):
                 raise ValueError("Output must be a pdf file when input is a pdf file.")
         else:
@@ -115,27 +221,84 @@ class FilesOptions:
             output = self.output
 
         if os.path.isfile(self.file):
-            self.input_files: List[str] = [str(self.file)]
-            if self.output is None:
-                self.output_files: List[str] = [str(self.file)]
-            else:
-                self.output_files = [str(output)]
+            self._files = [(str(self.file), str(output))]
         else:
-            self.input_files, self.output_files = add_directory_to_files(
-                str(self.file), str(output)
-            )
+            # Directories are scanned lazily, while the files are processed
+            self._files = None
+            self._output_directory = str(output)
+
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        if self._files is not None:
+            return iter(self._files)
+        return scan_directory(str(self.file), self._output_directory)
 
-        if len(self.input_files) != len(set(self.input_files)):
-            raise ValueError("Input files must be unique.")
+    def __next__(self):
+        return next(iter(self))
 
-        if len(self.output_files) != len(set(self.output_files)):
-            raise ValueError("Output files must be unique.")
+    def list_files(self) -> List[Tuple[str, str]]:
+        """
+        All the input and output files.
 
-    def __iter__(self):
-        return iter(zip(self.input_files, self.output_files))
+        The input directory is scanned once, by the first call, and the files are reused by the
+        next calls and iterations instead of being scanned lazily.
+        """
+        if self._files is None:
+            self._files = list(scan_directory(str(self.file), self._output_directory))
+        return self._files
 
-    def __next__(self):
-        return next(zip(self.input_files, self.output_files))
+    @property
+    def input_files(self) -> List[str]:
+        return [input_file for input_file, _ in self.list_files()]
+
+    @property
+    def output_files(self) -> List[str]:
+        return [output_file for _, output_file in self.list_files()]
+
+
+def get_image_path(watermark: str) -> Optional[str]:
+    """Path of the image file named by a watermark, or None if the watermark is a text."""
+    potential_image_path = os.path.join(os.getcwd(), watermark)
+    if watermark.endswith(
+        (".png", ".jpg", ".jpeg", ".PNG", ".JPG", ".JPEG")
+    ) and os.path.isfile(potential_image_path):
+        return potential_image_path
+    return None
+
+
+def load_image(image: Union[str, BinaryIO]):
+    # Image support is only loaded for image watermarks
+    from reportlab.lib.utils import ImageReader
+
+    return ImageReader(image)
+
+
+class UnselectableModes(Enum):
+    IMAGE = "image"
+    OUTLINES = "outlines"
+
+    @classmethod
+    def has_value(cls, value):
+        return value in cls._value2member_map_
+
+
+class RasterEncodings(Enum):
+    AUTO = "auto"
+    PNG = "png"
+    JPEG = "jpeg"
+    FLATE = "flate"
+
+    @classmethod
+    def has_value(cls, value):
+        return value in cls._value2member_map_
+
+
+class MergeModes(Enum):
+    CONTENT = "content"
+    XOBJECT = "xobject"
+
+    @classmethod
+    def has_value(cls, value):
+        return value in cls._value2member_map_
 
 
 @dataclass
@@ -194,9 +357,18 @@ class DrawingOptions:
             is_flag=True,
             default=False,
             show_default=True,
-            help="Make the watermark text unselectable. This works by drawing the text as an image, and thus results in a larger file size.",
+            help="Make the watermark text unselectable. See --unselectable-mode for how this is done.",
         ),
     ] = False
+    unselectable_mode: Annotated[
+        str,
+        option(
+            "--unselectable-mode",
+            default="image",
+            show_default=True,
+            help="How the watermark text is made unselectable. Can be one of 'image' and 'outlines'. With 'image', the watermark is drawn as an image, which requires poppler and results in a larger file size. With 'outlines', the characters are drawn as vector shapes, which keeps the watermark sharp and small but is not supported by CID fonts.",
+        ),
+    ] = "image"
     image_scale: Annotated[
         float,
         option(
@@ -207,6 +379,15 @@ class DrawingOptions:
             help="Scale factor for the image. Note that before this factor is applied, the image is already scaled down to fit in the boxes.",
         ),
     ] = 1
+    image_dpi: Annotated[
+        int,
+        option(
+            "--image-dpi",
+            default=300,
+            show_default=True,
+            help="Resolution of the image watermark. Larger images are downsampled to this resolution at the size they are drawn at, which keeps the output small. Use 0 to keep the original image.",
+        ),
+    ] = 300
     save_as_image: Annotated[
         bool,
         option(
@@ -226,6 +407,61 @@ class DrawingOptions:
             help="DPI to use when saving the PDF as an image.",
         ),
     ] = 300
+    max_raster_memory: Annotated[
+        int,
+        option(
+            "--max-raster-memory",
+            default=512,
+            show_default=True,
+            help="Maximum memory in MB used by page images when saving the PDF as an image. Pages are rasterized a few at a time to stay below this limit, but always at least one page at a time.",
+        ),
+    ] = 512
+    raster_workers: Annotated[
+        int | None,
+        option(
+            "--raster-workers",
+            default=None,
+            show_default=True,
+            help="Number of pages rasterized and encoded in parallel when saving the PDF as an image. By default, the number of CPU cores.",
+        ),
+    ] = None
+    persistent_stamp_cache: Annotated[
+        bool,
+        option(
+            "--persistent-stamp-cache",
+            is_flag=True,
+            default=False,
+            show_default=True,
+            help="Keep the watermarks rasterized by --unselectable on disk, so that the next runs with the same options and page sizes reuse them instead of rasterizing them again. They are stored in the pdf-watermark folder of the user cache directory, or in PDF_WATERMARK_CACHE_DIR if set.",
+        ),
+    ] = False
+    raster_encoding: Annotated[
+        str,
+        option(
+            "--raster-encoding",
+            default="flate",
+            show_default=True,
+            help="How rasterized pages and watermarks are encoded. Can be one of 'flate', 'png', 'jpeg' and 'auto'. 'flate' is the fastest and suited to text, 'png' is slower but produces smaller files for smooth images, 'jpeg' is lossy and suited to photographs and scans, and 'auto' uses 'jpeg' for the pages that look like photographs and 'flate' for the others. Lossless encodings store pages without color in grayscale.",
+        ),
+    ] = "flate"
+    raster_quality: Annotated[
+        int,
+        option(
+            "--raster-quality",
+            default=85,
+            show_default=True,
+            help="Quality of the rasterized pages encoded as JPEG, from 1 (smallest) to 95 (best).",
+        ),
+    ] = 85
+    raster_compression_level: Annotated[
+        int,
+        option(
+            "--raster-compression-level",
+            default=6,
+            show_default=True,
+            help="Compression level of the rasterized pages encoded as flate or PNG, from 0 (fastest) to 9 (smallest).",
+        ),
+    ] = 6
     custom_fonts_folder: Annotated[
         Path | None,
         option(
@@ -235,24 +471,186 @@ class DrawingOptions:
             help="Folder path containing custom font files (TTF, OTF, etc.) to search for non-standard fonts.",
         ),
     ] = None
+    merge_mode: Annotated[
+        str,
+        option(
+            "--merge-mode",
+            default="content",
+            show_default=True,
+            help="How the watermark is added to the pages. Can be one of 'content' and 'xobject'. With 'content', the watermark drawing is copied into every page. With 'xobject', it is stored once per page size and referenced by every page, which is faster and produces smaller files for long documents.",
+        ),
+    ] = "content"
+    incremental: Annotated[
+        bool,
+        option(
+            "--incremental",
+            is_flag=True,
+            default=False,
+            show_default=True,
+            help="Append the watermark to the original file as a PDF incremental update instead of rewriting the whole document. This is much faster for large files. Cannot be used with --save-as-image.",
+        ),
+    ] = False
+    compress: Annotated[
+        bool,
+        option(
+            "--compress",
+            is_flag=True,
+            default=False,
+            show_default=True,
+            help="Compress the page content streams that are not compressed yet, including the ones created when adding the watermark. With --incremental, only the streams written to the update are compressed.",
+        ),
+    ] = False
+    compression_level: Annotated[
+        int,
+        option(
+            "--compression-level",
+            default=6,
+            show_default=True,
+            help="Compression level used for the page content streams, from 0 (fastest) to 9 (smallest).",
+        ),
+    ] = 6
+    deduplicate: Annotated[
+        bool,
+        option(
+            "--deduplicate",
+            is_flag=True,
+            default=False,
+            show_default=True,
+            help="Store identical objects, such as fonts or images, only once and remove unused objects. Cannot be used with --incremental.",
+        ),
+    ] = False
 
     def __post_init__(self):
+        if not MergeModes.has_value(self.merge_mode):
+            raise ValueError(
+                "Invalid argument. Merge mode must be either content or xobject."
+            )
+
+        if not UnselectableModes.has_value(self.unselectable_mode):
+            raise ValueError(
+                "Invalid argument. Unselectable mode must be either image or outlines."
+            )
+
+        if self.incremental and self.save_as_image:
+            raise ValueError(
+                "Invalid argument. --incremental cannot be used with --save-as-image."
+            )
+
+        if self.incremental and self.deduplicate:
+            raise ValueError(
+                "Invalid argument. --incremental cannot be used with --deduplicate."
+            )
+
+        if self.max_raster_memory <= 0:
+            raise ValueError(
+                "Invalid argument. Maximum raster memory must be positive."
+            )
+
+        if self.raster_workers is not None and self.raster_workers < 1:
+            raise ValueError(
+                "Invalid argument. The number of raster workers must be at least 1."
+            )
+
+        if self.image_dpi < 0:
+            raise ValueError(
+                "Invalid argument. Image DPI must be positive, or 0 to keep the original image."
+            )
+
+        if not RasterEncodings.has_value(self.raster_encoding):
+            raise ValueError(
+                "Invalid argument. Raster encoding must be one of auto, png, jpeg and flate."
+            )
+
+        if not 1 <= self.raster_quality <= 95:
+            raise ValueError(
+                "Invalid argument. Raster quality must be between 1 and 95."
+            )
+
+        if not 0 <= self.raster_compression_level <= 9:
+            raise ValueError(
+                "Invalid argument. Raster compression level must be between 0 and 9."
+            )
+
+        if not 0 <= self.compression_level <= 9:
+            raise ValueError(
+                "Invalid argument. Compression level must be between 0 and 9."
+            )
+
         self.image = None
+        self.image_path = None
+        self.image_data = None
         self.text = None
 
-        potential_image_path = os.path.join(os.getcwd(), self.watermark)
-        if self.watermark.endswith(
-            (".png", ".jpg", ".jpeg", ".PNG", ".JPG", ".JPEG")
-        ) and os.path.isfile(potential_image_path):
-            self.image = ImageReader(self.watermark)
+        self.image_path = get_image_path(self.watermark)
+        if self.image_path is not None:
+            self.image = load_image(self.image_path)
         else:
             self.text = self.watermark
 
+        from reportlab.lib.colors import HexColor
+
         self.text_color = HexColor(self.text_color)
 
         # Register the font if needed
         register_custom_font(self.text_font, self.custom_fonts_folder)
 
+        if (
+            self.text is not None
+            and self.unselectable
+            and self.unselectable_mode == UnselectableModes.OUTLINES.value
+        ):
+            from pdf_watermark.outlines import get_font_outlines
+
+            # Fail early if the font does not provide outlines
+            get_font_outlines(self.text_font)
+
+    @classmethod
+    def from_image(cls, image: Union[bytes, BinaryIO], **kwargs) -> "DrawingOptions":
+        """
+        Create drawing options for an image watermark held in memory rather than in a file.
+
+        Args:
+            image: The encoded image (PNG, JPEG, ...), as bytes or as a binary stream
+            kwargs: The other DrawingOptions fields
+
+        Returns:
+            The drawing options, with the image already decoded.
+        """
+        if not isinstance(image, bytes):
+            image = image.read()
+
+        drawing_options = cls(watermark="", **kwargs)
+        drawing_options.text = None
+        drawing_options.image_data = image
+        drawing_options.image = load_image(BytesIO(image))
+        return drawing_options
+
+    def __getstate__(self):
+        # The decoded image is dropped and reloaded from its path or its encoded data on unpickling,
+        # which keeps the payload sent to worker processes small.
+        state = self.__dict__.copy()
+        state["image"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.image_path is not None:
+            self.image = load_image(self.image_path)
+        elif self.image_data is not None:
+            self.image = load_image(BytesIO(self.image_data))
+
+        # Fonts are registered per process, so they must be registered again
+        register_custom_font(self.text_font, self.custom_fonts_folder)
+
+
+class GridRenderings(Enum):
+    REPEAT = "repeat"
+    FORM = "form"
+
+    @classmethod
+    def has_value(cls, value):
+        return value in cls._value2member_map_
+
 
 @dataclass
 class GridOptions:
@@ -287,6 +685,21 @@ class GridOptions:
             help="Wether to leave a margin around the page or not. When False (default), the watermark will be cut on the PDF edges.",
         ),
     ] = False
+    rendering: Annotated[
+        str,
+        option(
+            "--rendering",
+            default="repeat",
+            show_default=True,
+            help="How the grid is drawn. Can be one of 'repeat' and 'form'. With 'repeat', the watermark is drawn once per box. With 'form', it is drawn once and referenced by every box, which keeps the watermark small for dense grids.",
+        ),
+    ] = "repeat"
+
+    def __post_init__(self):
+        if not GridRenderings.has_value(self.rendering):
+            raise ValueError(
+                "Invalid argument. Rendering must be either repeat or form."
+            )
 
 
 class Alignments(Enum):
@@ -337,3 +750,70 @@ class InsertOptions:
             raise Exception(
                 "Invalid argument. Horizontal alignment must be either left, right or center."
             )
+
+
+@dataclass
+class ServerOptions:
+    host: Annotated[
+        str,
+        option(
+            "--host",
+            default="127.0.0.1",
+            show_default=True,
+            help="Address to listen on.",
+        ),
+    ] = "127.0.0.1"
+    port: Annotated[
+        int,
+        option(
+            "--port",
+            default=8000,
+            show_default=True,
+            help="Port to listen on.",
+        ),
+    ] = 8000
+    socket: Annotated[
+        Path | None,
+        option(
+            "--socket",
+            default=None,
+            show_default=True,
+            help="Path of a Unix socket to listen on instead of a TCP port.",
+        ),
+    ] = None
+    max_concurrency: Annotated[
+        int | None,
+        option(
+            "--max-concurrency",
+            default=None,
+            show_default=True,
+            help="Maximum number of documents watermarked at the same time. By default, the number of CPU cores.",
+        ),
+    ] = None
+    max_request_size: Annotated[
+        int,
+        option(
+            "--max-request-size",
+            default=100,
+            show_default=True,
+            help="Maximum size in MB of the documents sent to the server. Larger requests are rejected with status 413.",
+        ),
+    ] = 100
+    verbose: Annotated[
+        bool,
+        option(
+            "--verbose",
+            default=True,
+            show_default=True,
+            help="Log the requests.",
+        ),
+    ] = True
+
+    def __post_init__(self):
+        if self.max_concurrency is None:
+            self.max_concurrency = os.cpu_count() or 1
+        elif self.max_concurrency < 1:
+            raise ValueError("Maximum concurrency must be at least 1.")
+
+        if self.max_request_size <= 0:
+            raise ValueError("Maximum request size must be positive.")
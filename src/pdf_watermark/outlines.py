@@ -0,0 +1,529 @@
+"""
+Glyph outline utilities for pdf-watermark.
+Converts text into vector paths, using the TrueType fonts and the Type 1 font files known to
+reportlab, so that the watermark text can be made unselectable without rasterizing it.
+"""
+
+import re
+import struct
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfgen.pathobject import PDFPathObject
+
+# Outlines are lists of path operations in glyph units: ("M", x, y), ("L", x, y),
+# ("C", x1, y1, x2, y2, x3, y3) and ("Z",)
+Outline = List[Tuple]
+
+TEXT_PATH_CACHE_SIZE = 256
+
+# Number of fonts whose parsed outlines are kept in memory
+FONT_OUTLINES_CACHE_SIZE = 32
+
+
+def _translate(outline: Outline, matrix: Tuple[float, ...]) -> Outline:
+    a, b, c, d, e, f = matrix
+    transformed = []
+    for operator, *coordinates in outline:
+        points = []
+        for x, y in zip(coordinates[::2], coordinates[1::2]):
+            points += [a * x + c * y + e, b * x + d * y + f]
+        transformed.append((operator, *points))
+    return transformed
+
+
+class TrueTypeOutlines:
+    """Reads glyph outlines from the glyf table of a TrueType font parsed by reportlab."""
+
+    MAX_COMPONENT_DEPTH = 8
+
+    def __init__(self, font):
+        face = font.face
+        self.font = font
+        self.units_per_em = face.unitsPerEm
+
+        head = face.get_table("head")
+        index_to_loc_format = struct.unpack(">h", head[50:52])[0]
+        loca = face.get_table("loca")
+        if index_to_loc_format == 0:
+            self.offsets = [
+                2 * offset for offset in struct.unpack(f">{len(loca) // 2}H", loca)
+            ]
+        else:
+            self.offsets = list(struct.unpack(f">{len(loca) // 4}L", loca))
+        self.glyf = face.get_table("glyf")
+        self._outlines: Dict[int, Outline] = {}
+
+    def char_outline(self, char: str) -> Outline:
+        return self.glyph_outline(self.font.face.charToGlyph.get(ord(char), 0))
+
+    def glyph_outline(self, glyph: int, depth: int = 0) -> Outline:
+        outline = self._outlines.get(glyph)
+        if outline is None:
+            outline = self._read_glyph(glyph, depth)
+            self._outlines[glyph] = outline
+        return outline
+
+    def _read_glyph(self, glyph: int, depth: int) -> Outline:
+        if glyph + 1 >= len(self.offsets) or depth > self.MAX_COMPONENT_DEPTH:
+            return []
+        start, end = self.offsets[glyph], self.offsets[glyph + 1]
+        if start == end:
+            # Empty glyph, e.g. a space
+            return []
+
+        data = self.glyf[start:end]
+        number_of_contours = struct.unpack(">h", data[:2])[0]
+        if number_of_contours >= 0:
+            return self._read_simple_glyph(data, number_of_contours)
+        return self._read_composite_glyph(data, depth)
+
+    @staticmethod
+    def _read_simple_glyph(data: bytes, number_of_contours: int) -> Outline:
+        if number_of_contours == 0:
+            return []
+
+        position = 10
+        end_points = struct.unpack(
+            f">{number_of_contours}H",
+            data[position : position + 2 * number_of_contours],
+        )
+        position += 2 * number_of_contours
+        instruction_length = struct.unpack(">H", data[position : position + 2])[0]
+        position += 2 + instruction_length
+
+        number_of_points = end_points[-1] + 1
+        flags = []
+        while len(flags) < number_of_points:
+            flag = data[position]
+            position += 1
+            flags.append(flag)
+            if flag & 0x08:
+                flags += [flag] * data[position]
+                position += 1
+
+        coordinates = []
+        for short_flag, same_or_positive_flag in ((0x02, 0x10), (0x04, 0x20)):
+            values = []
+            value = 0
+            for flag in flags[:number_of_points]:
+                if flag & short_flag:
+                    delta = data[position]
+                    position += 1
+                    if not flag & same_or_positive_flag:
+                        delta = -delta
+                elif flag & same_or_positive_flag:
+                    delta = 0
+                else:
+                    delta = struct.unpack(">h", data[position : position + 2])[0]
+                    position += 2
+                value += delta
+                values.append(value)
+            coordinates.append(values)
+
+        points = [
+            (x, y, bool(flag & 0x01))
+            for x, y, flag in zip(coordinates[0], coordinates[1], flags)
+        ]
+
+        outline = []
+        start = 0
+        for end_point in end_points:
+            outline += _quadratic_contour(points[start : end_point + 1])
+            start = end_point + 1
+        return outline
+
+    def _read_composite_glyph(self, data: bytes, depth: int) -> Outline:
+        outline = []
+        position = 10
+        while True:
+            flags, glyph = struct.unpack(">HH", data[position : position + 4])
+            position += 4
+            if flags & 0x0001:
+                argument_1, argument_2 = struct.unpack(
+                    ">hh", data[position : position + 4]
+                )
+                position += 4
+            else:
+                argument_1, argument_2 = struct.unpack(
+                    ">bb", data[position : position + 2]
+                )
+                position += 2
+
+            a, b, c, d = 1.0, 0.0, 0.0, 1.0
+            if flags & 0x0008:
+                a = d = struct.unpack(">h", data[position : position + 2])[0] / 16384
+                position += 2
+            elif flags & 0x0040:
+                a, d = (
+                    value / 16384
+                    for value in struct.unpack(">hh", data[position : position + 4])
+                )
+                position += 4
+            elif flags & 0x0080:
+                a, b, c, d = (
+                    value / 16384
+                    for value in struct.unpack(">hhhh", data[position : position + 8])
+                )
+                position += 8
+
+            # Components positioned by matching points are drawn without offset
+            dx, dy = (argument_1, argument_2) if flags & 0x0002 else (0, 0)
+            outline += _translate(
+                self.glyph_outline(glyph, depth + 1), (a, b, c, d, dx, dy)
+            )
+
+            if not flags & 0x0020:
+                return outline
+
+
+def _quadratic_contour(points: List[Tuple[int, int, bool]]) -> Outline:
+    """Convert a TrueType contour, made of on-curve and off-curve points, into cubic curves."""
+    if not points:
+        return []
+
+    # Start from an on-curve point, adding one between two off-curve points if there is none
+    start_index = next((i for i, point in enumerate(points) if point[2]), None)
+    if start_index is None:
+        (x0, y0, _), (x1, y1, _) = points[-1], points[0]
+        points = [((x0 + x1) / 2, (y0 + y1) / 2, True)] + points
+        start_index = 0
+    points = points[start_index:] + points[:start_index]
+
+    start_x, start_y, _ = points[0]
+    outline = [("M", start_x, start_y)]
+    previous = (start_x, start_y)
+    control = None
+    for x, y, on_curve in points[1:] + [points[0]]:
+        if on_curve:
+            if control is None:
+                outline.append(("L", x, y))
+            else:
+                outline.append(_quadratic_to_cubic(previous, control, (x, y)))
+            previous, control = (x, y), None
+        elif control is None:
+            control = (x, y)
+        else:
+            middle = ((control[0] + x) / 2, (control[1] + y) / 2)
+            outline.append(_quadratic_to_cubic(previous, control, middle))
+            previous, control = middle, (x, y)
+
+    outline.append(("Z",))
+    return outline
+
+
+def _quadratic_to_cubic(start, control, end) -> Tuple:
+    return (
+        "C",
+        start[0] + 2 / 3 * (control[0] - start[0]),
+        start[1] + 2 / 3 * (control[1] - start[1]),
+        end[0] + 2 / 3 * (control[0] - end[0]),
+        end[1] + 2 / 3 * (control[1] - end[1]),
+        end[0],
+        end[1],
+    )
+
+
+def _decrypt(data: bytes, key: int) -> bytes:
+    # Type 1 encryption, used both for the private dictionary and for the charstrings
+    decrypted = bytearray(len(data))
+    for i, value in enumerate(data):
+        decrypted[i] = value ^ (key >> 8)
+        key = ((value + key) * 52845 + 22719) & 0xFFFF
+    return bytes(decrypted)
+
+
+def _read_pfb(path: str) -> bytes:
+    """Return the decrypted private part of a Type 1 font stored as a PFB file."""
+    with open(path, "rb") as f:
+        data = f.read()
+
+    encrypted = b""
+    position = 0
+    while position + 6 <= len(data) and data[position] == 0x80:
+        segment_type = data[position + 1]
+        if segment_type == 3:
+            break
+        length = struct.unpack("<L", data[position + 2 : position + 6])[0]
+        if segment_type == 2:
+            encrypted += data[position + 6 : position + 6 + length]
+        position += 6 + length
+
+    if not encrypted:
+        raise ValueError(f"Unsupported Type 1 font file {path}.")
+    return _decrypt(encrypted, 55665)[4:]
+
+
+_SEPARATOR = rb"\s*(?:NP|ND|\||\|-|noaccess\s+(?:put|def))?\s*"
+_SUBR = re.compile(_SEPARATOR + rb"dup\s+(\d+)\s+(\d+)\s+(?:RD|-\|) ")
+_CHARSTRING = re.compile(_SEPARATOR + rb"/([^\s/\[\]{}()<>%]+)\s+(\d+)\s+(?:RD|-\|) ")
+
+
+class Type1Outlines:
+    """Reads glyph outlines from the charstrings of a Type 1 font file."""
+
+    def __init__(self, path: str):
+        private = _read_pfb(path)
+
+        match = re.search(rb"/lenIV\s+(\d+)", private)
+        length_iv = int(match.group(1)) if match else 4
+
+        def read_entries(pattern, position):
+            entries = {}
+            while match := pattern.match(private, position):
+                start = match.end()
+                length = int(match.group(2))
+                entries[match.group(1)] = _decrypt(
+                    private[start : start + length], 4330
+                )[length_iv:]
+                position = start + length
+            return entries
+
+        match = re.search(rb"/Subrs\s+\d+\s+array", private)
+        subrs = read_entries(_SUBR, match.end()) if match else {}
+        self.subrs = {int(index): subr for index, subr in subrs.items()}
+
+        match = re.search(rb"/CharStrings\s+\d+\s+dict\s+dup\s+begin", private)
+        if match is None:
+            raise ValueError(f"Unsupported Type 1 font file {path}.")
+        self.charstrings = {
+            name.decode("latin-1"): charstring
+            for name, charstring in read_entries(_CHARSTRING, match.end()).items()
+        }
+        self._outlines: Dict[str, Outline] = {}
+
+    def glyph_outline(self, name: str) -> Outline:
+        outline = self._outlines.get(name)
+        if outline is None:
+            charstring = self.charstrings.get(name, self.charstrings.get(".notdef"))
+            outline = _Type1Interpreter(self).run(charstring) if charstring else []
+            self._outlines[name] = outline
+        return outline
+
+
+class _Type1Interpreter:
+    """Interpreter of Type 1 charstrings, ignoring hints."""
+
+    def __init__(self, font: Type1Outlines):
+        self.font = font
+        self.stack: List[float] = []
+        self.postscript_stack: List[float] = []
+        self.outline: Outline = []
+        self.x = self.y = 0
+        self.side_bearing = 0
+        self.flex_points = None
+        self.ended = False
+
+    def run(self, charstring: bytes) -> Outline:
+        self._execute(charstring)
+        return self.outline
+
+    def _move(self, dx, dy):
+        self.x += dx
+        self.y += dy
+        if self.flex_points is not None:
+            self.flex_points.append((self.x, self.y))
+        else:
+            self.outline.append(("M", self.x, self.y))
+
+    def _line(self, dx, dy):
+        self.x += dx
+        self.y += dy
+        self.outline.append(("L", self.x, self.y))
+
+    def _curve(self, dx1, dy1, dx2, dy2, dx3, dy3):
+        x1, y1 = self.x + dx1, self.y + dy1
+        x2, y2 = x1 + dx2, y1 + dy2
+        self.x, self.y = x2 + dx3, y2 + dy3
+        self.outline.append(("C", x1, y1, x2, y2, self.x, self.y))
+
+    def _seac(self, accent_side_bearing, dx, dy, base_code, accent_code):
+        from reportlab.pdfbase._fontdata import encodings
+
+        standard_encoding = encodings["StandardEncoding"]
+        base = self.font.glyph_outline(standard_encoding[int(base_code)])
+        accent = self.font.glyph_outline(standard_encoding[int(accent_code)])
+        offset_x = dx + self.side_bearing - accent_side_bearing
+        self.outline = base + _translate(accent, (1, 0, 0, 1, offset_x, dy))
+
+    def _call_other_subr(self, other_subr, arguments):
+        if other_subr == 1:
+            # Start of a flex: the next moves give the reference point and the curve points
+            self.flex_points = []
+        elif other_subr == 0 and self.flex_points is not None:
+            points = self.flex_points
+            self.flex_points = None
+            if len(points) >= 7:
+                self.outline.append(("C", *points[1], *points[2], *points[3]))
+                self.outline.append(("C", *points[4], *points[5], *points[6]))
+            # The end point is read back by pop pop setcurrentpoint
+            self.postscript_stack += [arguments[2], arguments[1]]
+            return
+        self.postscript_stack += reversed(arguments)
+
+    def _execute(self, charstring: bytes):
+        stack = self.stack
+        position = 0
+        while position < len(charstring) and not self.ended:
+            value = charstring[position]
+            position += 1
+
+            if value >= 32:
+                if value <= 246:
+                    stack.append(value - 139)
+                elif value <= 250:
+                    stack.append((value - 247) * 256 + charstring[position] + 108)
+                    position += 1
+                elif value <= 254:
+                    stack.append(-(value - 251) * 256 - charstring[position] - 108)
+                    position += 1
+                else:
+                    stack.append(
+                        struct.unpack(">i", charstring[position : position + 4])[0]
+                    )
+                    position += 4
+                continue
+
+            if value == 12:
+                value = 1200 + charstring[position]
+                position += 1
+
+            if value == 13:  # hsbw
+                self.side_bearing = stack[0]
+                self.x, self.y = stack[0], 0
+            elif value == 1207:  # sbw
+                self.side_bearing = stack[0]
+                self.x, self.y = stack[0], stack[1]
+            elif value == 21:  # rmoveto
+                self._move(stack[0], stack[1])
+            elif value == 22:  # hmoveto
+                self._move(stack[0], 0)
+            elif value == 4:  # vmoveto
+                self._move(0, stack[0])
+            elif value == 5:  # rlineto
+                self._line(stack[0], stack[1])
+            elif value == 6:  # hlineto
+                self._line(stack[0], 0)
+            elif value == 7:  # vlineto
+                self._line(0, stack[0])
+            elif value == 8:  # rrcurveto
+                self._curve(*stack[:6])
+            elif value == 30:  # vhcurveto
+                self._curve(0, stack[0], stack[1], stack[2], stack[3], 0)
+            elif value == 31:  # hvcurveto
+                self._curve(stack[0], 0, stack[1], stack[2], 0, stack[3])
+            elif value == 9:  # closepath
+                self.outline.append(("Z",))
+            elif value == 10:  # callsubr
+                subr = self.font.subrs.get(int(stack.pop()), b"")
+                self._execute(subr)
+                continue
+            elif value == 11:  # return
+                return
+            elif value == 14:  # endchar
+                self.ended = True
+            elif value == 1206:  # seac
+                self._seac(*stack[:5])
+                self.ended = True
+            elif value == 1212:  # div
+                divisor = stack.pop()
+                stack.append(stack.pop() / divisor)
+                continue
+            elif value == 1216:  # callothersubr
+                other_subr = int(stack.pop())
+                count = int(stack.pop())
+                arguments = [stack.pop() for _ in range(count)][::-1]
+                self._call_other_subr(other_subr, arguments)
+                continue
+            elif value == 1217:  # pop
+                stack.append(
+                    self.postscript_stack.pop() if self.postscript_stack else 0
+                )
+                continue
+            elif value == 1233:  # setcurrentpoint
+                self.x, self.y = stack[0], stack[1]
+            # Other operators are hints, which are ignored
+
+            stack.clear()
+
+
+@lru_cache(maxsize=FONT_OUTLINES_CACHE_SIZE)
+def get_font_outlines(font_name: str):
+    """
+    Get the outlines of a registered font.
+
+    Raises:
+        ValueError: If the font does not provide outlines, e.g. CID fonts.
+    """
+    from reportlab.pdfbase._fontdata import findT1File
+    from reportlab.pdfbase.cidfonts import CIDFont
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    font = pdfmetrics.getFont(font_name)
+    if isinstance(font, TTFont):
+        return TrueTypeOutlines(font)
+
+    if not isinstance(font, CIDFont):
+        path = getattr(font.face, "pfbFileName", None)
+        if path is None:
+            try:
+                path = findT1File(font.face.name)
+            except (struct.error, IndexError, KeyError):
+                # Fonts that reportlab does not know the file of
+                path = None
+        if path is not None:
+            return Type1Outlines(path)
+
+    raise ValueError(
+        f"Invalid argument. Font '{font_name}' does not provide glyph outlines. Use --unselectable-mode image instead."
+    )
+
+
+def _add_outline(path: PDFPathObject, outline: Outline, scale: float, x: float):
+    for operator, *coordinates in outline:
+        points = [
+            value * scale + (x if i % 2 == 0 else 0)
+            for i, value in enumerate(coordinates)
+        ]
+        if operator == "M":
+            path.moveTo(*points)
+        elif operator == "L":
+            path.lineTo(*points)
+        elif operator == "C":
+            path.curveTo(*points)
+        else:
+            path.close()
+
+
+@lru_cache(maxsize=TEXT_PATH_CACHE_SIZE)
+def text_path(text: str, font_name: str, font_size: float) -> PDFPathObject:
+    """
+    Build the path of a line of text drawn with its baseline starting at the origin.
+
+    Characters are placed with the same widths as the ones reportlab uses to draw text.
+    """
+    font = pdfmetrics.getFont(font_name)
+    path = PDFPathObject()
+    x = 0.0
+
+    if isinstance(get_font_outlines(font_name), TrueTypeOutlines):
+        outlines = get_font_outlines(font_name)
+        scale = font_size / outlines.units_per_em
+        for char in text:
+            _add_outline(path, outlines.char_outline(char), scale, x)
+            x += font.stringWidth(char, font_size)
+        return path
+
+    # Type 1 fonts draw the characters their encoding does not cover with substitution fonts
+    scale = font_size / 1000
+    for segment_font, codes in pdfmetrics.unicode2T1(
+        text, [font] + font.substitutionFonts
+    ):
+        outlines = get_font_outlines(segment_font.fontName)
+        for code in codes:
+            glyph_name = segment_font.encoding.vector[code]
+            if glyph_name is not None:
+                _add_outline(path, outlines.glyph_outline(glyph_name), scale, x)
+            x += segment_font.widths[code] * scale
+    return path
@@ -0,0 +1,131 @@
+"""
+Profiling utilities for pdf-watermark.
+Measures the time spent in each phase of the watermarking of a document: parsing the input, drawing
+the watermark, merging it with the pages, writing the output and rasterizing pages.
+"""
+
+import json
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List, Optional
+
+PHASES = ("parse", "draw", "merge", "write", "rasterize")
+
+# Number of functions included in the report when cProfile is enabled
+PROFILE_TOP_FUNCTIONS = 50
+
+TimingHook = Callable[[str, float], None]
+
+_hooks: List[TimingHook] = []
+
+# Timings of the document being processed in the current thread or task
+_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar(
+    "pdf_watermark_timings", default=None
+)
+
+
+def add_timing_hook(hook: TimingHook):
+    """
+    Register a function called with the name of a phase and its duration in seconds, each time a
+    phase ends. Hooks are called in the thread and process running the phase.
+    """
+    _hooks.append(hook)
+
+
+def remove_timing_hook(hook: TimingHook):
+    _hooks.remove(hook)
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    """Measure the duration of a phase, if timings are being recorded or hooks are registered."""
+    timings = _timings.get()
+    if timings is None and not _hooks:
+        yield
+        return
+
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = perf_counter() - start
+        if timings is not None:
+            timings[phase] = timings.get(phase, 0.0) + elapsed
+        for hook in list(_hooks):
+            hook(phase, elapsed)
+
+
+@contextmanager
+def record_timings() -> Iterator[Dict[str, float]]:
+    """Collect the duration of the phases run in this context, and their total duration."""
+    timings: Dict[str, float] = {}
+    token = _timings.set(timings)
+    start = perf_counter()
+    try:
+        yield timings
+    finally:
+        timings["total"] = perf_counter() - start
+        _timings.reset(token)
+
+
+class Profile:
+    """Per-file and aggregate timings of a run, optionally with cProfile statistics."""
+
+    def __init__(self, use_cprofile: bool = False):
+        self.files: List[Dict] = []
+        self.start = perf_counter()
+        self.profiler = None
+        if use_cprofile:
+            import cProfile
+
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def add_file(self, input_file: str, output_file: str, timings: Dict[str, float]):
+        self.files.append(
+            {"input": input_file, "output": output_file, "timings": timings}
+        )
+
+    def to_dict(self) -> Dict:
+        phases = {phase: 0.0 for phase in PHASES}
+        total = 0.0
+        for file in self.files:
+            for phase, duration in file["timings"].items():
+                if phase == "total":
+                    total += duration
+                else:
+                    phases[phase] = phases.get(phase, 0.0) + duration
+
+        report = {
+            "files": self.files,
+            "aggregate": {
+                "files": len(self.files),
+                "wall_time": perf_counter() - self.start,
+                "total": total,
+                "phases": phases,
+            },
+        }
+
+        if self.profiler is not None:
+            import pstats
+
+            self.profiler.disable()
+            stats = pstats.Stats(self.profiler).sort_stats(pstats.SortKey.CUMULATIVE)
+            report["cprofile"] = []
+            for function in stats.fcn_list[:PROFILE_TOP_FUNCTIONS]:
+                _, calls, tottime, cumtime, _ = stats.stats[function]
+                report["cprofile"].append(
+                    {
+                        "function": pstats.func_std_string(function),
+                        "calls": calls,
+                        "tottime": tottime,
+                        "cumtime": cumtime,
+                    }
+                )
+
+        return report
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
@@ -0,0 +1,233 @@
+"""
+Watermark server for pdf-watermark.
+Keeps fonts and rendered stamps in memory between requests, so that the startup cost of the command
+line tool is only paid once.
+
+Documents are sent as the body of a POST request to /grid or /insert, and the options as query
+parameters named like the command line options, e.g. /grid?watermark=draft&opacity=0.2&horizontal-boxes=4.
+The watermarked document is returned in the response body.
+
+Clients cannot make the server read or write its own files: options that name server paths, like
+image watermarks, font files, custom font folders and the persistent stamp cache, are rejected.
+Errors are answered with generic messages, which do not disclose server paths.
+"""
+
+import socketserver
+import threading
+import types
+import typing
+from dataclasses import fields
+from functools import lru_cache
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Tuple, Union
+from urllib.parse import parse_qsl, urlsplit
+
+from pypdf.errors import PyPdfError
+
+from pdf_watermark.handler import add_watermark_to_bytes
+from pdf_watermark.options import (
+    DrawingOptions,
+    GridOptions,
+    InsertOptions,
+    ServerOptions,
+    get_image_path,
+)
+from pdf_watermark.utils import MEGABYTE
+
+COMMANDS = {"/grid": GridOptions, "/insert": InsertOptions}
+
+# Number of distinct option sets kept in memory, with their font
+OPTIONS_CACHE_SIZE = 128
+
+# Options that point at files of the server
+SERVER_PATH_OPTIONS = ("custom_fonts_folder", "persistent_stamp_cache")
+
+FONT_FILE_EXTENSIONS = (".ttf", ".otf")
+
+
+class RequestError(ValueError):
+    """Invalid request, whose message is sent to the client."""
+
+
+def _convert(value: str, annotation):
+    if typing.get_origin(annotation) in (Union, types.UnionType):
+        # Optional values, e.g. Path | None
+        annotation = next(a for a in typing.get_args(annotation) if a is not type(None))
+
+    if annotation is bool:
+        if value.lower() in ("1", "true", "yes", "on", ""):
+            return True
+        if value.lower() in ("0", "false", "no", "off"):
+            return False
+        raise ValueError(f"Invalid boolean value '{value}'.")
+
+    if annotation in (int, float, str, Path):
+        return annotation(value)
+
+    raise ValueError(f"Unsupported option type {annotation}.")
+
+
+def parse_options(options_class: type, parameters: Dict[str, str]):
+    """
+    Create an options dataclass from query parameters.
+
+    Args:
+        options_class: DrawingOptions, GridOptions or InsertOptions
+        parameters: Query parameters, named like the dataclass fields or the command line options
+
+    Returns:
+        An instance of options_class. Parameters that are not fields of options_class are ignored.
+    """
+    type_hints = typing.get_type_hints(options_class)
+    kwargs = {}
+    for field in fields(options_class):
+        for name in (field.name, field.name.replace("_", "-")):
+            if name in parameters:
+                kwargs[field.name] = _convert(parameters[name], type_hints[field.name])
+    return options_class(**kwargs)
+
+
+@lru_cache(maxsize=OPTIONS_CACHE_SIZE)
+def get_options(
+    command: str, parameters: Tuple[Tuple[str, str], ...]
+) -> Tuple[DrawingOptions, Union[GridOptions, InsertOptions]]:
+    """Parse and cache the options of a request. Fonts are registered only once."""
+    parameters_dict = dict(parameters)
+    if "watermark" not in parameters_dict:
+        raise RequestError("Missing 'watermark' parameter.")
+
+    for name in SERVER_PATH_OPTIONS:
+        if name in parameters_dict or name.replace("_", "-") in parameters_dict:
+            raise RequestError(f"The '{name}' parameter is not accepted by the server.")
+
+    if get_image_path(parameters_dict["watermark"]) is not None:
+        raise RequestError("Image watermarks are not accepted by the server.")
+
+    for name in ("text_font", "text-font"):
+        font = parameters_dict.get(name, "")
+        if any(separator in font for separator in ("/", "\\")) or font.lower().endswith(
+            FONT_FILE_EXTENSIONS
+        ):
+            raise RequestError("Font files are not accepted by the server.")
+
+    return (
+        parse_options(DrawingOptions, parameters_dict),
+        parse_options(COMMANDS[command], parameters_dict),
+    )
+
+
+class WatermarkRequestHandler(BaseHTTPRequestHandler):
+    server_version = "pdf-watermark"
+
+    def _send(self, status: HTTPStatus, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: HTTPStatus, message: str):
+        self._send(status, f"{message}\n".encode(), "text/plain; charset=utf-8")
+
+    def do_GET(self):
+        if urlsplit(self.path).path == "/health":
+            self._send(HTTPStatus.OK, b"ok\n", "text/plain; charset=utf-8")
+        else:
+            self._send_error(HTTPStatus.NOT_FOUND, "Unknown endpoint.")
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path not in COMMANDS:
+            self._send_error(HTTPStatus.NOT_FOUND, "Unknown endpoint.")
+            return
+
+        try:
+            content_length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            content_length = -1
+        if content_length < 0:
+            self._send_error(HTTPStatus.BAD_REQUEST, "Invalid Content-Length.")
+            return
+
+        if content_length > self.server.max_request_size:
+            # The body is not read, so the connection cannot be reused
+            self.close_connection = True
+            self._send_error(
+                HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                f"Documents are limited to {self.server.max_request_size // MEGABYTE} MB.",
+            )
+            return
+
+        content = self.rfile.read(content_length)
+        parameters = tuple(sorted(parse_qsl(url.query, keep_blank_values=True)))
+
+        # Other error messages may hold server paths, so they are only logged
+        try:
+            drawing_options, specific_options = get_options(url.path, parameters)
+        except RequestError as e:
+            self._send_error(HTTPStatus.BAD_REQUEST, str(e))
+            return
+        except (ValueError, TypeError) as e:
+            self.log_error("Invalid options: %s", e)
+            self._send_error(HTTPStatus.BAD_REQUEST, "Invalid options.")
+            return
+
+        try:
+            with self.server.slots:
+                watermarked = add_watermark_to_bytes(
+                    content, drawing_options, specific_options
+                )
+        except (ValueError, TypeError, PyPdfError) as e:
+            self.log_error("Invalid document: %s", e)
+            self._send_error(HTTPStatus.BAD_REQUEST, "Invalid document.")
+            return
+        except Exception as e:
+            self.log_error("Watermarking failed: %s", e)
+            self._send_error(HTTPStatus.INTERNAL_SERVER_ERROR, "Watermarking failed.")
+            return
+
+        self._send(HTTPStatus.OK, watermarked, "application/pdf")
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class WatermarkHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+if hasattr(socketserver, "UnixStreamServer"):
+
+    class WatermarkUnixHTTPServer(
+        socketserver.ThreadingMixIn, socketserver.UnixStreamServer
+    ):
+        daemon_threads = True
+
+
+def create_server(
+    server_options: ServerOptions,
+) -> socketserver.BaseServer:
+    """Create the server described by server_options, without starting it."""
+    if server_options.socket is not None:
+        if not hasattr(socketserver, "UnixStreamServer"):
+            raise ValueError("Unix sockets are not supported on this platform.")
+        server = WatermarkUnixHTTPServer(
+            str(server_options.socket), WatermarkRequestHandler
+        )
+    else:
+        server = WatermarkHTTPServer(
+            (server_options.host, server_options.port), WatermarkRequestHandler
+        )
+
+    # Requests beyond this limit wait for a slot before being processed
+    server.slots = threading.BoundedSemaphore(server_options.max_concurrency)
+    server.max_request_size = server_options.max_request_size * MEGABYTE
+    server.verbose = server_options.verbose
+    return server
@@ -1,13 +1,24 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from io import BytesIO
-from typing import Tuple
+from itertools import chain
+from math import ceil, cos, pi, sin
+from tempfile import TemporaryDirectory
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple, Union
 
+import click
 import numpy as np
 import pypdf
-from pdf2image import convert_from_path
-from pdf2image.exceptions import PopplerNotInstalledError
 from reportlab.lib.utils import ImageReader
 from reportlab.pdfgen import canvas
 
+from pdf_watermark.image_utils import PreparedImage, RasterEncoder, prepare_image
+from pdf_watermark.profiling import timed
+
+POPPLER_WARNING = "Warning : the --save-as-image and --unselectable options require poppler to be installed. Proceeding without these options. Pleaser refer to the documentation for more information."
+
 
 def draw_centered_image(
     canvas: canvas.Canvas,
@@ -16,16 +27,12 @@ def draw_centered_image(
     width: float,
     height: float,
     image: ImageReader,
+    dpi: int,
 ):
     bottom_left_x = x - width / 2
     bottom_left_y = y - height / 2
-    canvas.drawImage(
-        image,
-        bottom_left_x,
-        bottom_left_y,
-        width=width,
-        height=height,
-        mask="auto",
+    prepare_image(image, width, height, dpi).draw(
+        canvas, bottom_left_x, bottom_left_y, width, height
     )
 
 
@@ -34,6 +41,7 @@ def draw_centered_string_with_line_breaks(
     x: float,
     y: float,
     text: str,
+    outlines: bool = False,
 ):
     text_lines = text.split(r"\n")
     line_height = (
@@ -41,10 +49,24 @@ def draw_centered_string_with_line_breaks(
     )  # line height is set when setting the font of the canvas
     y += (len(text_lines) - 1) * line_height / 2  # also center the text vertically
     for line in text_lines:
-        watermark.drawCentredString(x, y, line)
+        if outlines:
+            draw_centered_outlines(watermark, x, y, line)
+        else:
+            watermark.drawCentredString(x, y, line)
         y -= watermark._leading
 
 
+def draw_centered_outlines(watermark: canvas.Canvas, x: float, y: float, text: str):
+    """Same as Canvas.drawCentredString, but the characters are drawn as vector shapes."""
+    from pdf_watermark.outlines import text_path
+
+    path = text_path(text, watermark._fontname, watermark._fontsize)
+    watermark.saveState()
+    watermark.translate(x - watermark.stringWidth(text) / 2, y)
+    watermark.drawPath(path, stroke=0, fill=1, fillMode=canvas.FILL_NON_ZERO)
+    watermark.restoreState()
+
+
 def change_base(x: float, y: float, rotation_matrix: np.ndarray) -> Tuple[float, float]:
     # Since we rotated the original coordinates system, use the inverse of the rotation matrix
     # (which is the transposed matrix) to get the coordinates we have to draw at
@@ -52,6 +74,48 @@ def change_base(x: float, y: float, rotation_matrix: np.ndarray) -> Tuple[float,
     return new_coordinates[0, 0], new_coordinates[1, 0]
 
 
+# Number of grid layouts kept in memory, one per page size and set of grid options
+GRID_LAYOUT_CACHE_SIZE = 256
+
+
+@lru_cache(maxsize=GRID_LAYOUT_CACHE_SIZE)
+def grid_layout(
+    width: float,
+    height: float,
+    horizontal_boxes: int,
+    vertical_boxes: int,
+    margin: bool,
+    angle: float,
+) -> Tuple[Tuple[float, float], ...]:
+    """
+    Compute the position of each watermark of a grid, in the rotated coordinates system used to draw.
+
+    All the positions are computed in one batch, which is equivalent to calling change_base for each
+    of them, and cached since all the pages with the same size share the same layout.
+    Every position lies on the page, so no watermark can be left out.
+    """
+    horizontal_box_spacing = width / horizontal_boxes
+    vertical_box_spacing = height / vertical_boxes
+
+    start_index = 1 if margin else 0
+    x_base = np.arange(start_index, horizontal_boxes + 1) * horizontal_box_spacing
+    y_base = np.arange(start_index, vertical_boxes + 1) * vertical_box_spacing
+
+    if margin:
+        x_base -= horizontal_box_spacing / 2
+        y_base -= vertical_box_spacing / 2
+
+    # Same order as nested loops over x then y
+    x_base, y_base = np.meshgrid(x_base, y_base, indexing="ij")
+
+    # Inverse rotation, as in change_base
+    angle_rad = angle * pi / 180
+    x_prime = cos(angle_rad) * x_base + sin(angle_rad) * y_base
+    y_prime = -sin(angle_rad) * x_base + cos(angle_rad) * y_base
+
+    return tuple(zip(x_prime.ravel().tolist(), y_prime.ravel().tolist()))
+
+
 def fit_image(image_width, image_height, max_image_width, max_image_height, scale):
     if image_width > max_image_width:
         change_ratio = max_image_width / image_width
@@ -68,38 +132,289 @@ def fit_image(image_width, image_height, max_image_width, max_image_height, scal
     return image_width, image_height
 
 
-def convert_content_to_images(file_name: str, dpi: int):
-    # load pages as images
-    try:
-        images = convert_from_path(file_name, dpi=dpi, fmt="png", transparent=True)
-    except PopplerNotInstalledError:
-        print(
-            "Warning : the --save-as-image and --unselectable options require poppler to be installed. Proceeding without these options. Pleaser refer to the documentation for more information."
-        )
-        return None
+def encode_page_images(
+    images: Iterable, workers: int, encoder: Optional[RasterEncoder] = None
+) -> Iterator[PreparedImage]:
+    """
+    Encode page images in parallel threads, and return them in order.
 
-    # get the page sizes
-    pdf_to_transform = pypdf.PdfReader(file_name)
-    page_sizes = []
-    for page in pdf_to_transform.pages:
-        page_sizes.append((page.mediabox.width, page.mediabox.height))
+    Encoding is mostly compression and hashing, which release the GIL. Only a few more images than
+    there are workers are taken from images at any time, so that rasterization stays bounded.
+    """
 
-    # create new pdf
-    pdf = canvas.Canvas(file_name)
+    if encoder is None:
+        encoder = RasterEncoder()
+    encode = encoder.encode
 
-    for image, (page_width, page_height) in zip(images, page_sizes):
+    if workers <= 1:
+        yield from map(encode, images)
+        return
+
+    with ThreadPoolExecutor(workers) as executor:
+        pending = deque()
+        for image in images:
+            pending.append(executor.submit(encode, image))
+            if len(pending) > workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def images_to_pdf(
+    images,
+    page_sizes,
+    output: Union[str, BinaryIO],
+    workers: int = 1,
+    encoder: Optional[RasterEncoder] = None,
+):
+    pdf = canvas.Canvas(output)
+
+    for image, (page_width, page_height) in zip(
+        encode_page_images(images, workers, encoder), page_sizes
+    ):
         pdf.setPageSize((page_width, page_height))
-        compressed = BytesIO()
-        image.save(compressed, format="png", optimize=True, quality=dpi // 10)
-
-        pdf.drawImage(
-            ImageReader(compressed),
-            0,
-            0,
-            width=page_width,
-            height=page_height,
-            mask="auto",
-        )
+        image.draw(pdf, 0, 0, page_width, page_height)
         pdf.showPage()
 
     pdf.save()
+
+
+def get_page_sizes(
+    pdf: Union[pypdf.PdfReader, pypdf.PdfWriter],
+) -> List[Tuple[float, float]]:
+    return [(page.mediabox.width, page.mediabox.height) for page in pdf.pages]
+
+
+def get_page_count(file_name: str) -> int:
+    """
+    Number of pages of a PDF file, read from the page tree root.
+
+    Only the cross-reference table and the objects leading to the page tree root are read, while
+    PdfReader.pages reads the whole file into memory and loads every page.
+    """
+    with open(file_name, "rb") as f:
+        pdf = pypdf.PdfReader(f)
+        try:
+            return int(pdf.trailer["/Root"]["/Pages"]["/Count"])
+        except (KeyError, TypeError, ValueError):
+            # Damaged page tree, the pages are counted instead
+            return len(pdf.pages)
+
+
+# Page images are RGBA, since the pages are rasterized with a transparent background
+RASTER_BYTES_PER_PIXEL = 4
+
+MEGABYTE = 1024 * 1024
+
+
+def get_page_memory(width: float, height: float, dpi: int) -> int:
+    """Size in bytes of the image of a page rasterized at dpi."""
+    return (
+        ceil(float(width) * dpi / 72)
+        * ceil(float(height) * dpi / 72)
+        * RASTER_BYTES_PER_PIXEL
+    )
+
+
+def get_page_windows(
+    page_sizes: List[Tuple[float, float]],
+    dpi: int,
+    max_memory: int,
+    pages_in_flight: int = 0,
+) -> Iterator[Tuple[int, int]]:
+    """
+    Split the pages of a document into windows of consecutive pages rasterized together.
+
+    Args:
+        page_sizes: The size of each page, in points
+        dpi: The resolution the pages are rasterized at
+        max_memory: Maximum size in bytes of the page images. A window always holds at least one
+            page, even if its image is larger.
+        pages_in_flight: Number of page images of the previous window that can still be held, e.g.
+            by the encoder, while the next window is rasterized. They are counted as the largest
+            page, and taken out of the memory of the windows.
+
+    Returns:
+        The first and last page numbers of each window, starting from 1 like pdf2image.
+    """
+    page_memories = [
+        get_page_memory(width, height, dpi) for width, height in page_sizes
+    ]
+    if page_memories:
+        max_memory -= pages_in_flight * max(page_memories)
+
+    first_page = 1
+    window_memory = 0
+    for page_number, page_memory in enumerate(page_memories, start=1):
+        if page_number > first_page and window_memory + page_memory > max_memory:
+            yield first_page, page_number - 1
+            first_page, window_memory = page_number, 0
+        window_memory += page_memory
+
+    if page_sizes:
+        yield first_page, len(page_sizes)
+
+
+def get_raster_workers(workers: Optional[int]) -> int:
+    """Number of parallel rasterization workers, the number of CPU cores by default."""
+    return workers or os.cpu_count() or 1
+
+
+def get_window_workers(
+    page_sizes: List[Tuple[float, float]], dpi: int, max_memory: int, workers: int
+) -> int:
+    """
+    Limit the number of workers so that at least half of max_memory is left to the windows.
+
+    Each worker holds a page image while the next window is rasterized, see rasterize_pages. With
+    many CPU cores and large pages, the windows would otherwise be left with a single page each,
+    and poppler would be run once per page.
+    """
+    if not page_sizes:
+        return workers
+
+    largest_page_memory = max(
+        get_page_memory(width, height, dpi) for width, height in page_sizes
+    )
+    # workers + 1 pages are in flight
+    return max(1, min(workers, max_memory // (2 * largest_page_memory) - 1))
+
+
+def rasterize_pages(
+    file_name: str,
+    page_sizes: List[Tuple[float, float]],
+    dpi: int,
+    max_memory: int,
+    workers: int = 1,
+):
+    """
+    Rasterize the pages of a document one window at a time, releasing each image once used.
+
+    The pages of a window are split between workers poppler processes.
+    """
+    from pdf2image import convert_from_path
+
+    # encode_page_images holds up to workers + 1 images while the next window is rasterized
+    pages_in_flight = workers + 1 if workers > 1 else 1
+    for first_page, last_page in get_page_windows(
+        page_sizes, dpi, max_memory, pages_in_flight
+    ):
+        images = convert_from_path(
+            file_name,
+            dpi=dpi,
+            fmt="png",
+            transparent=True,
+            first_page=first_page,
+            last_page=last_page,
+            thread_count=workers,
+        )
+        images.reverse()
+        while images:
+            yield images.pop()
+
+
+def _pdf_from_pages(
+    file_name: str,
+    page_sizes: List[Tuple[float, float]],
+    output: Union[str, BinaryIO],
+    dpi: int,
+    max_memory: int,
+    workers: int,
+    encoder: Optional[RasterEncoder],
+) -> bool:
+    from pdf2image.exceptions import PDFInfoNotInstalledError, PopplerNotInstalledError
+
+    workers = get_window_workers(page_sizes, dpi, max_memory, workers)
+    images = rasterize_pages(file_name, page_sizes, dpi, max_memory, workers)
+    try:
+        # Rasterize the first window before writing anything, to check that poppler is available
+        first_image = next(images, None)
+    except (PDFInfoNotInstalledError, PopplerNotInstalledError):
+        # The standard output may hold the output document
+        click.echo(POPPLER_WARNING, err=True)
+        return False
+
+    if first_image is not None:
+        images = chain([first_image], images)
+    images_to_pdf(images, page_sizes, output, workers, encoder)
+    return True
+
+
+def convert_bytes_to_images(
+    content: bytes,
+    dpi: int,
+    max_memory: int = 512 * MEGABYTE,
+    workers: Optional[int] = None,
+    encoder: Optional[RasterEncoder] = None,
+) -> Optional[bytes]:
+    """
+    In-memory version of convert_pdf_writer_to_images. Returns None if poppler is not available.
+    """
+    with timed("rasterize"):
+        return _convert_bytes_to_images(
+            content, dpi, max_memory, get_raster_workers(workers), encoder
+        )
+
+
+def _convert_bytes_to_images(
+    content: bytes,
+    dpi: int,
+    max_memory: int,
+    workers: int,
+    encoder: Optional[RasterEncoder],
+) -> Optional[bytes]:
+    page_sizes = get_page_sizes(pypdf.PdfReader(BytesIO(content)))
+
+    # poppler reads from a file, written once for all the windows
+    with TemporaryDirectory() as directory:
+        file_name = os.path.join(directory, "content.pdf")
+        with open(file_name, "wb") as f:
+            f.write(content)
+
+        output = BytesIO()
+        if not _pdf_from_pages(
+            file_name, page_sizes, output, dpi, max_memory, workers, encoder
+        ):
+            return None
+    return output.getvalue()
+
+
+def convert_pdf_writer_to_images(
+    pdf_writer: pypdf.PdfWriter,
+    page_sizes: List[Tuple[float, float]],
+    output: Union[str, BinaryIO],
+    dpi: int,
+    max_memory: int = 512 * MEGABYTE,
+    workers: Optional[int] = None,
+    encoder: Optional[RasterEncoder] = None,
+) -> bool:
+    """
+    Write to output a PDF holding an image of each page of a document that is not saved yet.
+
+    The document is serialized once, to the temporary file poppler reads, and page_sizes are the
+    sizes of its pages, which are not parsed again.
+
+    Pages are rasterized in windows whose images take at most max_memory bytes, and each image is
+    encoded into the output as soon as it is rasterized, so that long documents do not need to fit
+    in memory as images. Both rasterization and encoding are split between workers, the number of
+    CPU cores by default. Page images are encoded by encoder, with Flate by default.
+
+    Returns:
+        False if poppler is not available, in which case nothing is written to output.
+    """
+    with TemporaryDirectory() as directory:
+        file_name = os.path.join(directory, "content.pdf")
+        with timed("write"):
+            with open(file_name, "wb") as f:
+                pdf_writer.write(f)
+
+        with timed("rasterize"):
+            return _pdf_from_pages(
+                file_name,
+                page_sizes,
+                output,
+                dpi,
+                max_memory,
+                get_raster_workers(workers),
+                encoder,
+            )
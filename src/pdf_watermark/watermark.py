@@ -1,14 +1,35 @@
+import os
+from typing import Union
+
 import click
 from dataclass_click import dataclass_click
 
-from pdf_watermark.handler import add_watermark_from_options
 from pdf_watermark.options import (
     DrawingOptions,
     FilesOptions,
     GridOptions,
     InsertOptions,
+    ServerOptions,
 )
 
+# The modules doing the actual work are imported by the commands that need them, which keeps
+# --help and --dry-run fast.
+
+
+def run(
+    files_options: FilesOptions,
+    drawing_options: DrawingOptions,
+    specific_options: Union[GridOptions, InsertOptions],
+):
+    if files_options.dry_run:
+        from pdf_watermark.files import list_pending_files
+
+        list_pending_files(files_options, drawing_options, specific_options)
+    else:
+        from pdf_watermark.handler import add_watermark_from_options
+
+        add_watermark_from_options(files_options, drawing_options, specific_options)
+
 
 @click.group()
 def cli():
@@ -37,11 +58,7 @@ def insert(
     FILE can be a single file or a directory, in which case all PDF files in the directory will be watermarked.
     """
 
-    add_watermark_from_options(
-        files_options,
-        drawing_options,
-        insert_options,
-    )
+    run(files_options, drawing_options, insert_options)
 
 
 @cli.command()
@@ -61,11 +78,36 @@ def grid(
     FILE can be a single file or a directory, in which case all PDF files in the directory will be watermarked.
     """
 
-    add_watermark_from_options(
-        files_options,
-        drawing_options,
-        grid_options,
-    )
+    run(files_options, drawing_options, grid_options)
+
+
+@cli.command()
+@dataclass_click(ServerOptions)
+def serve(server_options: ServerOptions):
+    """
+    Run a watermark server.
+
+    The server keeps fonts and watermarks in memory between requests, which avoids the startup cost of the command line tool for each document.
+    Send a PDF as the body of a POST request to /grid or /insert, with the options as query parameters named like the command line options, e.g. /grid?watermark=draft&opacity=0.2&horizontal-boxes=4.
+    The watermarked PDF is returned in the response body.
+    Options that name files of the server, i.e. image watermarks, font files, --custom-fonts-folder and --persistent-stamp-cache, are rejected.
+    """
+    from pdf_watermark.server import create_server
+
+    server = create_server(server_options)
+    if server_options.socket is not None:
+        click.echo(f"Listening on {server_options.socket}")
+    else:
+        click.echo(f"Listening on http://{server_options.host}:{server.server_port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if server_options.socket is not None:
+            os.remove(server_options.socket)
 
 
 if __name__ == "__main__":
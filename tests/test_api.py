@@ -0,0 +1,88 @@
+"""
+Test the in-memory Python API.
+"""
+
+import builtins
+import os
+from io import BytesIO
+
+import pytest
+
+from pdf_watermark import (
+    DrawingOptions,
+    GridOptions,
+    add_watermark_to_bytes,
+    add_watermark_to_pdf,
+)
+from pdf_watermark.cache import options_fingerprint
+from tests.utils import assert_pdfs_are_close
+
+INPUT = "tests/fixtures/input.pdf"
+OUTPUT = "output.pdf"
+REFERENCE = "reference.pdf"
+FIXTURE = "tests/fixtures/0.pdf"
+IMAGE = "images/image.png"
+
+
+@pytest.fixture(autouse=True)
+def cleanup():
+    yield
+    for file in (OUTPUT, REFERENCE):
+        if os.path.exists(file):
+            os.remove(file)
+
+
+def forbidden_open(*args, **kwargs):
+    raise AssertionError("The in-memory API should not access the file system.")
+
+
+def read_input():
+    with open(INPUT, "rb") as f:
+        return f.read()
+
+
+def write_output(content: bytes):
+    with open(OUTPUT, "wb") as f:
+        f.write(content)
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_add_watermark_to_bytes(incremental, monkeypatch):
+    content = read_input()
+    drawing_options = DrawingOptions(watermark="watermark", incremental=incremental)
+
+    with monkeypatch.context() as m:
+        m.setattr(builtins, "open", forbidden_open)
+        watermarked = add_watermark_to_bytes(content, drawing_options, GridOptions())
+
+    write_output(watermarked)
+    assert_pdfs_are_close(OUTPUT, FIXTURE)
+
+
+def test_add_watermark_to_stream():
+    output = BytesIO()
+    with open(INPUT, "rb") as f:
+        add_watermark_to_pdf(
+            f, output, DrawingOptions(watermark="watermark"), GridOptions()
+        )
+
+    write_output(output.getvalue())
+    assert_pdfs_are_close(OUTPUT, FIXTURE)
+
+
+def test_drawing_options_from_image():
+    with open(IMAGE, "rb") as f:
+        image = f.read()
+
+    from_file = DrawingOptions(watermark=IMAGE)
+    from_memory = DrawingOptions.from_image(image)
+
+    assert from_memory.text is None
+    assert from_memory.image.getSize() == from_file.image.getSize()
+    assert options_fingerprint(from_memory) != options_fingerprint(
+        DrawingOptions.from_image(image[:-1] + b"\0")
+    )
+
+    write_output(add_watermark_to_bytes(read_input(), from_memory, GridOptions()))
+    add_watermark_to_pdf(INPUT, REFERENCE, from_file, GridOptions())
+    assert_pdfs_are_close(OUTPUT, REFERENCE)
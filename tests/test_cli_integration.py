@@ -151,3 +151,49 @@ def test_cli_invalid_input_file():
     result = runner.invoke(cli, command)
 
     assert result.exit_code != 0, "CLI should fail with non-existent input file"
+
+
+def test_cli_stdin_to_stdout():
+    """Test that - reads the document from stdin and writes the result to stdout."""
+    runner = CliRunner()
+    with open(INPUT, "rb") as f:
+        content = f.read()
+
+    result = runner.invoke(cli, ["grid", "-", "watermark"], input=content)
+
+    assert result.exit_code == 0, f"CLI command failed: {result.stderr}"
+    assert "<stdout>" in result.stderr
+    with open(OUTPUT, "wb") as f:
+        f.write(result.stdout_bytes)
+    assert_pdfs_are_close(OUTPUT, FIXTURES[0])
+
+
+@pytest.mark.parametrize(
+    "input_file, output_file, stdin",
+    [("-", OUTPUT, True), (INPUT, "-", False)],
+)
+def test_cli_stdio_with_file(input_file: str, output_file: str, stdin: bool):
+    """Test that - can be used for only one of the input and the output."""
+    runner = CliRunner()
+    with open(INPUT, "rb") as f:
+        content = f.read() if stdin else None
+
+    result = runner.invoke(
+        cli,
+        ["grid", input_file, "watermark", "--save", output_file, "--workers", "2"],
+        input=content,
+    )
+
+    assert result.exit_code == 0, f"CLI command failed: {result.stderr}"
+    if output_file == "-":
+        with open(OUTPUT, "wb") as f:
+            f.write(result.stdout_bytes)
+    assert_pdfs_are_close(OUTPUT, FIXTURES[0])
+
+
+def test_cli_stdout_requires_single_file():
+    """Test that a directory cannot be written to stdout."""
+    runner = CliRunner()
+    result = runner.invoke(cli, ["grid", "tests/fixtures", "watermark", "-s", "-"])
+
+    assert result.exit_code != 0
@@ -0,0 +1,119 @@
+"""
+Test the compression and deduplication of the output.
+"""
+
+import os
+import zlib
+
+import pypdf
+import pytest
+from reportlab.pdfgen import canvas
+
+from pdf_watermark.handler import add_watermark_to_pdf
+from pdf_watermark.options import DrawingOptions, GridOptions
+from tests.utils import assert_pdfs_are_close, assert_pdfs_are_similar
+
+INPUT = "tests/fixtures/input.pdf"
+OUTPUT = "output.pdf"
+REFERENCE = "reference.pdf"
+FIXTURE = "tests/fixtures/0.pdf"
+
+
+@pytest.fixture(autouse=True)
+def cleanup():
+    yield
+    for file in (OUTPUT, REFERENCE):
+        if os.path.exists(file):
+            os.remove(file)
+
+
+def get_content_streams(file: str):
+    for page in pypdf.PdfReader(file).pages:
+        contents = page["/Contents"].get_object()
+        if isinstance(contents, pypdf.generic.ArrayObject):
+            yield from (stream.get_object() for stream in contents)
+        else:
+            yield contents
+
+
+@pytest.mark.parametrize("merge_mode", ["content", "xobject"])
+@pytest.mark.parametrize("incremental", [False, True])
+def test_compress(merge_mode, incremental):
+    add_watermark_to_pdf(
+        INPUT,
+        OUTPUT,
+        DrawingOptions(
+            watermark="watermark",
+            merge_mode=merge_mode,
+            incremental=incremental,
+            compress=True,
+            compression_level=9,
+        ),
+        GridOptions(),
+    )
+
+    assert_pdfs_are_close(OUTPUT, FIXTURE)
+    # Streams are left uncompressed only when compression does not make them smaller
+    assert all(
+        "/Filter" in stream
+        or len(zlib.compress(stream.get_data(), 9)) >= len(stream.get_data())
+        for stream in get_content_streams(OUTPUT)
+    )
+
+
+@pytest.mark.parametrize("merge_mode", ["content", "xobject"])
+def test_deduplicate(merge_mode):
+    add_watermark_to_pdf(
+        INPUT,
+        REFERENCE,
+        DrawingOptions(watermark="watermark", merge_mode=merge_mode),
+        GridOptions(),
+    )
+    add_watermark_to_pdf(
+        INPUT,
+        OUTPUT,
+        DrawingOptions(
+            watermark="watermark",
+            merge_mode=merge_mode,
+            compress=True,
+            deduplicate=True,
+        ),
+        GridOptions(),
+    )
+
+    assert_pdfs_are_close(OUTPUT, FIXTURE)
+    assert os.path.getsize(OUTPUT) <= os.path.getsize(REFERENCE)
+
+
+@pytest.mark.parametrize("merge_mode", ["content", "xobject"])
+def test_incremental_compress_keeps_original_streams(tmp_path, merge_mode):
+    # The content streams of the original document are not compressed
+    input_file = str(tmp_path / "uncompressed.pdf")
+    pdf = canvas.Canvas(input_file, pageCompression=0)
+    for line in range(40):
+        pdf.drawString(72, 72 + 15 * line, "Some uncompressed text " * 3)
+    pdf.save()
+
+    for output, compress in ((REFERENCE, False), (OUTPUT, True)):
+        add_watermark_to_pdf(
+            input_file,
+            output,
+            DrawingOptions(
+                watermark="watermark",
+                merge_mode=merge_mode,
+                incremental=True,
+                compress=compress,
+            ),
+            GridOptions(),
+        )
+
+    assert os.path.getsize(OUTPUT) <= os.path.getsize(REFERENCE)
+    assert_pdfs_are_similar(OUTPUT, REFERENCE, tolerance=1e-3)
+
+
+def test_invalid_options():
+    with pytest.raises(ValueError):
+        DrawingOptions(watermark="watermark", compression_level=10)
+
+    with pytest.raises(ValueError):
+        DrawingOptions(watermark="watermark", incremental=True, deduplicate=True)
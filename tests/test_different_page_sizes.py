@@ -21,9 +21,25 @@ def cleanup():
     os.remove(OUTPUT)
 
 
-def test_different_page_sizes():
+@pytest.mark.parametrize("merge_mode", ["content", "xobject"])
+@pytest.mark.parametrize("incremental", [False, True])
+def test_different_page_sizes(merge_mode, incremental):
     add_watermark_from_options(
         files_options=FilesOptions(INPUT, OUTPUT),
+        drawing_options=DrawingOptions(
+            watermark="watermark", merge_mode=merge_mode, incremental=incremental
+        ),
+        specific_options=GridOptions(),
+    )
+    assert_pdfs_are_close(OUTPUT, FIXTURE)
+
+
+@pytest.mark.parametrize("executor", ["process", "thread"])
+def test_page_parallel(executor):
+    add_watermark_from_options(
+        files_options=FilesOptions(
+            INPUT, OUTPUT, workers=3, executor=executor, page_parallel_threshold=2
+        ),
         drawing_options=DrawingOptions(watermark="watermark"),
         specific_options=GridOptions(),
     )
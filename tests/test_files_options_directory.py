@@ -8,6 +8,7 @@ from pathlib import Path
 
 import pytest
 
+from pdf_watermark import options
 from pdf_watermark.options import FilesOptions, add_directory_to_files
 
 
@@ -45,8 +46,8 @@ class TestAddDirectoryToFiles:
                 assert input_file.endswith((".pdf", ".PDF"))
                 assert os.path.exists(input_file)
 
-            # Check output directory was created
-            assert os.path.exists(output_dir)
+            # Output directory is only created when the output files are written
+            assert not os.path.exists(output_dir)
 
     def test_add_directory_to_files_recursive_structure(self):
         """Test function with a recursive directory structure."""
@@ -185,3 +186,42 @@ class TestFilesOptionsWithDirectories:
                     dry_run=False,
                     workers=1,
                 )
+
+
+def test_directories_are_scanned_lazily(tmp_path):
+    input_dir = tmp_path / "input"
+    output_dir = tmp_path / "output"
+    (input_dir / "nested").mkdir(parents=True)
+
+    files_options = FilesOptions(file=input_dir, output=output_dir)
+    assert not output_dir.exists()
+
+    # Files added after the options were created are found
+    (input_dir / "nested" / "file.pdf").touch()
+    files = iter(files_options)
+    assert next(files) == (
+        str(input_dir / "nested" / "file.pdf"),
+        str(output_dir / "nested" / "file.pdf"),
+    )
+    assert not output_dir.exists()
+    assert next(files, None) is None
+
+
+def test_files_are_listed_once(tmp_path, monkeypatch):
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    (input_dir / "file.pdf").touch()
+    files_options = FilesOptions(file=input_dir, output=tmp_path / "output")
+
+    scans = []
+    scan_directory = options.scan_directory
+
+    def record_scan(*args):
+        scans.append(args)
+        return scan_directory(*args)
+
+    monkeypatch.setattr(options, "scan_directory", record_scan)
+    assert files_options.input_files == [str(input_dir / "file.pdf")]
+    assert files_options.output_files == [str(tmp_path / "output" / "file.pdf")]
+    assert list(files_options) == files_options.list_files()
+    assert len(scans) == 1
@@ -0,0 +1,143 @@
+import os
+import shutil
+
+import pytest
+import reportlab
+from reportlab.pdfbase.ttfonts import TTFont
+
+from pdf_watermark.cache import CACHE_DIR_ENV
+from pdf_watermark.font_index import FONT_INDEX_NAME, FontIndex, load_ttf_font
+
+FONT = "tests/fonts/TestFont.ttf"
+OTHER_FONT = os.path.join(os.path.dirname(reportlab.__file__), "fonts", "Vera.ttf")
+
+
+@pytest.fixture
+def fonts_folder(tmp_path):
+    folder = tmp_path / "fonts"
+    folder.mkdir()
+    shutil.copy(FONT, folder / "FirstFont.ttf")
+    return str(folder)
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv(CACHE_DIR_ENV, str(tmp_path / "cache"))
+    return tmp_path / "cache"
+
+
+def test_find_font(fonts_folder, cache_dir):
+    index_path = str(cache_dir / FONT_INDEX_NAME)
+    font_file = FontIndex(index_path).find("FirstFont", [fonts_folder])
+    assert font_file["path"] == os.path.join(fonts_folder, "FirstFont.ttf")
+    assert font_file["size"] == os.path.getsize(FONT)
+
+    assert FontIndex(index_path).find("Unknown", [fonts_folder]) is None
+
+    # The index is reused by the next runs
+    index = FontIndex(index_path)
+    assert index.is_up_to_date(fonts_folder)
+
+
+def test_index_is_invalidated_by_directory_changes(fonts_folder, cache_dir):
+    index_path = str(cache_dir / FONT_INDEX_NAME)
+    FontIndex(index_path).update([fonts_folder])
+
+    shutil.copy(FONT, os.path.join(fonts_folder, "SecondFont.ttf"))
+
+    index = FontIndex(index_path)
+    assert not index.is_up_to_date(fonts_folder)
+    assert index.find("SecondFont", [fonts_folder]) is not None
+
+
+def test_folders_are_searched_in_order(fonts_folder, tmp_path):
+    other_folder = tmp_path / "other"
+    other_folder.mkdir()
+    shutil.copy(FONT, other_folder / "FirstFont.ttf")
+
+    index = FontIndex(None)
+    assert index.find("FirstFont", [str(other_folder), fonts_folder])["path"] == str(
+        other_folder / "FirstFont.ttf"
+    )
+    assert index.find("FirstFont", [fonts_folder, str(other_folder)])["path"] == (
+        os.path.join(fonts_folder, "FirstFont.ttf")
+    )
+
+
+def test_subfolders_are_not_searched(fonts_folder):
+    # Like reportlab, only the fonts directly in the folders are found
+    os.mkdir(os.path.join(fonts_folder, "nested"))
+    shutil.copy(FONT, os.path.join(fonts_folder, "nested", "NestedFont.ttf"))
+
+    index = FontIndex(None)
+    assert index.find("NestedFont", [fonts_folder]) is None
+    assert index.similar_fonts("nested", [fonts_folder]) == []
+
+
+def test_similar_fonts(fonts_folder):
+    assert FontIndex(None).similar_fonts("firstf", [fonts_folder]) == ["FirstFont"]
+
+
+def test_font_overwritten_in_place_is_parsed_again(fonts_folder, cache_dir):
+    index_path = str(cache_dir / FONT_INDEX_NAME)
+    font_path = os.path.join(fonts_folder, "FirstFont.ttf")
+    font_file = FontIndex(index_path).find("FirstFont", [fonts_folder])
+    load_ttf_font("FirstFont", font_file)
+
+    # Overwriting a file does not modify its folder
+    shutil.copy(OTHER_FONT, font_path)
+    os.utime(font_path, ns=(font_file["mtime_ns"] + 10**9,) * 2)
+
+    index = FontIndex(index_path)
+    assert index.is_up_to_date(fonts_folder)
+    font_file = index.find("FirstFont", [fonts_folder])
+    assert font_file["size"] == os.path.getsize(OTHER_FONT)
+
+    font = load_ttf_font("FirstFont", font_file)
+    assert font.face.name == TTFont("OtherFont", OTHER_FONT).face.name
+    assert len(os.listdir(cache_dir / "fonts")) == 2
+
+
+def test_parsed_font_is_reused(fonts_folder, cache_dir):
+    font_file = FontIndex(None).find("FirstFont", [fonts_folder])
+
+    parsed_font = load_ttf_font("FirstFont", font_file)
+    assert len(os.listdir(cache_dir / "fonts")) == 1
+
+    cached_font = load_ttf_font("CachedFont", font_file)
+    assert cached_font.fontName == "CachedFont"
+    assert cached_font is not parsed_font
+
+    expected_font = TTFont("ExpectedFont", FONT)
+    for font in (parsed_font, cached_font):
+        assert font.stringWidth("watermark", 12) == expected_font.stringWidth(
+            "watermark", 12
+        )
+        assert font.face.bbox == expected_font.face.bbox
+
+
+@pytest.mark.skipif(not hasattr(os, "getuid"), reason="requires user ids")
+def test_parsed_font_writable_by_others_is_not_loaded(
+    fonts_folder, cache_dir, tmp_path
+):
+    font_file = FontIndex(None).find("FirstFont", [fonts_folder])
+    load_ttf_font("FirstFont", font_file)
+
+    parsed_fonts_folder = cache_dir / "fonts"
+    assert parsed_fonts_folder.stat().st_mode & 0o777 == 0o700
+    (parsed_font_path,) = parsed_fonts_folder.iterdir()
+
+    # Anyone could replace the parsed font, here with the one of another font
+    other_folder = tmp_path / "other"
+    other_folder.mkdir()
+    shutil.copy(OTHER_FONT, other_folder / "OtherFont.ttf")
+    other_font_file = FontIndex(None).find("OtherFont", [str(other_folder)])
+    load_ttf_font("OtherFont", other_font_file)
+    other_parsed_font_path = next(
+        path for path in parsed_fonts_folder.iterdir() if path != parsed_font_path
+    )
+    parsed_font_path.write_bytes(other_parsed_font_path.read_bytes())
+    parsed_font_path.chmod(0o666)
+
+    font = load_ttf_font("FirstFont", font_file)
+    assert font.face.name == TTFont("ExpectedFont", FONT).face.name
@@ -0,0 +1,110 @@
+"""
+Test the computation of the grid layout and the rendering of the grid.
+"""
+
+import os
+from io import BytesIO
+from math import cos, pi, sin
+
+import numpy as np
+import pypdf
+import pytest
+
+from pdf_watermark.draw import draw_watermarks
+from pdf_watermark.handler import add_watermark_to_pdf
+from pdf_watermark.options import DrawingOptions, GridOptions
+from pdf_watermark.utils import change_base, grid_layout
+from tests.utils import assert_pdfs_are_similar
+
+INPUT = "tests/fixtures/input.pdf"
+OUTPUT = "output.pdf"
+
+
+@pytest.fixture
+def cleanup():
+    yield
+    if os.path.exists(OUTPUT):
+        os.remove(OUTPUT)
+
+
+def reference_layout(width, height, horizontal_boxes, vertical_boxes, margin, angle):
+    angle_rad = angle * pi / 180
+    rotation_matrix = np.array(
+        [[cos(angle_rad), -sin(angle_rad)], [sin(angle_rad), cos(angle_rad)]]
+    )
+    horizontal_box_spacing = width / horizontal_boxes
+    vertical_box_spacing = height / vertical_boxes
+    start_index = 1 if margin else 0
+
+    positions = []
+    for x_index in range(start_index, horizontal_boxes + 1):
+        for y_index in range(start_index, vertical_boxes + 1):
+            x_base = x_index * horizontal_box_spacing
+            y_base = y_index * vertical_box_spacing
+            if margin:
+                x_base -= horizontal_box_spacing / 2
+                y_base -= vertical_box_spacing / 2
+            positions.append(change_base(x_base, y_base, rotation_matrix))
+    return positions
+
+
+@pytest.mark.parametrize("margin", [False, True])
+@pytest.mark.parametrize("angle", [0, 45, -30])
+def test_grid_layout_matches_change_base(margin, angle):
+    layout = grid_layout(595.0, 842.0, 3, 6, margin, angle)
+    reference = reference_layout(595.0, 842.0, 3, 6, margin, angle)
+
+    assert np.allclose(layout, reference)
+
+
+def test_grid_layout_is_cached():
+    grid_layout.cache_clear()
+    layout = grid_layout(612.0, 792.0, 40, 80, False, 45)
+
+    assert len(layout) == 41 * 81
+    assert grid_layout(612.0, 792.0, 40, 80, False, 45) is layout
+    assert grid_layout.cache_info().hits == 1
+
+
+@pytest.mark.parametrize(
+    "watermark, fixture",
+    [
+        ("watermark", "tests/fixtures/0.pdf"),
+        (r"watermark\nwith\nline\nbreaks", "tests/fixtures/2.pdf"),
+    ],
+)
+def test_form_rendering(cleanup, watermark, fixture):
+    add_watermark_to_pdf(
+        INPUT,
+        OUTPUT,
+        DrawingOptions(watermark=watermark),
+        GridOptions(rendering="form"),
+    )
+
+    assert_pdfs_are_similar(OUTPUT, fixture)
+
+
+def test_form_rendering_size_does_not_depend_on_density():
+    sizes = []
+    for horizontal_boxes, vertical_boxes in [(3, 6), (40, 80)]:
+        buffer = BytesIO()
+        draw_watermarks(
+            buffer,
+            595,
+            842,
+            DrawingOptions(watermark="watermark"),
+            GridOptions(
+                horizontal_boxes=horizontal_boxes,
+                vertical_boxes=vertical_boxes,
+                rendering="form",
+            ),
+        )
+        page = pypdf.PdfReader(buffer).pages[0]
+        sizes.append(len(page.get_contents().get_data()))
+
+    assert sizes[0] == sizes[1]
+
+
+def test_invalid_rendering():
+    with pytest.raises(ValueError):
+        GridOptions(rendering="pattern")
@@ -0,0 +1,79 @@
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+from reportlab.lib.utils import ImageReader
+
+from pdf_watermark.handler import add_watermark_from_options
+from pdf_watermark.image_utils import PreparedImage, get_target_size, prepare_image
+from pdf_watermark.options import DrawingOptions, FilesOptions, GridOptions
+from tests.utils import assert_pdfs_are_similar
+
+INPUT = "tests/fixtures/input.pdf"
+OUTPUT = "output.pdf"
+REFERENCE = "reference.pdf"
+
+
+@pytest.fixture(autouse=True)
+def cleanup():
+    yield
+    for file in (OUTPUT, REFERENCE):
+        if os.path.exists(file):
+            os.remove(file)
+
+
+@pytest.fixture
+def large_image(tmp_path):
+    # A smooth gradient with transparency, so that the image has a soft mask
+    x, y = np.meshgrid(np.linspace(0, 255, 2000), np.linspace(0, 255, 1500))
+    pixels = np.stack([x, y, 255 - x, np.full_like(x, 200)], axis=-1)
+    path = tmp_path / "large.png"
+    Image.fromarray(pixels.astype(np.uint8), "RGBA").save(path)
+    return str(path)
+
+
+def test_get_target_size():
+    # 144 points at 100 DPI is 200 pixels
+    assert get_target_size((2000, 1000), 144, 72, 100) == (200, 100)
+    # Images are never upsampled
+    assert get_target_size((100, 50), 144, 72, 100) == (100, 50)
+    assert get_target_size((2000, 1000), 144, 72, 0) == (2000, 1000)
+
+
+def test_prepared_images_are_reused(large_image):
+    image = DrawingOptions(watermark=large_image).image
+
+    prepared_image = prepare_image(image, 144, 108, 100)
+    assert (prepared_image.width, prepared_image.height) == (200, 150)
+    assert prepared_image.smask is not None
+    assert prepare_image(image, 144, 108, 100) is prepared_image
+    assert prepare_image(image, 72, 54, 100) is not prepared_image
+
+
+def test_prepared_image_names_depend_on_transparency():
+    transparent = Image.new("RGBA", (10, 10), (0, 0, 0, 0))
+    opaque = Image.new("RGBA", (10, 10), (0, 0, 0, 255))
+    assert (
+        PreparedImage(ImageReader(transparent)).name
+        != PreparedImage(ImageReader(opaque)).name
+    )
+
+
+def test_image_is_downsampled(large_image):
+    for output, image_dpi in ((REFERENCE, 0), (OUTPUT, 300)):
+        add_watermark_from_options(
+            files_options=FilesOptions(INPUT, output),
+            drawing_options=DrawingOptions(
+                watermark=large_image, opacity=0.5, image_dpi=image_dpi
+            ),
+            specific_options=GridOptions(),
+        )
+
+    assert os.path.getsize(OUTPUT) < os.path.getsize(REFERENCE) / 2
+    assert_pdfs_are_similar(OUTPUT, REFERENCE, tolerance=1e-3)
+
+
+def test_invalid_image_dpi():
+    with pytest.raises(ValueError):
+        DrawingOptions(watermark="watermark", image_dpi=-1)
@@ -0,0 +1,81 @@
+"""
+Test the incremental update output mode.
+"""
+
+import os
+import shutil
+
+import pypdf
+import pytest
+
+from pdf_watermark.handler import add_watermark_to_pdf
+from pdf_watermark.options import DrawingOptions, GridOptions
+from tests.utils import assert_pdfs_are_close
+
+INPUT = "tests/fixtures/input.pdf"
+OUTPUT = "output.pdf"
+FIXTURE = "tests/fixtures/0.pdf"
+
+
+@pytest.fixture(autouse=True)
+def cleanup():
+    yield
+    if os.path.exists(OUTPUT):
+        os.remove(OUTPUT)
+
+
+def test_original_bytes_are_kept():
+    add_watermark_to_pdf(
+        INPUT,
+        OUTPUT,
+        DrawingOptions(watermark="watermark", incremental=True),
+        GridOptions(),
+    )
+
+    with open(INPUT, "rb") as f:
+        original = f.read()
+    with open(OUTPUT, "rb") as f:
+        watermarked = f.read()
+
+    assert watermarked.startswith(original)
+    assert len(pypdf.PdfReader(OUTPUT).pages) == len(pypdf.PdfReader(INPUT).pages)
+    assert_pdfs_are_close(OUTPUT, FIXTURE)
+
+
+def test_in_place_update_is_appended():
+    shutil.copyfile(INPUT, OUTPUT)
+    add_watermark_to_pdf(
+        OUTPUT,
+        OUTPUT,
+        DrawingOptions(watermark="watermark", incremental=True),
+        GridOptions(),
+    )
+
+    with open(INPUT, "rb") as f:
+        original = f.read()
+    with open(OUTPUT, "rb") as f:
+        assert f.read().startswith(original)
+    assert_pdfs_are_close(OUTPUT, FIXTURE)
+
+
+def test_update_starts_on_a_new_line():
+    with open(INPUT, "rb") as f:
+        original = f.read().rstrip()
+    with open(OUTPUT, "wb") as f:
+        f.write(original)
+
+    add_watermark_to_pdf(
+        OUTPUT,
+        OUTPUT,
+        DrawingOptions(watermark="watermark", incremental=True),
+        GridOptions(),
+    )
+
+    with open(OUTPUT, "rb") as f:
+        assert f.read().startswith(original + b"\n")
+    assert_pdfs_are_close(OUTPUT, FIXTURE)
+
+
+def test_incremental_with_save_as_image():
+    with pytest.raises(ValueError, match="--incremental"):
+        DrawingOptions(watermark="watermark", incremental=True, save_as_image=True)
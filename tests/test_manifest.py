@@ -0,0 +1,97 @@
+"""
+Test the manifest used to skip files that did not change since the last run.
+"""
+
+import os
+import shutil
+import tempfile
+
+import pytest
+
+import pdf_watermark.handler
+from pdf_watermark.handler import add_watermark_from_options
+from pdf_watermark.manifest import MANIFEST_NAME
+from pdf_watermark.options import DrawingOptions, FilesOptions, GridOptions
+from tests.utils import assert_pdfs_are_close
+
+INPUT = "tests/fixtures/input.pdf"
+FIXTURE = "tests/fixtures/0.pdf"
+
+
+@pytest.fixture
+def processed_files(monkeypatch):
+    processed = []
+    add_watermark_to_pdf = pdf_watermark.handler.add_watermark_to_pdf
+
+    def counting_add_watermark_to_pdf(input, output, *args):
+        processed.append(output)
+        add_watermark_to_pdf(input, output, *args)
+
+    monkeypatch.setattr(
+        pdf_watermark.handler, "add_watermark_to_pdf", counting_add_watermark_to_pdf
+    )
+    return processed
+
+
+def run(file, output=None, workers=1, **drawing_kwargs):
+    add_watermark_from_options(
+        FilesOptions(file, output, workers=workers, manifest=True, verbose=False),
+        DrawingOptions(watermark="watermark", **drawing_kwargs),
+        GridOptions(),
+    )
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_directory(processed_files, workers):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_dir = os.path.join(temp_dir, "input")
+        output_dir = os.path.join(temp_dir, "output")
+        os.makedirs(os.path.join(input_dir, "subdir"))
+        for name in ("a.pdf", "b.pdf", os.path.join("subdir", "c.pdf")):
+            shutil.copyfile(INPUT, os.path.join(input_dir, name))
+
+        run(input_dir, output_dir, workers)
+        assert len(processed_files) == 3
+        assert os.path.isfile(os.path.join(output_dir, MANIFEST_NAME))
+        assert_pdfs_are_close(os.path.join(output_dir, "subdir", "c.pdf"), FIXTURE)
+
+        # Nothing changed
+        processed_files.clear()
+        run(input_dir, output_dir, workers)
+        assert processed_files == []
+
+        # One input changed, and one output was removed
+        with open(os.path.join(input_dir, "a.pdf"), "ab") as f:
+            f.write(b"\n")
+        os.remove(os.path.join(output_dir, "b.pdf"))
+        run(input_dir, output_dir, workers)
+        assert sorted(processed_files) == [
+            os.path.join(output_dir, "a.pdf"),
+            os.path.join(output_dir, "b.pdf"),
+        ]
+
+        # The options changed
+        processed_files.clear()
+        run(input_dir, output_dir, workers, opacity=0.5)
+        assert len(processed_files) == 3
+
+
+def test_overwritten_input(processed_files):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file = os.path.join(temp_dir, "input.pdf")
+        shutil.copyfile(INPUT, file)
+
+        run(file)
+        run(file)
+        assert processed_files == [file]
+        assert_pdfs_are_close(file, FIXTURE)
+
+        # The file was replaced by a new document
+        shutil.copyfile(INPUT, file)
+        run(file)
+        assert processed_files == [file, file]
+
+
+def test_manifest_with_stdio():
+    with pytest.raises(ValueError):
+        FilesOptions("-", manifest=True)
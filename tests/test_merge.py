@@ -0,0 +1,68 @@
+"""
+Test watermarking documents that already hold a watermark.
+"""
+
+import os
+import shutil
+
+import pypdf
+import pytest
+
+from pdf_watermark.handler import add_watermark_from_options, add_watermark_to_pdf
+from pdf_watermark.options import DrawingOptions, FilesOptions, GridOptions
+
+INPUT = "tests/fixtures/input.pdf"
+OUTPUT = "output.pdf"
+
+
+@pytest.fixture(autouse=True)
+def cleanup():
+    yield
+    if os.path.exists(OUTPUT):
+        os.remove(OUTPUT)
+
+
+def test_xobject_stamps_are_kept():
+    shutil.copyfile(INPUT, OUTPUT)
+    for watermark in ("AAAA", "BBBB"):
+        add_watermark_to_pdf(
+            OUTPUT,
+            OUTPUT,
+            DrawingOptions(watermark=watermark, merge_mode="xobject"),
+            GridOptions(),
+        )
+
+    page = pypdf.PdfReader(OUTPUT).pages[0]
+    assert len(page["/Resources"]["/XObject"]) == 2
+    text = page.extract_text()
+    assert "AAAA" in text
+    assert "BBBB" in text
+
+
+def test_page_parallel_stamp_resources_are_kept():
+    shutil.copyfile(INPUT, OUTPUT)
+    for watermark, opacity, font in (
+        ("AAAA", 0.9, "Helvetica"),
+        ("BBBB", 0.1, "Times-Roman"),
+    ):
+        add_watermark_from_options(
+            files_options=FilesOptions(OUTPUT, workers=2, page_parallel_threshold=1),
+            drawing_options=DrawingOptions(
+                watermark=watermark, opacity=opacity, text_font=font
+            ),
+            specific_options=GridOptions(),
+        )
+
+    page = pypdf.PdfReader(OUTPUT).pages[0]
+    resources = page["/Resources"]
+    opacities = {
+        float(state.get_object()["/ca"])
+        for state in resources["/ExtGState"].values()
+        if "/ca" in state.get_object()
+    }
+    assert {0.9, 0.1} <= opacities
+    fonts = {font.get_object()["/BaseFont"] for font in resources["/Font"].values()}
+    assert {"/Helvetica", "/Times-Roman"} <= fonts
+    text = page.extract_text()
+    assert "AAAA" in text
+    assert "BBBB" in text
@@ -0,0 +1,69 @@
+import os
+
+import pypdf
+import pytest
+
+from pdf_watermark.handler import add_watermark_from_options
+from pdf_watermark.options import DrawingOptions, FilesOptions, GridOptions
+from tests.utils import assert_pdfs_are_similar
+
+INPUT = "tests/fixtures/input.pdf"
+OUTPUT = "output.pdf"
+REFERENCE = "reference.pdf"
+
+
+@pytest.fixture(autouse=True)
+def cleanup():
+    yield
+    for file in (OUTPUT, REFERENCE):
+        if os.path.exists(file):
+            os.remove(file)
+
+
+@pytest.mark.parametrize(
+    "text, font, custom_fonts_folder",
+    [
+        # Type 1 fonts, including accented characters built from two glyphs
+        ("watermark", "Helvetica", None),
+        ("café\\nÉlève", "Times-Roman", None),
+        # TrueType fonts, including composite glyphs
+        ("watermark", "TestFont", "tests/fonts"),
+        ("Àccénts", "Vera", None),
+    ],
+)
+def test_outlines_look_like_text(text, font, custom_fonts_folder):
+    for output, unselectable in ((REFERENCE, False), (OUTPUT, True)):
+        add_watermark_from_options(
+            files_options=FilesOptions(INPUT, output),
+            drawing_options=DrawingOptions(
+                watermark=text,
+                text_font=font,
+                text_size=40,
+                opacity=1,
+                unselectable=unselectable,
+                unselectable_mode="outlines",
+                custom_fonts_folder=custom_fonts_folder,
+            ),
+            specific_options=GridOptions(),
+        )
+
+    assert_pdfs_are_similar(OUTPUT, REFERENCE, tolerance=3e-2)
+
+    # The watermark is the only text of the fixture
+    assert text.split("\\n")[0] in pypdf.PdfReader(REFERENCE).pages[0].extract_text()
+    assert text.split("\\n")[0] not in pypdf.PdfReader(OUTPUT).pages[0].extract_text()
+
+
+def test_cid_fonts_have_no_outlines():
+    with pytest.raises(ValueError):
+        DrawingOptions(
+            watermark="watermark",
+            text_font="HeiseiMin-W3",
+            unselectable=True,
+            unselectable_mode="outlines",
+        )
+
+
+def test_invalid_unselectable_mode():
+    with pytest.raises(ValueError):
+        DrawingOptions(watermark="watermark", unselectable_mode="invalid")
@@ -0,0 +1,89 @@
+"""
+Test the timing of the watermarking phases.
+"""
+
+import json
+import os
+
+import pytest
+
+from pdf_watermark import add_timing_hook, remove_timing_hook
+from pdf_watermark.handler import add_watermark_from_options, add_watermark_to_pdf
+from pdf_watermark.options import DrawingOptions, FilesOptions, GridOptions
+from pdf_watermark.profiling import PHASES, record_timings
+
+INPUT = "tests/fixtures/input.pdf"
+OUTPUT = "output.pdf"
+PROFILE = "profile.json"
+
+
+@pytest.fixture(autouse=True)
+def cleanup():
+    yield
+    for file in (OUTPUT, PROFILE):
+        if os.path.exists(file):
+            os.remove(file)
+
+
+def test_timing_hook():
+    calls = []
+
+    def hook(phase, duration):
+        calls.append(phase)
+        assert duration >= 0
+
+    add_timing_hook(hook)
+    try:
+        add_watermark_to_pdf(
+            INPUT, OUTPUT, DrawingOptions(watermark="timing hook"), GridOptions()
+        )
+    finally:
+        remove_timing_hook(hook)
+
+    assert {"parse", "draw", "merge", "write"} <= set(calls)
+
+
+def test_record_timings():
+    with record_timings() as timings:
+        add_watermark_to_pdf(
+            INPUT,
+            OUTPUT,
+            DrawingOptions(watermark="record timings", save_as_image=True, dpi=50),
+            GridOptions(),
+        )
+
+    assert set(timings) == set(PHASES) | {"total"}
+    assert timings["total"] >= sum(timings[phase] for phase in PHASES)
+
+
+@pytest.mark.parametrize(
+    "workers, executor", [(1, "serial"), (2, "thread"), (2, "process")]
+)
+def test_profile_file(workers, executor):
+    add_watermark_from_options(
+        FilesOptions(
+            INPUT,
+            OUTPUT,
+            workers=workers,
+            executor=executor,
+            profile=PROFILE,
+            cprofile=True,
+            verbose=False,
+        ),
+        DrawingOptions(watermark="watermark"),
+        GridOptions(),
+    )
+
+    with open(PROFILE) as f:
+        report = json.load(f)
+
+    assert [file["output"] for file in report["files"]] == [OUTPUT]
+    assert report["files"][0]["timings"]["total"] > 0
+    assert report["aggregate"]["files"] == 1
+    assert set(report["aggregate"]["phases"]) == set(PHASES)
+    assert len(report["cprofile"]) > 0
+
+
+def test_cprofile_requires_profile():
+    with pytest.raises(ValueError):
+        FilesOptions(INPUT, cprofile=True)
@@ -0,0 +1,294 @@
+"""
+Test the rasterization of documents by windows of pages.
+"""
+
+import os
+
+import numpy as np
+import pdf2image
+import pytest
+from pdf2image.exceptions import PDFInfoNotInstalledError, PopplerNotInstalledError
+from PIL import Image
+
+from pdf_watermark.handler import add_watermark_to_pdf
+from pdf_watermark.image_utils import RasterEncoder, is_photographic
+from pdf_watermark.options import DrawingOptions, GridOptions
+from pdf_watermark.utils import (
+    MEGABYTE,
+    encode_page_images,
+    get_page_windows,
+    get_window_workers,
+    images_to_pdf,
+)
+from tests.utils import assert_pdfs_are_close, assert_pdfs_are_similar
+
+INPUT = "tests/fixtures/different_sizes_input.pdf"
+OUTPUT = "output.pdf"
+REFERENCE = "reference.pdf"
+
+
+@pytest.fixture(autouse=True)
+def cleanup():
+    yield
+    for file in (OUTPUT, REFERENCE):
+        if os.path.exists(file):
+            os.remove(file)
+
+
+def test_get_page_windows():
+    # At 72 DPI, a 10 x 10 points page takes 400 bytes
+    page_sizes = [(10, 10)] * 5
+    assert list(get_page_windows(page_sizes, 72, 1200)) == [(1, 3), (4, 5)]
+    assert list(get_page_windows(page_sizes, 72, 10**6)) == [(1, 5)]
+
+    # Pages larger than the limit are rasterized alone
+    assert list(get_page_windows([(10, 10), (100, 100), (10, 10)], 72, 1000)) == [
+        (1, 1),
+        (2, 2),
+        (3, 3),
+    ]
+    assert list(get_page_windows([], 72, 1000)) == []
+
+
+def test_get_page_windows_with_pages_in_flight():
+    # The memory of the pages still encoded is taken out of the windows
+    page_sizes = [(10, 10)] * 5
+    assert list(get_page_windows(page_sizes, 72, 2000, pages_in_flight=2)) == [
+        (1, 3),
+        (4, 5),
+    ]
+
+    # They are counted as the largest page
+    page_sizes = [(10, 10)] * 3 + [(20, 20)]
+    assert list(get_page_windows(page_sizes, 72, 2800, pages_in_flight=1)) == [
+        (1, 3),
+        (4, 4),
+    ]
+
+    # A window always holds at least one page
+    assert list(get_page_windows(page_sizes, 72, 1000, pages_in_flight=4)) == [
+        (1, 1),
+        (2, 2),
+        (3, 3),
+        (4, 4),
+    ]
+
+
+def test_save_as_image_by_windows(monkeypatch):
+    windows = []
+    convert_from_path = pdf2image.convert_from_path
+
+    def record_window(*args, first_page=None, last_page=None, **kwargs):
+        windows.append((first_page, last_page))
+        return convert_from_path(
+            *args, first_page=first_page, last_page=last_page, **kwargs
+        )
+
+    add_watermark_to_pdf(
+        INPUT,
+        REFERENCE,
+        DrawingOptions(watermark="watermark", save_as_image=True, dpi=50),
+        GridOptions(),
+    )
+
+    monkeypatch.setattr(pdf2image, "convert_from_path", record_window)
+    add_watermark_to_pdf(
+        INPUT,
+        OUTPUT,
+        DrawingOptions(
+            watermark="watermark",
+            save_as_image=True,
+            dpi=50,
+            max_raster_memory=7,
+            raster_workers=1,
+        ),
+        GridOptions(),
+    )
+
+    # At 50 DPI, the largest page takes 3.7 MB and is counted for the page still encoded while the
+    # next window is rasterized. The first page does not fit in the 3.3 MB left, the next three do.
+    assert windows == [(1, 1), (2, 4)]
+    assert_pdfs_are_close(OUTPUT, REFERENCE)
+
+
+def test_windows_with_many_cpu_cores():
+    # A4 pages at 300 DPI take 33 MB, so that 64 workers would leave one page per window
+    page_sizes = [(595, 842)] * 100
+    workers = get_window_workers(page_sizes, 300, 512 * MEGABYTE, 64)
+    assert workers == 6
+
+    windows = list(get_page_windows(page_sizes, 300, 512 * MEGABYTE, workers + 1))
+    assert all(
+        last_page - first_page + 1 == 8 for first_page, last_page in windows[:-1]
+    )
+
+
+def test_save_as_image_with_many_cpu_cores(monkeypatch):
+    windows = []
+    convert_from_path = pdf2image.convert_from_path
+
+    def record_window(*args, first_page=None, last_page=None, **kwargs):
+        windows.append((first_page, last_page))
+        return convert_from_path(
+            *args, first_page=first_page, last_page=last_page, **kwargs
+        )
+
+    monkeypatch.setattr(os, "cpu_count", lambda: 64)
+    monkeypatch.setattr(pdf2image, "convert_from_path", record_window)
+    add_watermark_to_pdf(
+        INPUT,
+        OUTPUT,
+        DrawingOptions(
+            watermark="watermark", save_as_image=True, dpi=50, max_raster_memory=16
+        ),
+        GridOptions(),
+    )
+
+    # The pages are rasterized together, instead of one at a time for 65 pages in flight
+    assert windows == [(1, 4)]
+
+
+def test_save_as_image_does_not_parse_the_output(monkeypatch):
+    add_watermark_to_pdf(
+        INPUT,
+        REFERENCE,
+        DrawingOptions(watermark="watermark", save_as_image=True, dpi=50),
+        GridOptions(),
+    )
+
+    def no_parsing(*args, **kwargs):
+        raise AssertionError("Page sizes should be reused.")
+
+    monkeypatch.setattr("pdf_watermark.utils.get_page_sizes", no_parsing)
+    with open(OUTPUT, "wb") as f:
+        add_watermark_to_pdf(
+            INPUT,
+            f,
+            DrawingOptions(watermark="watermark", save_as_image=True, dpi=50),
+            GridOptions(),
+        )
+
+    assert_pdfs_are_close(OUTPUT, REFERENCE)
+
+
+@pytest.mark.parametrize("error", [PDFInfoNotInstalledError, PopplerNotInstalledError])
+def test_save_as_image_without_poppler(monkeypatch, capsys, error):
+    add_watermark_to_pdf(
+        INPUT, REFERENCE, DrawingOptions(watermark="watermark"), GridOptions()
+    )
+
+    def not_installed(*args, **kwargs):
+        raise error()
+
+    # The document is written as vectors instead
+    monkeypatch.setattr(pdf2image, "convert_from_path", not_installed)
+    add_watermark_to_pdf(
+        INPUT,
+        OUTPUT,
+        DrawingOptions(watermark="watermark", save_as_image=True, dpi=50),
+        GridOptions(),
+    )
+
+    assert_pdfs_are_close(OUTPUT, REFERENCE)
+    # The warning does not end up in documents written to the standard output
+    captured = capsys.readouterr()
+    assert captured.out == ""
+    assert "poppler" in captured.err
+
+
+def test_encode_page_images_keeps_order():
+    images = [Image.new("RGBA", (width, 10)) for width in range(1, 20)]
+    encoded_images = encode_page_images(iter(images), workers=4)
+    assert [image.width for image in encoded_images] == list(range(1, 20))
+
+
+def test_parallel_save_as_image():
+    for output, raster_workers in ((REFERENCE, 1), (OUTPUT, 3)):
+        add_watermark_to_pdf(
+            INPUT,
+            output,
+            DrawingOptions(
+                watermark="watermark",
+                save_as_image=True,
+                dpi=50,
+                raster_workers=raster_workers,
+            ),
+            GridOptions(),
+        )
+
+    assert_pdfs_are_close(OUTPUT, REFERENCE)
+
+
+def test_invalid_max_raster_memory():
+    with pytest.raises(ValueError):
+        DrawingOptions(watermark="watermark", max_raster_memory=0)
+
+
+def test_invalid_raster_workers():
+    with pytest.raises(ValueError):
+        DrawingOptions(watermark="watermark", raster_workers=0)
+
+
+def page_images():
+    x, y = np.meshgrid(np.arange(200), np.arange(300))
+    gradient = np.stack([x, y, 255 - x, 128 + x // 2], axis=-1).astype(np.uint8)
+    # Few colors and a transparent background
+    palette = np.zeros((300, 200, 4), dtype=np.uint8)
+    palette[50:100] = (255, 0, 0, 255)
+    palette[150:200, 50:150] = (0, 0, 255, 128)
+    # No color
+    gray = np.repeat((x + y) % 256, 3).reshape(300, 200, 3).astype(np.uint8)
+    return [
+        Image.fromarray(gradient, "RGBA"),
+        Image.fromarray(palette, "RGBA"),
+        Image.fromarray(gray, "RGB"),
+    ]
+
+
+@pytest.mark.parametrize("encoding", ["png", "flate"])
+def test_lossless_raster_encodings(encoding):
+    page_sizes = [(200, 300)] * 3
+    images_to_pdf(page_images(), page_sizes, REFERENCE)
+    images_to_pdf(page_images(), page_sizes, OUTPUT, encoder=RasterEncoder(encoding))
+    assert_pdfs_are_close(OUTPUT, REFERENCE)
+
+
+def test_jpeg_raster_encoding():
+    page_sizes = [(200, 300)] * 3
+    images_to_pdf(page_images(), page_sizes, REFERENCE)
+    images_to_pdf(
+        page_images(), page_sizes, OUTPUT, encoder=RasterEncoder("jpeg", quality=95)
+    )
+    assert_pdfs_are_similar(OUTPUT, REFERENCE, tolerance=1e-2)
+
+
+def test_encoded_colors_are_reduced():
+    gradient, palette, gray = page_images()
+    encoder = RasterEncoder("png")
+
+    assert encoder.encode(gradient).xobject.colorSpace == "DeviceRGB"
+    assert encoder.encode(palette).xobject.palette is not None
+    assert encoder.encode(palette).smask is not None
+    assert encoder.encode(gray).xobject.colorSpace == "DeviceGray"
+    assert encoder.encode(gray).smask is None
+
+
+def test_is_photographic():
+    rng = np.random.default_rng(0)
+    noise = rng.integers(0, 256, (300, 200, 3), dtype=np.uint8)
+    assert is_photographic(Image.fromarray(noise, "RGB"))
+    assert not is_photographic(page_images()[1])
+
+    # Photographic pages are encoded as JPEG by the auto encoding
+    encoder = RasterEncoder("auto")
+    assert encoder.encode(Image.fromarray(noise, "RGB")).xobject._filters == (
+        "DCTDecode",
+    )
+    assert encoder.encode(page_images()[1]).xobject._filters == ("FlateDecode",)
+
+
+def test_invalid_raster_encoding():
+    with pytest.raises(ValueError):
+        DrawingOptions(watermark="watermark", raster_encoding="gif")
+    with pytest.raises(ValueError):
+        DrawingOptions(watermark="watermark", raster_quality=0)
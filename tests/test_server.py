@@ -0,0 +1,161 @@
+"""
+Test the watermark server.
+"""
+
+import http.client
+import os
+import socket
+import sys
+import tempfile
+import threading
+
+import pytest
+
+from pdf_watermark.options import ServerOptions
+from pdf_watermark.server import create_server, get_options
+from tests.utils import assert_pdfs_are_close
+
+INPUT = "tests/fixtures/input.pdf"
+OUTPUT = "output.pdf"
+GRID_FIXTURE = "tests/fixtures/0.pdf"
+INSERT_FIXTURE = "tests/fixtures/1.pdf"
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str):
+        super().__init__("localhost")
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+@pytest.fixture(autouse=True)
+def cleanup():
+    yield
+    if os.path.exists(OUTPUT):
+        os.remove(OUTPUT)
+
+
+@pytest.fixture
+def server():
+    server = create_server(ServerOptions(port=0, max_concurrency=2, verbose=False))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def post(connection: http.client.HTTPConnection, path: str):
+    with open(INPUT, "rb") as f:
+        connection.request("POST", path, body=f.read())
+    response = connection.getresponse()
+    return response.status, response.read()
+
+
+@pytest.mark.parametrize(
+    "path, fixture",
+    [
+        ("/grid?watermark=watermark", GRID_FIXTURE),
+        ("/insert?watermark=watermark", INSERT_FIXTURE),
+    ],
+)
+def test_watermark_request(server, path, fixture):
+    connection = http.client.HTTPConnection("127.0.0.1", server.server_port)
+    status, body = post(connection, path)
+
+    assert status == 200
+    with open(OUTPUT, "wb") as f:
+        f.write(body)
+    assert_pdfs_are_close(OUTPUT, fixture)
+
+
+def test_invalid_requests(server):
+    connection = http.client.HTTPConnection("127.0.0.1", server.server_port)
+
+    assert post(connection, "/grid")[0] == 400
+    assert post(connection, "/grid?watermark=watermark&opacity=high")[0] == 400
+    assert post(connection, "/unknown?watermark=watermark")[0] == 404
+
+
+def test_request_size_is_limited():
+    server = create_server(ServerOptions(port=0, max_request_size=1, verbose=False))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        connection = http.client.HTTPConnection("127.0.0.1", server.server_port)
+        assert post(connection, "/grid?watermark=watermark")[0] == 200
+
+        # The body is rejected before being read
+        connection = http.client.HTTPConnection("127.0.0.1", server.server_port)
+        connection.putrequest("POST", "/grid?watermark=watermark")
+        connection.putheader("Content-Length", str(2 * 1024 * 1024))
+        connection.endheaders()
+        assert connection.getresponse().status == 413
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize(
+    "parameters",
+    [
+        "custom-fonts-folder=tests/fonts&text-font=TestFont",
+        "custom_fonts_folder=tests/fonts&text-font=TestFont",
+        "persistent-stamp-cache=true",
+    ],
+)
+def test_server_paths_are_rejected(server, parameters):
+    connection = http.client.HTTPConnection("127.0.0.1", server.server_port)
+    assert post(connection, f"/grid?watermark=watermark&{parameters}")[0] == 400
+
+
+@pytest.mark.parametrize(
+    "font",
+    ["/usr/share/fonts/Font.ttf", "..%2Ftests%2Ffonts%2FTestFont", "TestFont.ttf"],
+)
+def test_font_files_are_rejected(server, font):
+    connection = http.client.HTTPConnection("127.0.0.1", server.server_port)
+    assert post(connection, f"/grid?watermark=watermark&text-font={font}")[0] == 400
+
+
+def test_errors_do_not_disclose_server_paths(server):
+    connection = http.client.HTTPConnection("127.0.0.1", server.server_port)
+    status, body = post(connection, "/grid?watermark=watermark&text-font=Unknown")
+
+    assert status == 400
+    assert body == b"Invalid options.\n"
+
+
+def test_image_watermarks_are_rejected(server):
+    connection = http.client.HTTPConnection("127.0.0.1", server.server_port)
+    assert post(connection, "/grid?watermark=images/image.png")[0] == 400
+
+
+def test_options_are_reused():
+    parameters = (("horizontal-boxes", "4"), ("watermark", "watermark"))
+    drawing_options, grid_options = get_options("/grid", parameters)
+
+    assert grid_options.horizontal_boxes == 4
+    assert get_options("/grid", parameters)[0] is drawing_options
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Unix sockets only")
+def test_unix_socket():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "watermark.sock")
+        server = create_server(ServerOptions(socket=path, verbose=False))
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            status, body = post(UnixHTTPConnection(path), "/grid?watermark=watermark")
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    assert status == 200
+    with open(OUTPUT, "wb") as f:
+        f.write(body)
+    assert_pdfs_are_close(OUTPUT, GRID_FIXTURE)
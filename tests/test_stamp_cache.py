@@ -0,0 +1,178 @@
+"""
+Test the cache of rendered watermark stamps shared across files.
+"""
+
+import os
+import threading
+import time
+
+import pytest
+
+import pdf_watermark.handler
+from pdf_watermark.cache import (
+    CACHE_DIR_ENV,
+    RASTER_STAMPS_FOLDER,
+    STAMP_CACHE,
+    StampCache,
+    options_fingerprint,
+)
+from pdf_watermark.handler import add_watermark_to_pdf
+from pdf_watermark.options import DrawingOptions, GridOptions, InsertOptions
+
+INPUT = "tests/fixtures/different_sizes_input.pdf"
+OUTPUT = "output.pdf"
+
+
+@pytest.fixture(autouse=True)
+def cleanup():
+    STAMP_CACHE.clear()
+    yield
+    STAMP_CACHE.clear()
+    if os.path.exists(OUTPUT):
+        os.remove(OUTPUT)
+
+
+def test_lru_eviction():
+    cache = StampCache(max_size=2)
+    cache.put("a", b"a")
+    cache.put("b", b"b")
+    assert cache.get("a") == b"a"
+
+    cache.put("c", b"c")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"a"
+    assert cache.get("c") == b"c"
+    assert len(cache) == 2
+
+
+def test_options_fingerprint():
+    drawing_options = DrawingOptions(watermark="watermark")
+
+    assert options_fingerprint(drawing_options, GridOptions()) == options_fingerprint(
+        DrawingOptions(watermark="watermark"), GridOptions()
+    )
+    assert options_fingerprint(drawing_options, GridOptions()) != options_fingerprint(
+        drawing_options, GridOptions(horizontal_boxes=4)
+    )
+    assert options_fingerprint(drawing_options, GridOptions()) != options_fingerprint(
+        drawing_options, InsertOptions()
+    )
+    assert options_fingerprint(drawing_options) == options_fingerprint(
+        DrawingOptions(watermark="watermark", merge_mode="xobject")
+    )
+    assert options_fingerprint(drawing_options) != options_fingerprint(
+        DrawingOptions(watermark="watermark", save_as_image=True)
+    )
+
+
+def test_unselectable_stamps_are_not_shared_with_save_as_image(monkeypatch):
+    monkeypatch.setattr(
+        pdf_watermark.handler,
+        "convert_bytes_to_images",
+        lambda stamp, dpi, **kwargs: b"%PDF-rasterized",
+    )
+
+    # The pages are rasterized as a whole, so the stamp is not
+    vector_stamp = pdf_watermark.handler.get_watermark_stamp(
+        595,
+        842,
+        DrawingOptions(watermark="watermark", unselectable=True, save_as_image=True),
+        GridOptions(),
+    )
+    stamp = pdf_watermark.handler.get_watermark_stamp(
+        595,
+        842,
+        DrawingOptions(watermark="watermark", unselectable=True),
+        GridOptions(),
+    )
+
+    assert vector_stamp != b"%PDF-rasterized"
+    assert stamp == b"%PDF-rasterized"
+
+
+def test_stamps_are_rendered_once_per_page_size(monkeypatch):
+    calls = []
+    render_watermark_stamp = pdf_watermark.handler.render_watermark_stamp
+
+    def counting_render(width, height, *args):
+        calls.append((width, height))
+        return render_watermark_stamp(width, height, *args)
+
+    monkeypatch.setattr(
+        pdf_watermark.handler, "render_watermark_stamp", counting_render
+    )
+
+    drawing_options = DrawingOptions(watermark="watermark")
+    for _ in range(3):
+        add_watermark_to_pdf(INPUT, OUTPUT, drawing_options, GridOptions())
+
+    assert len(calls) == len(set(calls))
+    assert len(calls) > 1
+
+
+def test_stamps_are_rendered_in_memory(monkeypatch):
+    def no_temporary_files(*args, **kwargs):
+        raise AssertionError("Stamps should not be written to temporary files.")
+
+    monkeypatch.setattr("tempfile.NamedTemporaryFile", no_temporary_files)
+    monkeypatch.setattr("tempfile.mkstemp", no_temporary_files)
+
+    stamp = pdf_watermark.handler.render_watermark_stamp(
+        595, 842, DrawingOptions(watermark="watermark"), GridOptions()
+    )
+    assert stamp.startswith(b"%PDF")
+
+
+def test_stamps_are_created_once_by_concurrent_threads():
+    cache = StampCache()
+    calls = []
+
+    def create():
+        calls.append(None)
+        time.sleep(0.05)
+        return b"stamp"
+
+    threads = [
+        threading.Thread(target=cache.get_or_create, args=("key", create))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert cache.get("key") == b"stamp"
+
+
+@pytest.mark.parametrize("rasterized_stamp", [b"%PDF-rasterized", None])
+def test_rasterized_stamps_are_persisted(tmp_path, monkeypatch, rasterized_stamp):
+    monkeypatch.setenv(CACHE_DIR_ENV, str(tmp_path))
+    calls = []
+
+    def fake_rasterization(stamp, dpi, **kwargs):
+        calls.append(dpi)
+        return rasterized_stamp
+
+    monkeypatch.setattr(
+        pdf_watermark.handler, "convert_bytes_to_images", fake_rasterization
+    )
+
+    drawing_options = DrawingOptions(
+        watermark="watermark", unselectable=True, persistent_stamp_cache=True
+    )
+    for _ in range(2):
+        # Each run starts with an empty memory cache
+        STAMP_CACHE.clear()
+        stamp = pdf_watermark.handler.get_watermark_stamp(
+            595, 842, drawing_options, GridOptions()
+        )
+
+    if rasterized_stamp is None:
+        # Stamps drawn without poppler are not stored
+        assert len(calls) == 2
+        assert not os.path.exists(tmp_path / RASTER_STAMPS_FOLDER)
+    else:
+        assert len(calls) == 1
+        assert stamp == rasterized_stamp
+        assert len(os.listdir(tmp_path / RASTER_STAMPS_FOLDER)) == 1
@@ -0,0 +1,68 @@
+"""
+Test that the command line interface starts without loading the libraries it does not need.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+HEAVY_MODULES = ["numpy", "pdf2image", "PIL", "pypdf", "reportlab"]
+
+SCRIPT = """
+import json, sys
+from pdf_watermark.watermark import cli
+try:
+    cli(sys.argv[1:])
+except SystemExit:
+    pass
+print(json.dumps(sorted(sys.modules)))
+"""
+
+
+def run_python(script: str, *args: str) -> str:
+    # The package may only be importable through the test path configuration
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)}
+    completed = subprocess.run(
+        [sys.executable, "-c", script, *args],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=env,
+    )
+    return completed.stdout
+
+
+def get_loaded_modules(*args: str) -> set:
+    return set(json.loads(run_python(SCRIPT, *args).splitlines()[-1]))
+
+
+def get_loaded_packages(*args: str) -> set:
+    return {module.split(".")[0] for module in get_loaded_modules(*args)}
+
+
+@pytest.mark.parametrize(
+    "args", [["--help"], ["grid", "--help"], ["insert", "--help"], ["serve", "--help"]]
+)
+def test_help_does_not_load_heavy_modules(args):
+    assert get_loaded_packages(*args).isdisjoint(HEAVY_MODULES)
+
+
+def test_dry_run_does_not_load_pdf_libraries():
+    modules = get_loaded_modules(
+        "grid", "tests/fixtures", "watermark", "--dry-run", "--manifest"
+    )
+
+    assert {module.split(".")[0] for module in modules}.isdisjoint(
+        ["numpy", "pdf2image", "pypdf"]
+    )
+    assert "reportlab.pdfgen" not in modules
+
+
+def test_pdf2image_is_only_loaded_for_rasterization():
+    output = run_python(
+        "import sys; import pdf_watermark.handler; print('pdf2image' in sys.modules)"
+    )
+    assert output.strip() == "False"
@@ -3,12 +3,16 @@ Test parallel processing of multiple PDFs.
 """
 
 import os
+import pickle
 from shutil import rmtree
 
+import pypdf
 import pytest
 
-from pdf_watermark.handler import add_watermark_from_options
+import pdf_watermark.handler
+from pdf_watermark.handler import add_watermark_from_options, process_files
 from pdf_watermark.options import DrawingOptions, FilesOptions, GridOptions
+from pdf_watermark.utils import get_page_count
 from tests.utils import assert_pdfs_are_close
 
 INPUT = "tests/fixtures/workers/inputs"
@@ -16,14 +20,16 @@ FIXTURES = "tests/fixtures/workers/outputs"
 OUTPUT = "output"
 
 
-@pytest.fixture(autouse=True)
+@pytest.fixture
 def cleanup():
     yield
     rmtree(OUTPUT)
 
 
-def test_different_page_sizes():
-    files_options = FilesOptions(INPUT, OUTPUT, workers=4)
+@pytest.mark.parametrize("executor", ["process", "thread", "serial"])
+@pytest.mark.usefixtures("cleanup")
+def test_different_page_sizes(executor):
+    files_options = FilesOptions(INPUT, OUTPUT, workers=4, executor=executor)
     add_watermark_from_options(
         files_options=files_options,
         drawing_options=DrawingOptions(watermark="watermark"),
@@ -31,3 +37,59 @@ def test_different_page_sizes():
     )
     for file in files_options.output_files:
         assert_pdfs_are_close(file, os.path.join(FIXTURES, os.path.basename(file)))
+
+
+def test_files_are_submitted_as_workers_become_free(monkeypatch):
+    files_options = FilesOptions(INPUT, OUTPUT, workers=2)
+    input_file = next(iter(files_options))[0]
+    yielded_files = []
+    yielded_files_at_first_call = []
+
+    def files():
+        for _ in range(20):
+            yielded_files.append(None)
+            yield input_file, OUTPUT
+
+    def record_call(*args):
+        yielded_files_at_first_call.append(len(yielded_files))
+
+    monkeypatch.setattr(pdf_watermark.handler, "PENDING_FILES_PER_WORKER", 1)
+    monkeypatch.setattr(pdf_watermark.handler, "add_watermark_to_pdf", record_call)
+    process_files(
+        files(),
+        files_options,
+        DrawingOptions(watermark="watermark"),
+        GridOptions(),
+        None,
+        None,
+    )
+
+    # At most one file per worker is pending, and one more is taken from the scan
+    assert yielded_files_at_first_call[0] <= 3
+    assert len(yielded_files_at_first_call) == 20
+
+
+def test_page_count_does_not_load_the_pages(monkeypatch):
+    input_file = "tests/fixtures/different_sizes_input.pdf"
+    expected_page_count = len(pypdf.PdfReader(input_file).pages)
+
+    def no_loading(*args, **kwargs):
+        raise AssertionError("Pages should not be loaded.")
+
+    # Large files are detected in the main process before each file is submitted
+    monkeypatch.setattr(pypdf.PdfReader, "_flatten", no_loading)
+    assert get_page_count(input_file) == expected_page_count
+
+
+def test_drawing_options_pickle():
+    drawing_options = DrawingOptions(watermark="images/image.png")
+    unpickled = pickle.loads(pickle.dumps(drawing_options))
+
+    assert unpickled.image is not None
+    assert unpickled.image.getSize() == drawing_options.image.getSize()
+    assert unpickled.text_color == drawing_options.text_color
+
+
+def test_invalid_executor():
+    with pytest.raises(ValueError, match="Executor must be"):
+        FilesOptions(INPUT, OUTPUT, executor="gpu")
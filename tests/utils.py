@@ -9,3 +9,14 @@ def assert_pdfs_are_close(path_1: str, path_2: str, epsilon: float = 1e-10):
 
     for im1, im2 in zip(images_1, images_2):
         assert np.sum(np.abs(np.array(im1) - np.array(im2))) < epsilon
+
+
+def assert_pdfs_are_similar(path_1: str, path_2: str, tolerance: float = 1e-4):
+    """Looser version of assert_pdfs_are_close, for PDFs drawn differently that only differ by anti-aliasing."""
+    images_1 = convert_from_path(path_1)
+    images_2 = convert_from_path(path_2)
+
+    assert len(images_1) == len(images_2)
+    for im1, im2 in zip(images_1, images_2):
+        difference = np.abs(np.array(im1, dtype=int) - np.array(im2, dtype=int))
+        assert np.mean(difference) / 255 < tolerance